@@ -1,17 +1,23 @@
 from .base_agent import DeepSeekBaseAgent
-from typing import Dict, List, Any
+from services.http_client import DeepSeekHTTPClient
+from services.response_cache import ResponseCache
+from typing import Dict, List, Optional, Any
 
 
 class DeepSeekBalancingAgent(DeepSeekBaseAgent):
     """基于DeepSeek的平衡协调助手"""
 
-    def __init__(self, agent_id: str, api_key: str, model: str = "deepseek-chat"):
+    def __init__(self, agent_id: str, api_key: str, model: str = "deepseek-chat",
+                 http_client: Optional[DeepSeekHTTPClient] = None,
+                 response_cache: Optional[ResponseCache] = None):
         super().__init__(
             agent_id=agent_id,
             role="协调平衡助手",
             base_weight=1.0,  # 中性权重
             api_key=api_key,
-            model=model
+            model=model,
+            http_client=http_client,
+            response_cache=response_cache
         )
 
         self.coordination_strategies = [
@@ -53,7 +59,8 @@ class DeepSeekBalancingAgent(DeepSeekBaseAgent):
     async def synthesize_responses(self,
                                    learning_response: Dict,
                                    questioning_response: Dict,
-                                   user_context: Dict) -> Dict:
+                                   user_context: Dict,
+                                   use_cache: bool = True) -> Dict:
         """综合学习助手和质疑助手的响应"""
 
         synthesis_prompt = f"""
@@ -82,7 +89,7 @@ class DeepSeekBalancingAgent(DeepSeekBaseAgent):
             "user_context": user_context
         }
 
-        return await self.generate_response(synthesis_prompt, context)
+        return await self.generate_response(synthesis_prompt, context, use_cache=use_cache)
 
     def _assess_response_quality(self, response: str) -> float:
         """评估平衡助手响应质量"""
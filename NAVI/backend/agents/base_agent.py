@@ -1,11 +1,15 @@
 import asyncio
-import aiohttp
 import json
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple
 import numpy as np
 import time
 from abc import ABC, abstractmethod
 
+from services.http_client import DeepSeekHTTPClient, get_default_client
+from services.response_cache import ResponseCache
+from services.circuit_breaker import CircuitOpenError
+from services.history_packer import estimate_message_tokens, pack_messages
+
 
 class DeepSeekBaseAgent(ABC):
     """基于DeepSeek的智能体基类"""
@@ -16,7 +20,9 @@ class DeepSeekBaseAgent(ABC):
                  base_weight: float,
                  api_key: str,
                  base_url: str = "https://api.deepseek.com",
-                 model: str = "deepseek-chat"):
+                 model: str = "deepseek-chat",
+                 http_client: Optional[DeepSeekHTTPClient] = None,
+                 response_cache: Optional[ResponseCache] = None):
 
         self.agent_id = agent_id
         self.role = role
@@ -26,6 +32,12 @@ class DeepSeekBaseAgent(ABC):
         self.base_url = base_url
         self.model = model
 
+        # 共享连接池（未注入时使用进程内的默认连接池，由应用关闭时统一关闭）
+        self.http_client = http_client or get_default_client()
+
+        # 响应缓存（可选，多个智能体可共享）
+        self.response_cache = response_cache
+
         # 智能体个性配置
         self.system_prompt = self._create_system_prompt()
         self.conversation_history = []
@@ -35,14 +47,16 @@ class DeepSeekBaseAgent(ABC):
         self.api_call_count = 0
         self.total_tokens = 0
         self.last_response_time = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     @abstractmethod
     def _create_system_prompt(self) -> str:
         """创建系统提示词（子类必须重写）"""
         pass
 
-    async def call_deepseek_api(self, messages: List[Dict]) -> Dict:
-        """调用DeepSeek API"""
+    def _build_request(self, messages: List[Dict], stream: bool = False):
+        """构建API请求的URL、请求头和请求体"""
         url = f"{self.base_url}/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -54,27 +68,96 @@ class DeepSeekBaseAgent(ABC):
             "messages": messages,
             "temperature": self._get_temperature(),
             "max_tokens": self._get_max_tokens(),
-            "stream": False
+            "stream": stream
         }
+        if stream:
+            # 让最后一个数据块携带token用量
+            payload["stream_options"] = {"include_usage": True}
+
+        return url, headers, payload
 
+    def _cache_key(self, messages: List[Dict]) -> str:
+        return self.response_cache.make_key(self.agent_id, self.model, self._get_temperature(), messages)
+
+    def _cache_lookup(self, messages: List[Dict], use_cache: bool) -> Optional[Dict]:
+        """查询响应缓存，并记录命中/未命中"""
+        if not use_cache or self.response_cache is None:
+            return None
+
+        cached = self.response_cache.get(self._cache_key(messages))
+        if cached is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+        return cached
+
+    def _stale_lookup(self, messages: List[Dict], use_cache: bool) -> Optional[Dict]:
+        """上游熔断时读取已过期但仍在内存中的缓存响应"""
+        if not use_cache or self.response_cache is None:
+            return None
+        return self.response_cache.get(self._cache_key(messages), allow_stale=True)
+
+    def _cache_store(self, messages: List[Dict], data: Dict, use_cache: bool):
+        if use_cache and self.response_cache is not None:
+            self.response_cache.set(self._cache_key(messages), data)
+
+    async def call_deepseek_api(self, messages: List[Dict], use_cache: bool = True) -> Dict:
+        """调用DeepSeek API
+
+        Args:
+            messages: 消息列表
+            use_cache: 是否使用响应缓存（个性化提示词应传入False）
+        """
         start_time = time.time()
 
+        cached = self._cache_lookup(messages, use_cache)
+        if cached is not None:
+            self.last_response_time = time.time() - start_time
+            return cached
+
+        url, headers, payload = self._build_request(messages)
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self.api_call_count += 1
-                        self.total_tokens += data.get('usage', {}).get('total_tokens', 0)
-                        self.last_response_time = time.time() - start_time
-                        return data
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"API调用失败: {response.status} - {error_text}")
+            result = await self.http_client.request_json(url, headers, payload)
+            if result.status == 200:
+                data = result.data
+                self.api_call_count += 1
+                self.total_tokens += data.get('usage', {}).get('total_tokens', 0)
+                self.last_response_time = time.time() - start_time
+                if data.get('choices'):
+                    self._cache_store(messages, data, use_cache)
+                return data
+            else:
+                raise Exception(f"API调用失败: {result.status} - {result.text}")
+        except CircuitOpenError:
+            # 熔断期间不等待超时，直接返回过期缓存或后备响应
+            self.last_response_time = time.time() - start_time
+            return self._stale_lookup(messages, use_cache) or self._get_fallback_response()
         except Exception as e:
             print(f"DeepSeek API调用错误: {e}")
             return self._get_fallback_response()
 
+    async def stream_deepseek_api(self, messages: List[Dict]) -> AsyncIterator[Dict]:
+        """流式调用DeepSeek API，逐个产出SSE数据块"""
+        url, headers, payload = self._build_request(messages, stream=True)
+
+        async with self.http_client.post(url, headers, payload) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"API调用失败: {response.status} - {error_text}")
+
+            async for line in response.content:
+                line = line.decode('utf-8').strip()
+                if not line.startswith('data: '):
+                    continue
+                data_str = line[6:]
+                if data_str == '[DONE]':
+                    break
+                try:
+                    yield json.loads(data_str)
+                except json.JSONDecodeError:
+                    continue
+
     def _get_temperature(self) -> float:
         """根据智能体角色调整温度参数"""
         temperature_map = {
@@ -93,38 +176,134 @@ class DeepSeekBaseAgent(ABC):
         }
         return token_map.get(self.agent_id, 1500)
 
-    async def generate_response(self, user_input: str, context: Dict) -> Dict:
+    def _get_prompt_budget(self) -> int:
+        """根据角色调整提示词（输入）token预算"""
+        budget_map = {
+            "learning_agent": 4000,  # 学习辅导需要较完整的上下文
+            "questioning_agent": 3000,
+            "balancing_agent": 3000,
+        }
+        return budget_map.get(self.agent_id, 3000)
+
+    async def generate_response(self, user_input: str, context: Dict, use_cache: bool = True) -> Dict:
         """生成智能体响应"""
-        messages = self._build_message_sequence(user_input, context)
+        messages, prompt_tokens = self._build_prompt(user_input, context)
 
-        response_data = await self.call_deepseek_api(messages)
+        response_data = await self.call_deepseek_api(messages, use_cache=use_cache)
 
         if 'choices' in response_data and len(response_data['choices']) > 0:
             content = response_data['choices'][0]['message']['content']
-            return self._process_response(content, context)
+            return self._process_response(content, context, prompt_tokens)
         else:
             return self._get_fallback_response()
 
+    async def stream_response(self, user_input: str, context: Dict,
+                              use_cache: bool = True) -> AsyncIterator[Dict]:
+        """流式生成智能体响应
+
+        先逐个产出 {"type": "token", "content": ...}，
+        最后产出 {"type": "done", "response": ...}，其结构与 generate_response 的返回值相同。
+        """
+        messages, prompt_tokens = self._build_prompt(user_input, context)
+
+        cached = self._cache_lookup(messages, use_cache)
+        if cached is not None:
+            content = cached['choices'][0]['message']['content']
+            response = self._process_response(content, context, prompt_tokens)
+            response["metadata"]["cached"] = True
+            yield {"type": "token", "content": content}
+            yield {"type": "done", "response": response}
+            return
+
+        start_time = time.time()
+        first_token_time = None
+        chunks = []
+        usage = {}
+
+        try:
+            async for data in self.stream_deepseek_api(messages):
+                if data.get('usage'):
+                    usage = data['usage']
+                choices = data.get('choices') or []
+                if not choices:
+                    continue
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                    chunks.append(delta)
+                    yield {"type": "token", "content": delta}
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                print(f"DeepSeek 流式API调用错误: {e}")
+            if not chunks:
+                stale = self._stale_lookup(messages, use_cache) if isinstance(e, CircuitOpenError) else None
+                if stale is not None:
+                    content = stale['choices'][0]['message']['content']
+                    response = self._process_response(content, context, prompt_tokens)
+                    response["metadata"]["cached"] = True
+                    yield {"type": "token", "content": content}
+                    yield {"type": "done", "response": response}
+                    return
+                fallback = self._get_fallback_response()
+                yield {"type": "token", "content": fallback["content"]}
+                yield {"type": "done", "response": fallback}
+                return
+
+        self.api_call_count += 1
+        self.total_tokens += usage.get('total_tokens', 0)
+        self.last_response_time = time.time() - start_time
+
+        content = "".join(chunks)
+        self._cache_store(messages, {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": usage
+        }, use_cache)
+
+        response = self._process_response(content, context, prompt_tokens)
+        response["metadata"]["tokens_used"] = usage.get('total_tokens', 0)
+        response["metadata"]["time_to_first_token"] = first_token_time
+        yield {"type": "done", "response": response}
+
     def _build_message_sequence(self, user_input: str, context: Dict) -> List[Dict]:
         """构建消息序列"""
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-        ]
+        return self._build_prompt(user_input, context)[0]
 
-        # 添加上下文信息
-        if context.get('conversation_history'):
-            # 添加最近几轮对话历史
-            history = context['conversation_history'][-3:]  # 最近3轮
-            for turn in history:
-                if isinstance(turn, dict):
-                    messages.append({"role": "user", "content": turn.get('content', '')})
-                    if 'response' in turn:
-                        messages.append({"role": "assistant", "content": turn['response']})
-
-        # 添加当前用户输入
+    def _build_prompt(self, user_input: str, context: Dict) -> Tuple[List[Dict], int]:
+        """构建消息序列，返回 (消息列表, 估算的提示词token数)
+
+        对话历史按智能体的提示词token预算从新到旧装填，超长的单轮对话会被截断。
+        token数随返回值传递而不记在实例上，避免并发请求相互覆盖。
+        """
+        prefix = [{"role": "system", "content": self.system_prompt}]
+
+        # 长会话的滚动摘要以紧凑的系统消息注入
+        if context.get('conversation_summary'):
+            prefix.append({"role": "system", "content": f"此前对话摘要：\n{context['conversation_summary']}"})
+
+        # 当前用户输入
         enhanced_input = self._enhance_user_input(user_input, context)
-        messages.append({"role": "user", "content": enhanced_input})
+        current_message = {"role": "user", "content": enhanced_input}
+
+        fixed_tokens = sum(estimate_message_tokens(m) for m in prefix) + estimate_message_tokens(current_message)
+        history_budget = max(0, self._get_prompt_budget() - fixed_tokens)
 
+        # 添加上下文信息
+        history_messages = self._history_to_messages(context.get('conversation_history') or [])
+        packed_history, history_tokens = pack_messages(
+            history_messages, history_budget, max_message_tokens=history_budget // 2
+        )
+        return prefix + packed_history + [current_message], fixed_tokens + history_tokens
+
+    def _history_to_messages(self, history: List) -> List[Dict]:
+        """将前端的对话历史转换为聊天消息"""
+        messages = []
+        for turn in history:
+            if isinstance(turn, dict):
+                role = "assistant" if turn.get('sender') == 'assistant' else "user"
+                messages.append({"role": role, "content": turn.get('content', '')})
+                if 'response' in turn:
+                    messages.append({"role": "assistant", "content": turn['response']})
         return messages
 
     def _enhance_user_input(self, user_input: str, context: Dict) -> str:
@@ -144,7 +323,7 @@ class DeepSeekBaseAgent(ABC):
 
         return enhanced
 
-    def _process_response(self, raw_response: str, context: Dict) -> Dict:
+    def _process_response(self, raw_response: str, context: Dict, prompt_tokens: int = 0) -> Dict:
         """处理原始API响应"""
         return {
             "agent_id": self.agent_id,
@@ -156,7 +335,8 @@ class DeepSeekBaseAgent(ABC):
                 "tokens_used": context.get('tokens_used', 0),
                 "response_quality": self._assess_response_quality(raw_response),
                 "relevance_score": self._calculate_relevance(raw_response, context),
-                "response_time": self.last_response_time
+                "response_time": self.last_response_time,
+                "prompt_tokens": prompt_tokens
             }
         }
 
@@ -207,5 +387,7 @@ class DeepSeekBaseAgent(ABC):
             "api_call_count": self.api_call_count,
             "total_tokens": self.total_tokens,
             "current_weight": self.current_weight,
-            "avg_response_time": self.last_response_time
+            "avg_response_time": self.last_response_time,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses
         }
\ No newline at end of file
@@ -1,17 +1,23 @@
 from .base_agent import DeepSeekBaseAgent
-from typing import Dict, List
+from services.http_client import DeepSeekHTTPClient
+from services.response_cache import ResponseCache
+from typing import Dict, List, Optional
 
 
 class DeepSeekLearningAgent(DeepSeekBaseAgent):
     """基于DeepSeek的学习助手"""
 
-    def __init__(self, agent_id: str, api_key: str, model: str = "deepseek-chat"):
+    def __init__(self, agent_id: str, api_key: str, model: str = "deepseek-chat",
+                 http_client: Optional[DeepSeekHTTPClient] = None,
+                 response_cache: Optional[ResponseCache] = None):
         super().__init__(
             agent_id=agent_id,
             role="学习辅导助手",
             base_weight=1.618,  # 黄金比例
             api_key=api_key,
-            model=model
+            model=model,
+            http_client=http_client,
+            response_cache=response_cache
         )
 
         self.learning_strategies = [
@@ -65,6 +71,9 @@ class DeepSeekLearningAgent(DeepSeekBaseAgent):
             if 'children' in graph and isinstance(graph['children'], list) and len(graph['children']) > 0:
                 enhanced += f"- 已有知识点: {len(graph['children'])}个"
 
+        if context and context.get('related_notes'):
+            enhanced += f"\n用户已学过的相关笔记：{'、'.join(context['related_notes'])}，可在此基础上讲解"
+
         # 添加学习策略提示
         enhanced += f"\n\n请根据用户当前水平选择合适的教学策略：{', '.join(self.learning_strategies)}"
         enhanced += "\n重点关注概念的深度理解和实际应用。"
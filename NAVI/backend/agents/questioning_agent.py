@@ -1,17 +1,23 @@
 from .base_agent import DeepSeekBaseAgent
-from typing import Dict, List
+from services.http_client import DeepSeekHTTPClient
+from services.response_cache import ResponseCache
+from typing import Dict, List, Optional
 
 
 class DeepSeekQuestioningAgent(DeepSeekBaseAgent):
     """基于DeepSeek的质疑思考助手"""
 
-    def __init__(self, agent_id: str, api_key: str, model: str = "deepseek-chat"):
+    def __init__(self, agent_id: str, api_key: str, model: str = "deepseek-chat",
+                 http_client: Optional[DeepSeekHTTPClient] = None,
+                 response_cache: Optional[ResponseCache] = None):
         super().__init__(
             agent_id=agent_id,
             role="批判思考助手",
             base_weight=1.414,  # 根号2，体现理性思维
             api_key=api_key,
-            model=model
+            model=model,
+            http_client=http_client,
+            response_cache=response_cache
         )
 
         self.questioning_strategies = [
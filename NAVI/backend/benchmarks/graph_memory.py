@@ -0,0 +1,73 @@
+"""知识图谱内存占用基准测试
+
+比较字典形式与紧凑节点形式（services.compact_graph）下每个节点占用的字节数。
+图谱先序列化为JSON再解析，模拟从磁盘加载时字符串互不共享的真实情况。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.graph_memory --sizes 1000 5000
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+from typing import Callable, Dict, List
+
+from services.compact_graph import pack_graph, unpack_graph
+from services.knowledge_service import KnowledgeGraphService
+
+TOPICS = ["递归", "动态规划", "二叉树", "哈希表", "排序算法", "图的遍历", "链表", "栈与队列"]
+
+
+def build_graph(service: KnowledgeGraphService, size: int) -> Dict:
+    """用 add_learning_node 构造包含 size 个学习节点的图谱"""
+    rng = random.Random(42)
+    graph = service.create_default_graph()
+    for i in range(size):
+        topic = rng.choice(TOPICS)
+        question = f"{topic}的第{i % 50}个问题是什么？"
+        learning = f"{topic}是一种重要的概念。" * 20
+        questioning = f"关于{topic}，你是否考虑过它的局限性？" * 8
+        graph = service.add_learning_node(graph, question, learning, questioning, dedupe=False)
+    return graph
+
+
+def measure(factory: Callable[[], object]) -> int:
+    """返回 factory 构造的对象所占用的内存（字节）"""
+    gc.collect()
+    tracemalloc.start()
+    obj = factory()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current
+
+
+def run(sizes: List[int]):
+    print(f"{'nodes':>8} | {'dict B/node':>11} | {'compact B/node':>14} | {'saving':>6} | {'lossless':>8}")
+    print("-" * 62)
+
+    for size in sizes:
+        service = KnowledgeGraphService()
+        raw = json.dumps(build_graph(service, size), ensure_ascii=False)
+        total = size + 3
+
+        dict_bytes = measure(lambda: json.loads(raw))
+        # 解析后的临时字典在打包完成后释放，只计入紧凑节点及其引用的文本
+        compact_bytes = measure(lambda: pack_graph(json.loads(raw)))
+        graph = json.loads(raw)
+        lossless = json.dumps(unpack_graph(pack_graph(graph)), ensure_ascii=False) == raw
+
+        print(f"{size:>8} | {dict_bytes / total:>11.0f} | {compact_bytes / total:>14.0f} | "
+              f"{1 - compact_bytes / dict_bytes:>6.0%} | {str(lossless):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱内存占用基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    args = parser.parse_args()
+    run(args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""知识图谱修改开销基准测试
+
+对比整图JSON深拷贝与写时复制（路径复制）两种方式下，单次插入/更新的
+耗时与内存分配随图谱规模的变化。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.graph_mutation --sizes 100 1000 5000 20000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from services.knowledge_service import KnowledgeGraphService
+
+
+def build_graph(service: KnowledgeGraphService, size: int, fanout: int = 20) -> Dict:
+    """构造约 size 个节点的图谱：学习笔记下按主题分组，每组 fanout 个笔记"""
+    graph = service.create_default_graph()
+    notes = graph["children"][0]
+    topic = None
+    for i in range(size):
+        if i % fanout == 0:
+            topic = {"id": f"topic_{i}", "title": f"主题{i}", "content": "", "type": "manual",
+                     "metadata": {"keywords": [f"主题{i}"]}, "children": []}
+            notes["children"].append(topic)
+        topic["children"].append({
+            "id": f"note_{i}", "title": f"笔记{i}", "content": "递归与栈" * 20, "type": "learning",
+            "metadata": {"keywords": ["递归", f"笔记{i}"]}, "children": []
+        })
+    return graph
+
+
+def deep_copy_insert(graph: Dict, parent_id: str, new_node: Dict) -> Dict:
+    """原实现：整图JSON深拷贝后递归查找插入"""
+    updated = json.loads(json.dumps(graph))
+    stack = [updated]
+    while stack:
+        node = stack.pop()
+        if node["id"] == parent_id:
+            node["children"].append(new_node)
+            break
+        stack.extend(node.get("children", []))
+    return updated
+
+
+def measure(step: Callable[[Dict, int], Dict], graph: Dict, repeat: int) -> Dict:
+    """在最新版本上连续执行 repeat 次修改，返回单次平均耗时与峰值内存分配"""
+    start = time.perf_counter()
+    for i in range(repeat):
+        graph = step(graph, i)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    graph = step(graph, repeat)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"ms": elapsed * 1000, "kb": peak / 1024}
+
+
+def new_note(i: int) -> Dict:
+    return {"id": f"bench_{i}", "title": f"新笔记{i}", "content": "", "type": "learning", "children": []}
+
+
+def run(sizes: List[int], repeat: int):
+    print(f"{'nodes':>8} | {'deepcopy ms':>11} {'KB':>9} | {'cow insert ms':>13} {'KB':>7} | {'cow update ms':>13} {'KB':>7}")
+    print("-" * 82)
+
+    for size in sizes:
+        service = KnowledgeGraphService()
+        graph = build_graph(service, size)
+        parent_id = f"topic_{(size - 1) // 20 * 20}"
+
+        baseline = measure(lambda g, i: deep_copy_insert(g, parent_id, new_note(i)), graph, repeat)
+        insert = measure(lambda g, i: service._insert_node(g, parent_id, new_note(i)), graph, repeat)
+        update = measure(lambda g, i: service.update_node(g, "note_0", {"title": f"改名{i}"}), graph, repeat)
+
+        print(f"{size:>8} | {baseline['ms']:>11.3f} {baseline['kb']:>9.1f} | "
+              f"{insert['ms']:>13.3f} {insert['kb']:>7.1f} | {update['ms']:>13.3f} {update['kb']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱修改开销基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""存储序列化基准测试
+
+比较原有的格式化JSON（indent=2）与 services.serializer 各格式在真实规模图谱上的
+编码、解码耗时和输出大小。未安装的可选依赖（orjson、msgpack、zstandard）对应的
+格式会被跳过。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.serialization --sizes 1000 5000
+"""
+import argparse
+import json
+import time
+from typing import Callable, List
+
+from benchmarks.graph_memory import build_graph
+from services.knowledge_service import KnowledgeGraphService
+from services.serializer import SerializationError, Serializer
+
+FORMATS = [
+    ("json", "none"), ("orjson", "none"), ("msgpack", "none"),
+    ("json", "gzip"), ("json", "zstd"), ("orjson", "zstd"), ("msgpack", "zstd"),
+]
+
+
+def best_of(func: Callable[[], object], repeat: int) -> float:
+    """多次运行取最短耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(sizes: List[int], repeat: int):
+    print(f"{'nodes':>8} | {'format':<16} | {'encode ms':>9} | {'decode ms':>9} | {'KB':>9} | {'size':>5}")
+    print("-" * 70)
+
+    for size in sizes:
+        graph = build_graph(KnowledgeGraphService(), size)
+
+        legacy = json.dumps(graph, ensure_ascii=False, indent=2).encode("utf-8")
+        encode_ms = best_of(lambda: json.dumps(graph, ensure_ascii=False, indent=2).encode("utf-8"), repeat)
+        decode_ms = best_of(lambda: json.loads(legacy), repeat)
+        print(f"{size:>8} | {'json (indent=2)':<16} | {encode_ms:>9.1f} | {decode_ms:>9.1f} | "
+              f"{len(legacy) / 1024:>9.0f} | {1:>5.0%}")
+
+        for codec, compression in FORMATS:
+            try:
+                serializer = Serializer(codec, compression)
+            except SerializationError:
+                continue
+
+            payload = serializer.dumps(graph)
+            assert serializer.loads(payload) == graph
+            encode_ms = best_of(lambda: serializer.dumps(graph), repeat)
+            decode_ms = best_of(lambda: serializer.loads(payload), repeat)
+            print(f"{size:>8} | {serializer.name:<16} | {encode_ms:>9.1f} | {decode_ms:>9.1f} | "
+                  f"{len(payload) / 1024:>9.0f} | {len(payload) / len(legacy):>5.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="存储序列化基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
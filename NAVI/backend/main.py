@@ -18,16 +18,26 @@ from dotenv import load_dotenv
 # 在其他导入之前加载环境变量
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Dict, List, Any, Optional
+import asyncio
+import json
+import time
 import uvicorn
 
 from agents.learning_agent import DeepSeekLearningAgent
 from agents.questioning_agent import DeepSeekQuestioningAgent
 from agents.balancing_agent import DeepSeekBalancingAgent
 from services.knowledge_service import KnowledgeGraphService
+from services.http_client import close_default_client, get_default_client
+from services.response_cache import ResponseCache
+from services.deepseek_service import DeepSeekService
+from services.storage_service import StorageService
+from services.session_summarizer import ConversationSummarizer
+from services.graph_store import KnowledgeGraphStore
 
 app = FastAPI(title="Navi API", version="1.0.0")
 
@@ -43,13 +53,36 @@ app.add_middleware(
 learning_agent = None
 questioning_agent = None
 balancing_agent = None
+http_client = None
+response_cache = None
+summarizer = None
 knowledge_service = KnowledgeGraphService()
+storage_service = StorageService.from_env()
+# 服务端保存的用户知识图谱（内存工作集 + StorageService）
+graph_store = KnowledgeGraphStore.from_env(storage_service, knowledge_service)
+
+
+# user_id / session_id 会成为存储的文件名或键：只允许字母、数字和 _.@-，且以字母或数字开头，
+# 因此不会含有路径分隔符，也不可能是 "." 或 ".."
+STORAGE_KEY_PATTERN = r"^[A-Za-z0-9][A-Za-z0-9_.@-]{0,127}$"
 
 
 class ChatRequest(BaseModel):
     message: str
     context: Optional[List[Dict]] = []
-    knowledge_graph: Optional[Dict] = None
+    knowledge_graph: Optional[Dict] = None  # 旧客户端随请求发送的图谱，提供 user_id 时忽略
+    # 提供时使用服务端保存的该用户知识图谱
+    user_id: Optional[str] = Field(None, pattern=STORAGE_KEY_PATTERN)
+    use_cache: bool = True  # 个性化提示词可关闭响应缓存
+    # 提供时由服务端维护对话历史和滚动摘要
+    session_id: Optional[str] = Field(None, pattern=STORAGE_KEY_PATTERN)
+
+
+class KnowledgePatchRequest(BaseModel):
+    user_id: str = Field("default", pattern=STORAGE_KEY_PATTERN)
+    base_version: Optional[int] = None  # 客户端所基于的图谱版本，为空时不做冲突检测
+    operations: List[Dict] = []  # add/update/move/delete 增量操作
+    graph_data: Optional[Dict] = None  # 整图替换（兼容旧客户端）
 
 
 class ChatResponse(BaseModel):
@@ -58,9 +91,16 @@ class ChatResponse(BaseModel):
     metadata: Optional[Dict] = None
 
 
+class OrchestrateResponse(BaseModel):
+    learning: ChatResponse
+    questioning: ChatResponse
+    synthesis: ChatResponse
+    timings: Dict[str, float]
+
+
 @app.on_event("startup")
 async def startup_event():
-    global learning_agent, questioning_agent, balancing_agent
+    global learning_agent, questioning_agent, balancing_agent, http_client, response_cache, summarizer
 
     # 从环境变量读取API密钥
     api_key = os.getenv("DEEPSEEK_API_KEY")
@@ -71,13 +111,62 @@ async def startup_event():
     else:
         print(f"API Key 加载成功: {api_key[:10]}...")
 
-    learning_agent = DeepSeekLearningAgent("learning_agent", api_key)
-    questioning_agent = DeepSeekQuestioningAgent("questioning_agent", api_key)
-    balancing_agent = DeepSeekBalancingAgent("balancing_agent", api_key)
+    # 所有智能体共享一个长连接池
+    http_client = get_default_client()
+    await http_client.start()
+
+    # 相同问题的响应在智能体之间共享一个缓存
+    response_cache = ResponseCache.from_env()
+
+    agent_options = {"http_client": http_client, "response_cache": response_cache}
+    learning_agent = DeepSeekLearningAgent("learning_agent", api_key, **agent_options)
+    questioning_agent = DeepSeekQuestioningAgent("questioning_agent", api_key, **agent_options)
+    balancing_agent = DeepSeekBalancingAgent("balancing_agent", api_key, **agent_options)
+
+    # 长会话的滚动摘要，使用低 max_tokens 的后台调用
+    summarizer = ConversationSummarizer.from_env(
+        storage_service, DeepSeekService(api_key, http_client=http_client)
+    )
 
     print("所有智能体初始化完成")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if summarizer:
+        await summarizer.wait_pending()
+    if response_cache:
+        response_cache.save()
+    await storage_service.close()
+    await close_default_client()
+    print("连接池已关闭")
+
+
+async def _apply_session(request: ChatRequest, context: Dict):
+    """请求带 session_id 时，用服务端保存的最近对话和滚动摘要替换客户端历史"""
+    if request.session_id and summarizer:
+        context.update(await summarizer.get_context(request.session_id))
+
+
+async def _apply_knowledge_graph(request: ChatRequest, context: Dict):
+    """请求带 user_id 时，使用服务端保存的知识图谱及与问题相关的已有笔记"""
+    if not request.user_id:
+        return
+
+    graph = await graph_store.get(request.user_id)
+    context['knowledge_graph'] = graph
+    context['related_notes'] = [
+        node.get('title', '')
+        for node in knowledge_service.search_nodes(graph, request.message, top_k=5)
+        if node.get('type') != 'system'
+    ][:3]
+
+
+async def _record_turn(request: ChatRequest, response: Optional[Dict]):
+    if request.session_id and summarizer and response and not response.get('metadata', {}).get('is_fallback'):
+        await summarizer.record_turn(request.session_id, request.message, response.get('content', ''))
+
+
 @app.get("/")
 async def root():
     return {"message": "Navi API is running", "status": "healthy"}
@@ -102,15 +191,19 @@ async def learning_chat(request: ChatRequest):
             'conversation_history': request.context,
             'knowledge_graph': request.knowledge_graph
         }
+        await _apply_session(request, context)
+        await _apply_knowledge_graph(request, context)
 
         print(f"[DEBUG] 调用 learning_agent.generate_response...")
-        response = await learning_agent.generate_response(request.message, context)
+        response = await learning_agent.generate_response(request.message, context, use_cache=request.use_cache)
         print(f"[DEBUG] 智能体响应: {response}")
 
         if response is None:
             print("[ERROR] 智能体返回None!")
             raise HTTPException(status_code=500, detail="智能体响应为空")
 
+        await _record_turn(request, response)
+
         return ChatResponse(
             content=response.get('content', '响应内容为空'),
             type="learning",
@@ -131,8 +224,10 @@ async def questioning_chat(request: ChatRequest):
             'conversation_history': request.context,
             'learning_context': request.context
         }
+        await _apply_session(request, context)
 
-        response = await questioning_agent.generate_response(request.message, context)
+        response = await questioning_agent.generate_response(request.message, context, use_cache=request.use_cache)
+        await _record_turn(request, response)
 
         return ChatResponse(
             content=response['content'],
@@ -151,8 +246,10 @@ async def general_chat(request: ChatRequest):
         context = {
             'conversation_history': request.context
         }
+        await _apply_session(request, context)
 
-        response = await balancing_agent.generate_response(request.message, context)
+        response = await balancing_agent.generate_response(request.message, context, use_cache=request.use_cache)
+        await _record_turn(request, response)
 
         return ChatResponse(
             content=response['content'],
@@ -164,24 +261,233 @@ async def general_chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _sse_event(event: str, data: Dict) -> str:
+    """格式化一条Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_agent(agent, request: ChatRequest, context: Dict, response_type: str) -> StreamingResponse:
+    """将智能体的流式输出转发为SSE：token事件逐个转发，done事件携带元数据"""
+
+    async def event_generator():
+        try:
+            async for chunk in agent.stream_response(request.message, context, use_cache=request.use_cache):
+                if chunk["type"] == "token":
+                    yield _sse_event("token", {"content": chunk["content"]})
+                elif chunk["type"] == "done":
+                    response = chunk["response"]
+                    await _record_turn(request, response)
+                    yield _sse_event("done", {
+                        "type": response_type,
+                        "metadata": response.get('metadata', {})
+                    })
+        except Exception as e:
+            print(f"流式API错误: {str(e)}")
+            yield _sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/learning/stream")
+async def learning_chat_stream(request: ChatRequest):
+    if learning_agent is None:
+        raise HTTPException(status_code=500, detail="学习智能体未初始化")
+
+    context = {
+        'conversation_history': request.context,
+        'knowledge_graph': request.knowledge_graph
+    }
+    await _apply_session(request, context)
+    await _apply_knowledge_graph(request, context)
+    return _stream_agent(learning_agent, request, context, "learning")
+
+
+@app.post("/api/questioning/stream")
+async def questioning_chat_stream(request: ChatRequest):
+    if questioning_agent is None:
+        raise HTTPException(status_code=500, detail="质疑智能体未初始化")
+
+    context = {
+        'conversation_history': request.context,
+        'learning_context': request.context
+    }
+    await _apply_session(request, context)
+    return _stream_agent(questioning_agent, request, context, "questioning")
+
+
+@app.post("/api/chat/stream")
+async def general_chat_stream(request: ChatRequest):
+    if balancing_agent is None:
+        raise HTTPException(status_code=500, detail="平衡智能体未初始化")
+
+    context = {
+        'conversation_history': request.context
+    }
+    await _apply_session(request, context)
+    return _stream_agent(balancing_agent, request, context, "chat")
+
+
+@app.post("/api/orchestrate", response_model=OrchestrateResponse)
+async def orchestrate_chat(request: ChatRequest):
+    """并行调用学习和质疑智能体，再由平衡智能体综合"""
+    try:
+        if learning_agent is None or questioning_agent is None or balancing_agent is None:
+            raise HTTPException(status_code=500, detail="智能体未初始化")
+
+        learning_context = {
+            'conversation_history': request.context,
+            'knowledge_graph': request.knowledge_graph
+        }
+        questioning_context = {
+            'conversation_history': request.context,
+            'learning_context': request.context
+        }
+        await _apply_session(request, learning_context)
+        await _apply_session(request, questioning_context)
+        await _apply_knowledge_graph(request, learning_context)
+
+        async def timed(coro):
+            start = time.perf_counter()
+            result = await coro
+            return result, time.perf_counter() - start
+
+        total_start = time.perf_counter()
+
+        # 学习与质疑互不依赖，并行执行
+        (learning_response, learning_time), (questioning_response, questioning_time) = await asyncio.gather(
+            timed(learning_agent.generate_response(request.message, learning_context, use_cache=request.use_cache)),
+            timed(questioning_agent.generate_response(request.message, questioning_context, use_cache=request.use_cache))
+        )
+        parallel_time = time.perf_counter() - total_start
+
+        user_context = {
+            'current_question': request.message,
+            'learning_goals': []
+        }
+        synthesis_response, synthesis_time = await timed(
+            balancing_agent.synthesize_responses(learning_response, questioning_response, user_context,
+                                                 use_cache=request.use_cache)
+        )
+        await _record_turn(request, synthesis_response)
+
+        return OrchestrateResponse(
+            learning=ChatResponse(
+                content=learning_response.get('content', ''),
+                type="learning",
+                metadata=learning_response.get('metadata', {})
+            ),
+            questioning=ChatResponse(
+                content=questioning_response.get('content', ''),
+                type="questioning",
+                metadata=questioning_response.get('metadata', {})
+            ),
+            synthesis=ChatResponse(
+                content=synthesis_response.get('content', ''),
+                type="synthesis",
+                metadata=synthesis_response.get('metadata', {})
+            ),
+            timings={
+                "learning": round(learning_time, 3),
+                "questioning": round(questioning_time, 3),
+                "parallel": round(parallel_time, 3),
+                "synthesis": round(synthesis_time, 3),
+                "total": round(time.perf_counter() - total_start, 3)
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"编排API错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/knowledge/update")
-async def update_knowledge_graph(knowledge_data: Dict):
+async def update_knowledge_graph(request: KnowledgePatchRequest):
     try:
-        updated_graph = knowledge_service.update_graph(knowledge_data)
-        return {"status": "success", "graph": updated_graph}
+        if request.graph_data is not None:
+            graph = await graph_store.replace(request.user_id, request.graph_data)
+            result = {"version": graph["revision"], "applied": 1, "conflicts": []}
+        else:
+            result = await graph_store.apply_patch(request.user_id, request.operations, request.base_version)
+
+        if result["conflicts"]:
+            return JSONResponse(status_code=409, content={
+                "status": "conflict",
+                "version": result["version"],
+                "conflicts": result["conflicts"]
+            })
+
+        return {
+            "status": "success",
+            "version": result["version"],
+            "applied": result["applied"],
+            "conflicts": []
+        }
     except Exception as e:
         print(f"知识图谱更新错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/knowledge/graph")
+async def get_knowledge_graph(user_id: str = Query("default", pattern=STORAGE_KEY_PATTERN)):
+    """获取用户的完整知识图谱（首次加载或同步时使用）"""
+    try:
+        graph = await graph_store.get(user_id)
+        return {"user_id": user_id, "version": graph.get("revision", 0), "graph": graph}
+    except Exception as e:
+        print(f"获取知识图谱错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/knowledge/nodes/{node_id}")
+async def get_knowledge_node(node_id: str, user_id: str = Query("default", pattern=STORAGE_KEY_PATTERN),
+                             limit: int = 20):
+    """获取节点及其前 limit 个子节点（按需展开大图谱）"""
+    graph = await graph_store.get(user_id)
+    result = knowledge_service.get_node_page(graph, node_id, limit=max(1, min(limit, 200)))
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"节点不存在: {node_id}")
+    return {"version": graph.get("revision", 0), **result}
+
+
+@app.get("/api/knowledge/nodes/{node_id}/children")
+async def get_knowledge_children(node_id: str, user_id: str = Query("default", pattern=STORAGE_KEY_PATTERN),
+                                 cursor: Optional[str] = None, limit: int = 20):
+    """游标分页获取子节点"""
+    graph = await graph_store.get(user_id)
+    try:
+        result = knowledge_service.get_children_page(graph, node_id, cursor, max(1, min(limit, 200)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"节点不存在: {node_id}")
+    return {"version": graph.get("revision", 0), **result}
+
+
+@app.get("/api/knowledge/nodes/{node_id}/path")
+async def get_knowledge_path(node_id: str, user_id: str = Query("default", pattern=STORAGE_KEY_PATTERN)):
+    """获取从根节点到指定节点的祖先路径"""
+    graph = await graph_store.get(user_id)
+    path = knowledge_service.get_ancestor_path(graph, node_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"节点不存在: {node_id}")
+    return {"version": graph.get("revision", 0), "path": path}
+
+
 @app.get("/api/knowledge/stats")
-async def get_knowledge_stats():
+async def get_knowledge_stats(user_id: str = Query("default", pattern=STORAGE_KEY_PATTERN)):
     try:
-        # 这里可以添加知识图谱统计逻辑
+        graph = await graph_store.get(user_id)
+        stats = knowledge_service.get_graph_stats(graph)
         return {
-            "total_nodes": 0,
-            "total_connections": 0,
-            "last_updated": None
+            "user_id": user_id,
+            **stats,
+            "total_connections": max(stats["total_nodes"] - 1, 0),
+            "last_updated": stats["last_modified"]
         }
     except Exception as e:
         print(f"获取知识图谱统计错误: {str(e)}")
@@ -203,7 +509,13 @@ async def get_agents_status():
             "balancing_agent": {
                 "initialized": balancing_agent is not None,
                 "stats": balancing_agent.get_stats() if balancing_agent else None
-            }
+            },
+            "circuit_breaker": http_client.breaker.get_stats() if http_client else None,
+            "http_client": http_client.get_stats() if http_client else None,
+            "response_cache": response_cache.get_stats() if response_cache else None,
+            "summarizer": summarizer.get_stats() if summarizer else None,
+            "knowledge_graph_store": graph_store.get_stats(),
+            "storage_write_behind": storage_service.get_write_behind_stats()
         }
         return status
     except Exception as e:
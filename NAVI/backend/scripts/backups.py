@@ -0,0 +1,70 @@
+"""用户数据的增量备份管理
+
+备份按内容分块去重（services.backup_store），可以按小时运行而不会让备份目录
+随次数线性增长。还原会覆盖用户当前的数据，请在服务停止时执行。
+
+用法（在 backend 目录下）:
+    python -m scripts.backups backup [--user alice]
+    python -m scripts.backups list --user alice
+    python -m scripts.backups restore --user alice [--backup-id 20240101T000000000000]
+    python -m scripts.backups gc --keep-last 24 [--max-age-days 30]
+    python -m scripts.backups stats
+"""
+import argparse
+import asyncio
+
+from services.storage_service import StorageService
+
+
+async def run(args):
+    storage = StorageService.from_env(args.data_dir)
+    backups = storage.backups
+
+    try:
+        if args.command == "backup":
+            users = args.users or await storage.list_graph_users()
+            for user_id in users:
+                ok = await storage.backup_user_data(user_id)
+                print(f"{user_id}: {'完成' if ok else '失败'}")
+
+        elif args.command == "list":
+            for user_id in args.users or backups.list_users():
+                for backup_id in backups.list_backups(user_id):
+                    manifest = backups.load_manifest(user_id, backup_id)
+                    sizes = {
+                        kind: entry["size"] if entry else 0
+                        for kind, entry in manifest["documents"].items()
+                    }
+                    print(f"{user_id}  {backup_id}  {manifest['backup_time']}  {sizes}")
+
+        elif args.command == "restore":
+            if not args.users or len(args.users) != 1:
+                raise SystemExit("restore 需要且只能指定一个 --user")
+            ok = await storage.restore_user_data(args.users[0], args.backup_id)
+            print("还原完成" if ok else "还原失败")
+
+        elif args.command == "gc":
+            result = await storage.gc_backups(args.keep_last, args.max_age_days)
+            print(f"删除 {result['removed_manifests']} 个备份, {result['removed_chunks']} 个分块, "
+                  f"释放 {result['freed_bytes'] / 1024:.1f} KB")
+
+        elif args.command == "stats":
+            print(backups.stats())
+    finally:
+        await storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用户数据的增量备份管理")
+    parser.add_argument("command", choices=["backup", "list", "restore", "gc", "stats"])
+    parser.add_argument("--data-dir", help="数据目录，默认读取 NAVI_DATA_DIR 等环境变量")
+    parser.add_argument("--user", action="append", dest="users", help="指定用户，可重复")
+    parser.add_argument("--backup-id", help="restore 使用的备份，默认最新")
+    parser.add_argument("--keep-last", type=int, default=24, help="gc 时每个用户至少保留的备份数")
+    parser.add_argument("--max-age-days", type=float, help="gc 时只删除早于该天数的备份")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
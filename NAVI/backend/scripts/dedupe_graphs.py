@@ -0,0 +1,65 @@
+"""知识图谱批量去重
+
+对已保存的用户知识图谱执行近似重复笔记合并（KnowledgeGraphService.deduplicate_graph），
+用于清理去重功能上线前积累的重复笔记，以及客户端通过 /api/knowledge/update
+添加的笔记（该接口写入时不去重）中的重复。存储引擎和格式按 NAVI_STORAGE_ENGINE 等
+环境变量确定，与服务保持一致。
+
+脚本直接读写存储，请在服务停止时执行：运行中的服务在内存中保留着用户图谱，
+之后的保存会覆盖脚本写回的结果。
+
+用法（在 backend 目录下）:
+    python -m scripts.dedupe_graphs [--data-dir data]
+    python -m scripts.dedupe_graphs --user alice --dry-run
+"""
+import argparse
+import asyncio
+from typing import List, Optional
+
+from services.knowledge_service import KnowledgeGraphService
+from services.storage_service import StorageService
+
+
+async def run(data_dir: Optional[str], users: Optional[List[str]], threshold: float, dry_run: bool):
+    storage = StorageService.from_env(data_dir)
+    service = KnowledgeGraphService(duplicate_threshold=threshold)
+
+    total_merged = 0
+    try:
+        for user_id in users or await storage.list_graph_users():
+            graph = await storage.load_knowledge_graph(user_id)
+            if graph is None:
+                print(f"{user_id}: 未找到知识图谱")
+                continue
+
+            before = service.get_index(graph).get_stats()["total_nodes"]
+            deduped, merges = service.deduplicate_graph(graph)
+            after = service.get_index(deduped).get_stats()["total_nodes"]
+            total_merged += len(merges)
+            print(f"{user_id}: {before} -> {after} 个节点，合并 {len(merges)} 个重复笔记")
+
+            if merges and not dry_run:
+                deduped = dict(deduped)
+                deduped["revision"] = deduped.get("revision", 0) + 1
+                if not await storage.save_knowledge_graph(user_id, deduped):
+                    print(f"{user_id}: 写回失败")
+            service.release_index(graph)
+            service.release_index(deduped)
+    finally:
+        await storage.close()
+
+    print(f"共合并 {total_merged} 个重复笔记" + ("（dry run，未写回）" if dry_run else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识图谱批量去重（请在服务停止时执行）")
+    parser.add_argument("--data-dir", help="数据目录，默认读取 NAVI_DATA_DIR 等环境变量")
+    parser.add_argument("--user", action="append", dest="users", help="只处理指定用户，可重复")
+    parser.add_argument("--threshold", type=float, default=0.8, help="近似重复的相似度阈值")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写回")
+    args = parser.parse_args()
+    asyncio.run(run(args.data_dir, args.users, args.threshold, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,34 @@
 Navi智能助手 - 服务模块
 """
 
+from .http_client import DeepSeekHTTPClient, get_default_client, close_default_client
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .concurrency_limiter import AdaptiveLimiter, UpstreamOverloadedError
+from .retry_policy import RetryPolicy
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
 from .deepseek_service import DeepSeekService
 from .knowledge_service import KnowledgeGraphService
 from .storage_service import StorageService
+from .graph_store import KnowledgeGraphStore
+from .session_summarizer import ConversationSummarizer
 
 __all__ = [
+    'DeepSeekHTTPClient',
+    'get_default_client',
+    'close_default_client',
+    'ResponseCache',
+    'SingleFlight',
+    'AdaptiveLimiter',
+    'UpstreamOverloadedError',
+    'RetryPolicy',
+    'CircuitBreaker',
+    'CircuitOpenError',
     'DeepSeekService',
     'KnowledgeGraphService',
-    'StorageService'
+    'StorageService',
+    'KnowledgeGraphStore',
+    'ConversationSummarizer'
 ]
 
 
@@ -0,0 +1,257 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WINDOW = 48
+_rng = np.random.RandomState(2024)
+_BYTE_TABLE = _rng.randint(0, 1 << 32, size=256, dtype=np.uint64).astype(np.uint32)
+_BASE = np.uint32(0x01000193)
+# _BASE 的模 2^32 逆元（_BASE 为奇数，逆元存在）
+_BASE_INV = np.uint32(pow(int(_BASE), -1, 1 << 32))
+
+
+def _powers_mod32(base: np.uint32, count: int) -> np.ndarray:
+    """base^0 .. base^(count-1) mod 2^32"""
+    powers = np.empty(count, dtype=np.uint32)
+    powers[0] = 1
+    if count > 1:
+        with np.errstate(over="ignore"):
+            np.cumprod(np.full(count - 1, base, dtype=np.uint32), dtype=np.uint32, out=powers[1:])
+    return powers
+
+
+def chunk_boundaries(data: bytes,
+                     min_size: int = 2 * 1024,
+                     avg_size: int = 8 * 1024,
+                     max_size: int = 64 * 1024) -> List[int]:
+    """内容定义分块：返回各分块的结束位置
+
+    对每个位置计算其前 _WINDOW 字节的滚动哈希（用前缀和向量化计算），
+    哈希低位全为零的位置作为候选切点，再按最小/最大块大小筛选。
+    切点只取决于附近的内容，因此局部修改只影响相邻的一两个分块。
+    """
+    length = len(data)
+    if length <= min_size:
+        return [length] if length else []
+
+    with np.errstate(over="ignore"):
+        values = _BYTE_TABLE[np.frombuffer(data, dtype=np.uint8)]
+        # H(i) = sum(T[b[k]] * BASE^(i-k))，k 取窗口内的位置；uint32 运算自然按 2^32 取模
+        prefix = np.cumsum(values * _powers_mod32(_BASE_INV, length), dtype=np.uint32)
+        window_sums = prefix.copy()
+        window_sums[_WINDOW:] -= prefix[:-_WINDOW]
+        hashes = window_sums * _powers_mod32(_BASE, length)
+
+    mask = np.uint32((1 << max(avg_size.bit_length() - 1, 1)) - 1)
+    candidates = np.flatnonzero((hashes & mask) == 0) + 1
+
+    boundaries = []
+    start = 0
+    for position in candidates.tolist():
+        while position - start > max_size:
+            start += max_size
+            boundaries.append(start)
+        if position - start >= min_size:
+            boundaries.append(position)
+            start = position
+    while length - start > max_size:
+        start += max_size
+        boundaries.append(start)
+    if start < length:
+        boundaries.append(length)
+    return boundaries
+
+
+def _write_atomic(path: str, payload: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class BackupStore:
+    """内容寻址的增量备份
+
+    备份时把每份用户数据序列化为紧凑JSON，按内容定义分块，每个分块以其
+    SHA-256 命名、gzip 压缩后只保存一份（backups/chunks/），每次备份只写一个
+    记录分块列表的清单（backups/manifests/{user_id}/{backup_id}.json）。
+    未变化的数据只增加一个清单，小修改只增加变化附近的分块。
+
+    gc 按保留策略删除旧清单，再删除不被任何清单引用的分块。复用的分块在备份时
+    会刷新修改时间，gc 只删除早于 grace_seconds 之前的分块，避免误删正在进行的
+    备份刚写入或复用的分块。
+    """
+
+    def __init__(self, root: str, grace_seconds: float = 3600):
+        self.root = root
+        self.chunk_dir = os.path.join(root, "chunks")
+        self.manifest_dir = os.path.join(root, "manifests")
+        self.grace_seconds = grace_seconds
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def _manifest_path(self, user_id: str, backup_id: str) -> str:
+        return os.path.join(self.manifest_dir, user_id, f"{backup_id}.json")
+
+    def _put_chunk(self, chunk: bytes) -> Tuple[str, bool]:
+        """保存分块，已存在时只刷新修改时间；返回 (哈希, 是否新写入)"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return digest, False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, gzip.compress(chunk, mtime=0))
+        return digest, True
+
+    def _get_chunk(self, digest: str) -> bytes:
+        with open(self._chunk_path(digest), "rb") as f:
+            chunk = gzip.decompress(f.read())
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"备份分块已损坏: {digest}")
+        return chunk
+
+    def backup(self, user_id: str, documents: Dict[str, Optional[Dict]]) -> Dict:
+        """备份一个用户的数据，返回清单（附带本次新写入的分块数和字节数）"""
+        backup_time = datetime.now()
+        manifest = {
+            "user_id": user_id,
+            "backup_id": backup_time.strftime("%Y%m%dT%H%M%S%f"),
+            "backup_time": backup_time.isoformat(),
+            "documents": {}
+        }
+
+        new_chunks = 0
+        new_bytes = 0
+        for kind, document in documents.items():
+            if document is None:
+                manifest["documents"][kind] = None
+                continue
+
+            data = json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            chunks = []
+            start = 0
+            for end in chunk_boundaries(data):
+                digest, created = self._put_chunk(data[start:end])
+                if created:
+                    new_chunks += 1
+                    new_bytes += end - start
+                chunks.append(digest)
+                start = end
+            manifest["documents"][kind] = {"size": len(data), "chunks": chunks}
+
+        path = self._manifest_path(user_id, manifest["backup_id"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+
+        return {**manifest, "new_chunks": new_chunks, "new_bytes": new_bytes}
+
+    def list_users(self) -> List[str]:
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        return sorted(os.listdir(self.manifest_dir))
+
+    def list_backups(self, user_id: str) -> List[str]:
+        """列出用户的备份ID（从旧到新）"""
+        user_dir = os.path.join(self.manifest_dir, user_id)
+        if not os.path.isdir(user_dir):
+            return []
+        return sorted(filename[:-len(".json")] for filename in os.listdir(user_dir) if filename.endswith(".json"))
+
+    def load_manifest(self, user_id: str, backup_id: str) -> Dict:
+        with open(self._manifest_path(user_id, backup_id), "rb") as f:
+            return json.loads(f.read())
+
+    def restore(self, user_id: str, backup_id: Optional[str] = None) -> Dict[str, Optional[Dict]]:
+        """还原备份中的用户数据，backup_id 为空时使用最新的备份"""
+        if backup_id is None:
+            backups = self.list_backups(user_id)
+            if not backups:
+                raise FileNotFoundError(f"没有用户 {user_id} 的备份")
+            backup_id = backups[-1]
+
+        manifest = self.load_manifest(user_id, backup_id)
+        documents = {}
+        for kind, entry in manifest["documents"].items():
+            if entry is None:
+                documents[kind] = None
+                continue
+            data = b"".join(self._get_chunk(digest) for digest in entry["chunks"])
+            if len(data) != entry["size"]:
+                raise ValueError(f"备份数据长度不符: {user_id}/{backup_id}/{kind}")
+            documents[kind] = json.loads(data)
+        return documents
+
+    def gc(self, keep_last: int = 24, max_age_days: Optional[float] = None) -> Dict:
+        """按保留策略删除旧备份，并回收不再被引用的分块
+
+        每个用户至少保留最近 keep_last 个备份；设置 max_age_days 时，超出
+        keep_last 且早于该天数的备份才会删除，否则超出的备份全部删除。
+        """
+        started = time.time()
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y%m%dT%H%M%S%f") if max_age_days else None
+
+        removed_manifests = 0
+        referenced = set()
+        for user_id in self.list_users():
+            backups = self.list_backups(user_id)
+            expired = backups[:-keep_last] if keep_last > 0 else backups
+            if cutoff is not None:
+                expired = [backup_id for backup_id in expired if backup_id < cutoff]
+
+            for backup_id in expired:
+                os.remove(self._manifest_path(user_id, backup_id))
+                removed_manifests += 1
+            for backup_id in backups:
+                if backup_id not in expired:
+                    for entry in self.load_manifest(user_id, backup_id)["documents"].values():
+                        if entry is not None:
+                            referenced.update(entry["chunks"])
+
+        removed_chunks = 0
+        freed_bytes = 0
+        if os.path.isdir(self.chunk_dir):
+            for prefix in os.listdir(self.chunk_dir):
+                prefix_dir = os.path.join(self.chunk_dir, prefix)
+                for digest in os.listdir(prefix_dir):
+                    path = os.path.join(prefix_dir, digest)
+                    if digest in referenced or os.path.getmtime(path) > started - self.grace_seconds:
+                        continue
+                    freed_bytes += os.path.getsize(path)
+                    os.remove(path)
+                    removed_chunks += 1
+
+        logger.info(f"备份回收: 删除 {removed_manifests} 个清单, {removed_chunks} 个分块")
+        return {
+            "removed_manifests": removed_manifests,
+            "removed_chunks": removed_chunks,
+            "freed_bytes": freed_bytes
+        }
+
+    def stats(self) -> Dict:
+        chunk_count = 0
+        chunk_bytes = 0
+        if os.path.isdir(self.chunk_dir):
+            for prefix in os.listdir(self.chunk_dir):
+                prefix_dir = os.path.join(self.chunk_dir, prefix)
+                for digest in os.listdir(prefix_dir):
+                    chunk_count += 1
+                    chunk_bytes += os.path.getsize(os.path.join(prefix_dir, digest))
+
+        return {
+            "users": len(self.list_users()),
+            "backups": sum(len(self.list_backups(user_id)) for user_id in self.list_users()),
+            "chunks": chunk_count,
+            "chunk_bytes": chunk_bytes
+        }
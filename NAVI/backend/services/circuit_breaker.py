@@ -0,0 +1,116 @@
+import os
+import time
+from typing import Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+    pass
+
+
+class CircuitBreaker:
+    """上游熔断器
+
+    closed: 正常放行，连续失败达到阈值后进入 open；
+    open: 直接拒绝请求，经过 recovery_timeout 后进入 half_open；
+    half_open: 放行少量探测请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+        # 统计信息
+        self.rejected_count = 0
+        self.open_count = 0
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        """从环境变量读取熔断配置"""
+        return cls(
+            failure_threshold=int(os.getenv("DEEPSEEK_BREAKER_FAILURE_THRESHOLD", "5")),
+            recovery_timeout=float(os.getenv("DEEPSEEK_BREAKER_RECOVERY_TIMEOUT", "30")),
+            half_open_max_calls=int(os.getenv("DEEPSEEK_BREAKER_HALF_OPEN_CALLS", "1")),
+        )
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+            logger.info("熔断器进入半开状态，开始探测上游")
+        return self._state
+
+    def allow_request(self) -> bool:
+        """判断是否放行请求；放行的请求必须随后调用 record_success/record_failure/release"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return True
+
+        self.rejected_count += 1
+        return False
+
+    def check(self):
+        """放行请求，或在熔断时抛出 CircuitOpenError"""
+        if not self.allow_request():
+            raise CircuitOpenError("DeepSeek上游熔断中，请稍后重试")
+
+    def record_success(self):
+        if self._state == self.HALF_OPEN:
+            logger.info("熔断器探测成功，恢复关闭状态")
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._half_open_calls = 0
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            self._trip()
+
+    def release(self):
+        """放行的请求被取消、没有结果时归还半开探测名额"""
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def _trip(self):
+        if self._state != self.OPEN:
+            self.open_count += 1
+            logger.warning(f"DeepSeek上游连续失败 {self._consecutive_failures} 次，熔断器打开")
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_calls = 0
+
+    def get_stats(self) -> Dict:
+        """获取熔断器状态"""
+        state = self.state
+        retry_in = None
+        if state == self.OPEN:
+            retry_in = round(max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at)), 2)
+        return {
+            "state": state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "retry_in": retry_in,
+            "open_count": self.open_count,
+            "rejected_count": self.rejected_count
+        }
@@ -0,0 +1,156 @@
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# 具名存放的节点字段，其余字段放入 extra
+_FIELDS = ("id", "title", "content", "type", "created_at", "updated_at", "metadata", "children")
+_TIMESTAMP_FIELDS = ("created_at", "updated_at")
+
+
+class PackedDict(tuple):
+    """紧凑存放的字典：(键, 值) 对组成的元组，保留键的顺序"""
+    __slots__ = ()
+
+
+class PackedList(tuple):
+    """紧凑存放的列表"""
+    __slots__ = ()
+
+
+class PackedTimestamp(int):
+    """以纪元微秒存放的ISO时间戳"""
+    __slots__ = ()
+
+
+class TextPool:
+    """文本去重池：相同内容的字符串只保留一份"""
+
+    def __init__(self):
+        self._texts: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def intern(self, text: str) -> str:
+        return self._texts.setdefault(text, text)
+
+
+class CompactNode:
+    """紧凑的知识图谱节点
+
+    使用 __slots__ 代替每个节点一个字典；节点类型标签驻留（sys.intern），
+    可无损往返的ISO时间戳存为整数微秒，文本经 TextPool 去重，字典和列表
+    存为元组。layout 记录原字典的键顺序（相同结构的节点共享同一个元组），
+    保证 to_dict 的结果与原JSON完全一致。
+    """
+
+    __slots__ = ("id", "title", "content", "type", "created_at", "updated_at",
+                 "metadata", "children", "extra", "layout")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+_layouts: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+def _intern_layout(keys: Tuple[str, ...]) -> Tuple[str, ...]:
+    return _layouts.setdefault(keys, keys)
+
+
+def pack_timestamp(value: Any) -> Any:
+    """ISO时间戳转为整数微秒，无法无损还原时保持原值"""
+    if not isinstance(value, str):
+        return value
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if moment.tzinfo is not None:
+        return value
+
+    packed = PackedTimestamp((moment - _EPOCH) // _MICROSECOND)
+    return packed if unpack_timestamp(packed) == value else value
+
+
+def unpack_timestamp(value: Any) -> Any:
+    if isinstance(value, PackedTimestamp):
+        return (_EPOCH + timedelta(microseconds=int(value))).isoformat()
+    return value
+
+
+def _pack_value(value: Any, pool: TextPool) -> Any:
+    if isinstance(value, str):
+        return pool.intern(value)
+    if isinstance(value, dict):
+        return PackedDict((sys.intern(key), _pack_value(item, pool)) for key, item in value.items())
+    if isinstance(value, list):
+        return PackedList(_pack_value(item, pool) for item in value)
+    return value
+
+
+def _unpack_value(value: Any) -> Any:
+    if isinstance(value, PackedDict):
+        return {key: _unpack_value(item) for key, item in value}
+    if isinstance(value, PackedList):
+        return [_unpack_value(item) for item in value]
+    return value
+
+
+def pack_graph(graph: Dict, pool: Optional[TextPool] = None) -> CompactNode:
+    """将嵌套字典形式的图谱转换为紧凑节点树（迭代实现）"""
+    pool = pool if pool is not None else TextPool()
+    root = CompactNode()
+
+    stack = [(graph, root)]
+    while stack:
+        source, node = stack.pop()
+        node.layout = _intern_layout(tuple(source.keys()))
+
+        extra = []
+        for key, value in source.items():
+            if key == "children" and isinstance(value, list):
+                children = tuple(CompactNode() for _ in value)
+                node.children = children
+                stack.extend(zip(value, children))
+            elif key == "type" and isinstance(value, str):
+                node.type = sys.intern(value)
+            elif key in _TIMESTAMP_FIELDS:
+                setattr(node, key, pack_timestamp(value))
+            elif key in _FIELDS:
+                setattr(node, key, _pack_value(value, pool))
+            else:
+                extra.append((sys.intern(key), _pack_value(value, pool)))
+
+        if extra:
+            node.extra = PackedDict(extra)
+
+    return root
+
+
+def unpack_graph(root: CompactNode) -> Dict:
+    """将紧凑节点树还原为嵌套字典形式的图谱（迭代实现）"""
+    result: Dict = {}
+
+    stack = [(root, result)]
+    while stack:
+        node, target = stack.pop()
+        extra = dict(node.extra) if node.extra else {}
+
+        for key in node.layout:
+            if key == "children" and isinstance(node.children, tuple):
+                children = [{} for _ in node.children]
+                target[key] = children
+                stack.extend(zip(node.children, children))
+            elif key in _TIMESTAMP_FIELDS:
+                target[key] = unpack_timestamp(getattr(node, key))
+            elif key in _FIELDS:
+                target[key] = _unpack_value(getattr(node, key))
+            else:
+                target[key] = _unpack_value(extra[key])
+
+    return result
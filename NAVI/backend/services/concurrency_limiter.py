@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamOverloadedError(Exception):
+    """等待队列已满，请求被直接拒绝"""
+    pass
+
+
+class AdaptiveLimiter:
+    """自适应并发限制器（AIMD）
+
+    请求成功且延迟低于目标时并发上限加性增长；出现错误（429/5xx/网络错误）
+    或延迟超过目标时乘性下降。超出上限的请求排队等待，队列满时立即拒绝，
+    以便过载时快速失败而不是堆积协程。
+    """
+
+    def __init__(self,
+                 initial_limit: int = 8,
+                 min_limit: int = 1,
+                 max_limit: int = 64,
+                 max_queue: int = 100,
+                 latency_target: float = 30.0,
+                 backoff_ratio: float = 0.7,
+                 increase_step: float = 1.0,
+                 decrease_cooldown: float = 1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.increase_step = increase_step
+        self.decrease_cooldown = decrease_cooldown
+
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+        # 统计信息
+        self.latency_ewma: Optional[float] = None
+        self.error_rate = 0.0
+        self.shed_count = 0
+        self.completed_count = 0
+
+    @classmethod
+    def from_env(cls) -> "AdaptiveLimiter":
+        """从环境变量读取限流配置"""
+        return cls(
+            initial_limit=int(os.getenv("DEEPSEEK_CONCURRENCY_INITIAL", "8")),
+            min_limit=int(os.getenv("DEEPSEEK_CONCURRENCY_MIN", "1")),
+            max_limit=int(os.getenv("DEEPSEEK_CONCURRENCY_MAX", "64")),
+            max_queue=int(os.getenv("DEEPSEEK_QUEUE_MAX", "100")),
+            latency_target=float(os.getenv("DEEPSEEK_LATENCY_TARGET", "30")),
+        )
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        """获取一个并发槽位，队列已满时抛出 UpstreamOverloadedError"""
+        if self._in_flight < self.capacity and not self._waiters:
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.shed_count += 1
+            raise UpstreamOverloadedError(
+                f"DeepSeek请求队列已满 ({len(self._waiters)}/{self.max_queue})")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            elif future.done() and not future.cancelled():
+                # 槽位已分配但调用方被取消，归还槽位
+                self.cancel()
+            raise
+
+    def cancel(self):
+        """归还未发出或被调用方放弃的请求的槽位，不记录结果，不影响并发上限"""
+        self._in_flight -= 1
+        self._wake_waiters()
+
+    def release(self, latency: Optional[float], success: bool):
+        """归还槽位并根据本次结果调整并发上限"""
+        self._in_flight -= 1
+        self._record(latency, success)
+        self._wake_waiters()
+
+    def _record(self, latency: Optional[float], success: bool):
+        self.completed_count += 1
+        self.error_rate = 0.9 * self.error_rate + 0.1 * (0.0 if success else 1.0)
+        if latency is not None:
+            self.latency_ewma = latency if self.latency_ewma is None else \
+                0.8 * self.latency_ewma + 0.2 * latency
+
+        overloaded = not success or (latency is not None and latency > self.latency_target)
+        if overloaded:
+            now = time.monotonic()
+            # 同一批并发失败只触发一次下降
+            if now - self._last_decrease >= self.decrease_cooldown:
+                old_limit = self.limit
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+                self._last_decrease = now
+                logger.warning(f"DeepSeek并发上限下调: {old_limit:.1f} -> {self.limit:.1f}")
+        else:
+            self.limit = min(float(self.max_limit), self.limit + self.increase_step / self.limit)
+
+    def _wake_waiters(self):
+        while self._waiters and self._in_flight < self.capacity:
+            future = self._waiters.popleft()
+            if not future.done():
+                self._in_flight += 1
+                future.set_result(None)
+
+    def get_stats(self) -> Dict:
+        """获取限流统计信息"""
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "shed_count": self.shed_count,
+            "completed_count": self.completed_count
+        }
@@ -1,32 +1,39 @@
 import asyncio
-import aiohttp
 import json
 from typing import Dict, List, Optional, Any
 import time
 import logging
 
+from .http_client import DeepSeekHTTPClient
+from .concurrency_limiter import UpstreamOverloadedError
+from .circuit_breaker import CircuitOpenError
+
 logger = logging.getLogger(__name__)
 
 
 class DeepSeekService:
     """DeepSeek API服务封装"""
 
-    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com"):
+    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com",
+                 http_client: Optional[DeepSeekHTTPClient] = None):
         self.api_key = api_key
         self.base_url = base_url
-        self.session = None
+        # 未注入共享连接池时使用私有连接池，并在退出时关闭
+        self._owns_client = http_client is None
+        self.http_client = http_client or DeepSeekHTTPClient()
         self.request_count = 0
         self.total_tokens = 0
 
     async def __aenter__(self):
         """异步上下文管理器入口"""
-        self.session = aiohttp.ClientSession()
+        await self.http_client.get_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """异步上下文管理器出口"""
-        if self.session:
-            await self.session.close()
+        # 共享连接池由应用生命周期管理，这里只关闭私有连接池
+        if self._owns_client:
+            await self.http_client.close()
 
     async def chat_completion(self,
                               messages: List[Dict],
@@ -48,9 +55,6 @@ class DeepSeekService:
             API响应数据
         """
 
-        if not self.session:
-            self.session = aiohttp.ClientSession()
-
         url = f"{self.base_url}/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -68,36 +72,48 @@ class DeepSeekService:
         start_time = time.time()
 
         try:
-            async with self.session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    data = await response.json()
-
-                    # 更新统计信息
-                    self.request_count += 1
-                    usage = data.get('usage', {})
-                    self.total_tokens += usage.get('total_tokens', 0)
-
-                    # 记录响应时间
-                    response_time = time.time() - start_time
-
-                    logger.info(f"DeepSeek API调用成功 - 响应时间: {response_time:.2f}s, "
-                                f"Token使用: {usage.get('total_tokens', 0)}")
-
-                    return {
-                        "success": True,
-                        "data": data,
-                        "response_time": response_time,
-                        "tokens_used": usage.get('total_tokens', 0)
-                    }
-                else:
-                    error_text = await response.text()
-                    logger.error(f"DeepSeek API错误: {response.status} - {error_text}")
-                    return {
-                        "success": False,
-                        "error": f"API错误: {response.status}",
-                        "details": error_text
-                    }
-
+            result = await self.http_client.request_json(url, headers, payload)
+            if result.status == 200:
+                data = result.data
+
+                # 更新统计信息
+                self.request_count += 1
+                usage = data.get('usage', {})
+                self.total_tokens += usage.get('total_tokens', 0)
+
+                # 记录响应时间
+                response_time = time.time() - start_time
+
+                logger.info(f"DeepSeek API调用成功 - 响应时间: {response_time:.2f}s, "
+                            f"Token使用: {usage.get('total_tokens', 0)}")
+
+                return {
+                    "success": True,
+                    "data": data,
+                    "response_time": response_time,
+                    "tokens_used": usage.get('total_tokens', 0)
+                }
+            else:
+                logger.error(f"DeepSeek API错误: {result.status} - {result.text}")
+                return {
+                    "success": False,
+                    "error": f"API错误: {result.status}",
+                    "details": result.text
+                }
+
+        except CircuitOpenError as e:
+            return {
+                "success": False,
+                "error": "服务暂不可用",
+                "details": str(e)
+            }
+        except UpstreamOverloadedError as e:
+            logger.warning(f"DeepSeek请求被限流拒绝: {e}")
+            return {
+                "success": False,
+                "error": "服务繁忙",
+                "details": str(e)
+            }
         except asyncio.TimeoutError:
             logger.error("DeepSeek API调用超时")
             return {
@@ -131,9 +147,6 @@ class DeepSeekService:
             流式响应数据块
         """
 
-        if not self.session:
-            self.session = aiohttp.ClientSession()
-
         url = f"{self.base_url}/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -149,7 +162,7 @@ class DeepSeekService:
         }
 
         try:
-            async with self.session.post(url, headers=headers, json=payload) as response:
+            async with self.http_client.post(url, headers, payload) as response:
                 if response.status == 200:
                     async for line in response.content:
                         line = line.decode('utf-8').strip()
@@ -180,7 +193,8 @@ class DeepSeekService:
         return {
             "request_count": self.request_count,
             "total_tokens": self.total_tokens,
-            "avg_tokens_per_request": self.total_tokens / max(self.request_count, 1)
+            "avg_tokens_per_request": self.total_tokens / max(self.request_count, 1),
+            "coalesced_requests": self.http_client.single_flight.coalesced_count
         }
 
     async def test_connection(self) -> bool:
@@ -0,0 +1,306 @@
+import math
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .search_index import InvertedIndex
+from .keyword_extractor import DocumentFrequencies, KeywordExtractor, node_text
+from .near_duplicate import NearDuplicateIndex, duplicate_text
+
+# 参与近似重复检测的节点类型
+NOTE_TYPES = ("learning", "questioning")
+
+
+class GraphIndex:
+    """知识图谱索引
+
+    在嵌套字典形式的知识图谱之上维护 id→节点 映射、父节点指针和标题索引，
+    使按ID/标题查找为 O(1)、取祖先路径为 O(depth)。所有遍历均为迭代实现，
+    不受Python递归深度限制。索引引用图谱中的节点对象本身，不复制数据。
+
+    同时增量维护统计信息（各类型节点数、各深度节点数、子树规模、最后修改时间），
+    每次修改的维护开销为 O(depth + 变动节点数)，读取统计为 O(1)。
+    """
+
+    def __init__(self, root: Dict):
+        self.root = root
+        self.nodes: Dict[str, Dict] = {}
+        self.parents: Dict[str, Optional[str]] = {}
+        self.titles: Dict[str, List[str]] = defaultdict(list)
+        # 关键词 -> 含该关键词的节点ID，用于新节点的父节点选择
+        self.keyword_postings: Dict[str, Set[str]] = defaultdict(set)
+        # 全文检索索引在首次检索时构建，之后随修改增量维护
+        self.search_index: Optional[InvertedIndex] = None
+        # 关键词提取用的文档频率统计（即该用户的语料），首次提取关键词时构建
+        self.term_stats: Optional[DocumentFrequencies] = None
+        self.term_extractor: Optional[KeywordExtractor] = None
+        # 笔记节点的MinHash LSH索引，首次查重时构建
+        self.duplicate_index: Optional[NearDuplicateIndex] = None
+
+        # 增量统计
+        self.depths: Dict[str, int] = {}
+        self.subtree_sizes: Dict[str, int] = {}
+        self.type_counts: Counter = Counter()
+        self.depth_counts: Counter = Counter()
+        self.max_depth = 0
+        self.last_modified: Optional[str] = root.get("updated_at")
+
+        self.add_subtree(root, None)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.nodes
+
+    def get(self, node_id: str) -> Optional[Dict]:
+        """根据ID查找节点"""
+        return self.nodes.get(node_id)
+
+    def find_by_title(self, title: str) -> Optional[Dict]:
+        """根据标题查找节点（同名时返回先序遍历中最先出现的节点）"""
+        ids = self.titles.get(title)
+        return self.nodes[ids[0]] if ids else None
+
+    def get_search_index(self) -> InvertedIndex:
+        """获取全文检索索引，不存在时构建"""
+        if self.search_index is None:
+            self.search_index = InvertedIndex()
+            for node_id, node in self.nodes.items():
+                self.search_index.add_node(node_id, node)
+        return self.search_index
+
+    def get_term_stats(self, extractor: KeywordExtractor) -> DocumentFrequencies:
+        """获取图谱语料的文档频率统计，不存在时构建"""
+        if self.term_stats is None:
+            self.term_extractor = extractor
+            self.term_stats = DocumentFrequencies()
+            for node in self.nodes.values():
+                self.term_stats.add(extractor.terms(node_text(node)))
+        return self.term_stats
+
+    def get_duplicate_index(self, threshold: float = 0.8) -> NearDuplicateIndex:
+        """获取笔记节点的近似重复检测索引，不存在时构建"""
+        if self.duplicate_index is None:
+            self.duplicate_index = NearDuplicateIndex(threshold=threshold)
+            for node_id, node in self.nodes.items():
+                if node.get("type") in NOTE_TYPES:
+                    self.duplicate_index.add(node_id, duplicate_text(node))
+        return self.duplicate_index
+
+    @staticmethod
+    def node_keywords(node: Dict) -> List[str]:
+        return (node.get("metadata") or {}).get("keywords") or []
+
+    def keyword_idf(self, keyword: str) -> float:
+        """关键词的逆文档频率，越少见权重越高"""
+        df = len(self.keyword_postings.get(keyword, ()))
+        return math.log(1 + len(self.nodes) / (df + 1))
+
+    def parent_of(self, node_id: str) -> Optional[Dict]:
+        parent_id = self.parents.get(node_id)
+        return self.nodes.get(parent_id) if parent_id is not None else None
+
+    def path_to(self, node_id: str) -> Optional[List[str]]:
+        """返回从根节点到指定节点的ID路径，节点不存在时返回None"""
+        if node_id not in self.nodes:
+            return None
+
+        path = []
+        current = node_id
+        while current is not None:
+            path.append(current)
+            current = self.parents.get(current)
+        path.reverse()
+        return path
+
+    def depth(self, node_id: str) -> int:
+        return self.depths.get(node_id, -1)
+
+    def iter_nodes(self, start: Optional[Dict] = None) -> Iterator[Tuple[Dict, int]]:
+        """先序遍历，产出 (节点, 相对深度)"""
+        stack = [(start if start is not None else self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            children = node.get("children") or []
+            for child in reversed(children):
+                stack.append((child, depth + 1))
+
+    def add_subtree(self, node: Dict, parent_id: Optional[str]):
+        """登记一棵子树中的所有节点"""
+        base_depth = self.depths[parent_id] + 1 if parent_id in self.depths else 0
+        added = []
+
+        stack = [(node, parent_id, base_depth)]
+        while stack:
+            current, current_parent, depth = stack.pop()
+            node_id = current.get("id")
+            if node_id is not None and node_id not in self.nodes:
+                self._register(node_id, current, current_parent, depth)
+                added.append(node_id)
+            else:
+                # 没有ID或ID重复的节点不登记，其子节点归到最近的已登记祖先下
+                node_id = current_parent
+            children = current.get("children") or []
+            for child in reversed(children):
+                stack.append((child, node_id, depth + 1))
+
+        # 先序序列逆序后子节点总在父节点之前，自底向上累计子树规模
+        added_ids = set(added)
+        for node_id in reversed(added):
+            parent = self.parents[node_id]
+            if parent in added_ids:
+                self.subtree_sizes[parent] += self.subtree_sizes[node_id]
+
+        if added:
+            self._adjust_ancestor_sizes(parent_id, len(added))
+
+    def remove_subtree(self, node_id: str) -> List[str]:
+        """注销一棵子树中的所有节点，返回被移除的ID"""
+        node = self.nodes.get(node_id)
+        if node is None:
+            return []
+
+        parent_id = self.parents.get(node_id)
+        removed = []
+        for current, _ in self.iter_nodes(node):
+            current_id = current.get("id")
+            if current_id is None or self.nodes.get(current_id) is not current:
+                continue
+            self._unregister(current_id)
+            removed.append(current_id)
+
+        self._adjust_ancestor_sizes(parent_id, -len(removed))
+        if not self.depth_counts.get(self.max_depth):
+            self.max_depth = max(self.depth_counts) if self.depth_counts else 0
+        return removed
+
+    def replace(self, node_id: str, new_node: Dict):
+        """将ID指向新的节点对象（路径复制后使用）"""
+        old_node = self.nodes.get(node_id)
+        if old_node is not None:
+            if old_node.get("title", "") != new_node.get("title", ""):
+                self._remove_title(node_id, old_node.get("title", ""))
+                self.titles[new_node.get("title", "")].append(node_id)
+            if old_node.get("type", "manual") != new_node.get("type", "manual"):
+                self._count_type(old_node, -1)
+                self._count_type(new_node, 1)
+            old_keywords = self.node_keywords(old_node)
+            new_keywords = self.node_keywords(new_node)
+            if old_keywords != new_keywords:
+                self._index_keywords(node_id, old_keywords, -1)
+                self._index_keywords(node_id, new_keywords, 1)
+            if (self.search_index is not None and
+                    InvertedIndex.node_fields(old_node) != InvertedIndex.node_fields(new_node)):
+                self.search_index.add_node(node_id, new_node)
+            if self.term_stats is not None:
+                old_text, new_text = node_text(old_node), node_text(new_node)
+                if old_text != new_text:
+                    self.term_stats.remove(self.term_extractor.terms(old_text))
+                    self.term_stats.add(self.term_extractor.terms(new_text))
+            if self.duplicate_index is not None:
+                old_text, new_text = duplicate_text(old_node), duplicate_text(new_node)
+                if old_text != new_text or old_node.get("type") != new_node.get("type"):
+                    self.duplicate_index.remove(node_id)
+                    if new_node.get("type") in NOTE_TYPES:
+                        self.duplicate_index.add(node_id, new_text)
+        self.nodes[node_id] = new_node
+
+    def touch(self, timestamp: Optional[str] = None):
+        """记录图谱最后修改时间"""
+        self.last_modified = timestamp or datetime.now().isoformat()
+
+    def get_subtree_size(self, node_id: str) -> int:
+        """子树节点数（含自身），节点不存在时返回0"""
+        return self.subtree_sizes.get(node_id, 0)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息（除逐个列出根节点的子树规模外均为 O(1)）"""
+        learning = self.type_counts.get("learning", 0)
+        questioning = self.type_counts.get("questioning", 0)
+        root_id = self.root.get("id")
+        return {
+            "total_nodes": len(self.nodes),
+            "learning_nodes": learning,
+            "questioning_nodes": questioning,
+            "manual_nodes": len(self.nodes) - learning - questioning,
+            "max_depth": self.max_depth,
+            "type_counts": dict(self.type_counts),
+            "subtree_counts": {
+                child["id"]: self.subtree_sizes[child["id"]]
+                for child in self.root.get("children") or []
+                if child.get("id") in self.subtree_sizes and self.parents.get(child["id"]) == root_id
+            },
+            "created_at": self.root.get("created_at"),
+            "updated_at": self.root.get("updated_at"),
+            "last_modified": self.last_modified
+        }
+
+    def _register(self, node_id: str, node: Dict, parent_id: Optional[str], depth: int):
+        self.nodes[node_id] = node
+        self.parents[node_id] = parent_id
+        self.titles[node.get("title", "")].append(node_id)
+
+        self.depths[node_id] = depth
+        self.subtree_sizes[node_id] = 1
+        self.depth_counts[depth] += 1
+        self.max_depth = max(self.max_depth, depth)
+        self._count_type(node, 1)
+        self._index_keywords(node_id, self.node_keywords(node), 1)
+
+        if self.search_index is not None:
+            self.search_index.add_node(node_id, node)
+        if self.term_stats is not None:
+            self.term_stats.add(self.term_extractor.terms(node_text(node)))
+        if self.duplicate_index is not None and node.get("type") in NOTE_TYPES:
+            self.duplicate_index.add(node_id, duplicate_text(node))
+
+    def _unregister(self, node_id: str):
+        node = self.nodes.pop(node_id)
+        self.parents.pop(node_id, None)
+        self._remove_title(node_id, node.get("title", ""))
+
+        depth = self.depths.pop(node_id)
+        self.subtree_sizes.pop(node_id, None)
+        self.depth_counts[depth] -= 1
+        if not self.depth_counts[depth]:
+            del self.depth_counts[depth]
+        self._count_type(node, -1)
+        self._index_keywords(node_id, self.node_keywords(node), -1)
+
+        if self.search_index is not None:
+            self.search_index.remove(node_id)
+        if self.term_stats is not None:
+            self.term_stats.remove(self.term_extractor.terms(node_text(node)))
+        if self.duplicate_index is not None:
+            self.duplicate_index.remove(node_id)
+
+    def _count_type(self, node: Dict, delta: int):
+        node_type = node.get("type", "manual")
+        self.type_counts[node_type] += delta
+        if not self.type_counts[node_type]:
+            del self.type_counts[node_type]
+
+    def _index_keywords(self, node_id: str, keywords: List[str], delta: int):
+        for keyword in keywords:
+            if delta > 0:
+                self.keyword_postings[keyword].add(node_id)
+            else:
+                ids = self.keyword_postings.get(keyword)
+                if ids is not None:
+                    ids.discard(node_id)
+                    if not ids:
+                        del self.keyword_postings[keyword]
+
+    def _adjust_ancestor_sizes(self, node_id: Optional[str], delta: int):
+        while node_id is not None:
+            self.subtree_sizes[node_id] += delta
+            node_id = self.parents.get(node_id)
+
+    def _remove_title(self, node_id: str, title: str):
+        ids = self.titles.get(title)
+        if ids and node_id in ids:
+            ids.remove(node_id)
+            if not ids:
+                del self.titles[title]
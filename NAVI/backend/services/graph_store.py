@@ -0,0 +1,175 @@
+import os
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import logging
+
+from .compact_graph import CompactNode, pack_graph, unpack_graph
+from .knowledge_service import KnowledgeGraphService
+from .storage_service import StorageService
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeGraphStore:
+    """服务端的用户知识图谱存储
+
+    内存中按LRU保留最近使用的用户图谱（工作集），首次访问时从 StorageService
+    懒加载，不存在时创建默认图谱。图谱发生变化时立即交给存储保存（启用写回
+    缓存时由 StorageService 合并短时间内的多次写入），因此淘汰时无需再次保存。
+    同一用户的修改串行执行，避免并发的读-改-写相互覆盖。
+
+    被淘汰的图谱转为紧凑节点形式（CompactNode）保留在第二层LRU中，
+    再次访问时直接还原，免去读盘和JSON解析。
+
+    工作集中每个图谱在 KnowledgeGraphService 中各有一份索引，索引缓存的大小
+    由工作集大小推出（max_graphs + index_headroom），余量留给不在工作集中的
+    图谱（旧客户端随请求发送的图谱），避免热图谱的索引被反复淘汰重建。
+    """
+
+    def __init__(self,
+                 storage: StorageService,
+                 knowledge_service: KnowledgeGraphService,
+                 max_graphs: int = 100,
+                 max_compact_graphs: int = 500,
+                 index_headroom: int = 64):
+        self.storage = storage
+        self.knowledge_service = knowledge_service
+        self.max_graphs = max_graphs
+        self.max_compact_graphs = max_compact_graphs
+        knowledge_service.max_cached_graphs = max_graphs + index_headroom
+
+        self._graphs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._compact: "OrderedDict[str, CompactNode]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+        self.hits = 0
+        self.compact_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+
+    @classmethod
+    def from_env(cls, storage: StorageService, knowledge_service: KnowledgeGraphService) -> "KnowledgeGraphStore":
+        """从环境变量读取工作集配置"""
+        return cls(
+            storage,
+            knowledge_service,
+            max_graphs=int(os.getenv("NAVI_GRAPH_CACHE_SIZE", "100")),
+            max_compact_graphs=int(os.getenv("NAVI_GRAPH_COMPACT_CACHE_SIZE", "500")),
+        )
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def get(self, user_id: str) -> Dict:
+        """获取用户图谱（只读，修改请使用 update/apply_patch）"""
+        graph = self._graphs.get(user_id)
+        if graph is not None:
+            self._graphs.move_to_end(user_id)
+            self.hits += 1
+            return graph
+
+        async with self._lock(user_id):
+            return await self._get_locked(user_id)
+
+    async def _get_locked(self, user_id: str) -> Dict:
+        # 等待锁期间可能已被其他请求加载
+        graph = self._graphs.get(user_id)
+        if graph is not None:
+            self._graphs.move_to_end(user_id)
+            self.hits += 1
+            return graph
+
+        compact = self._compact.pop(user_id, None)
+        if compact is not None:
+            self.compact_hits += 1
+            graph = unpack_graph(compact)
+        else:
+            self.misses += 1
+            graph = await self.storage.load_knowledge_graph(user_id)
+            if graph is None:
+                graph = self.knowledge_service.create_default_graph()
+        self._remember(user_id, graph)
+        return graph
+
+    async def update(self, user_id: str, mutate: Callable[[Dict], Dict]) -> Dict:
+        """以 mutate(graph) -> 新图谱 的方式修改用户图谱，有变化时写回存储"""
+        async with self._lock(user_id):
+            graph = await self._get_locked(user_id)
+            updated = mutate(graph)
+            if updated is not graph:
+                self.knowledge_service.release_index(graph)
+                self._remember(user_id, updated)
+                await self._flush(user_id, updated)
+            return updated
+
+    async def replace(self, user_id: str, graph: Dict) -> Dict:
+        """整图替换，版本号在当前版本基础上加一"""
+        def mutate(current: Dict) -> Dict:
+            replaced = dict(graph)
+            replaced["revision"] = current.get("revision", 0) + 1
+            return replaced
+
+        return await self.update(user_id, mutate)
+
+    async def apply_patch(self, user_id: str, operations: List[Dict], base_version: Optional[int] = None) -> Dict:
+        """对用户图谱原子地应用增量操作，返回 KnowledgeGraphService.apply_patch 的结果"""
+        result = {}
+
+        def mutate(graph: Dict) -> Dict:
+            result.update(self.knowledge_service.apply_patch(graph, operations, base_version))
+            return result["graph"]
+
+        await self.update(user_id, mutate)
+        return result
+
+    def _remember(self, user_id: str, graph: Dict):
+        self._graphs[user_id] = graph
+        self._graphs.move_to_end(user_id)
+
+        while len(self._graphs) > self.max_graphs:
+            evicted_id, evicted = self._graphs.popitem(last=False)
+            self.knowledge_service.release_index(evicted)
+            self._remember_compact(evicted_id, evicted)
+            lock = self._locks.get(evicted_id)
+            if lock is not None and not lock.locked():
+                del self._locks[evicted_id]
+            self.evictions += 1
+
+    def _remember_compact(self, user_id: str, graph: Dict):
+        if self.max_compact_graphs <= 0:
+            return
+        self._compact[user_id] = pack_graph(graph)
+        self._compact.move_to_end(user_id)
+        while len(self._compact) > self.max_compact_graphs:
+            self._compact.popitem(last=False)
+
+    async def _flush(self, user_id: str, graph: Dict):
+        if await self.storage.save_knowledge_graph(user_id, graph):
+            self.flush_count += 1
+        else:
+            self.flush_failures += 1
+            logger.error(f"知识图谱写回失败: {user_id}")
+
+    def get_stats(self) -> Dict:
+        """获取工作集统计信息"""
+        total = self.hits + self.compact_hits + self.misses
+        return {
+            "loaded_graphs": len(self._graphs),
+            "max_graphs": self.max_graphs,
+            "max_cached_indexes": self.knowledge_service.max_cached_graphs,
+            "compact_graphs": len(self._compact),
+            "max_compact_graphs": self.max_compact_graphs,
+            "hits": self.hits,
+            "compact_hits": self.compact_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.compact_hits) / total if total else 0.0,
+            "evictions": self.evictions,
+            "flush_count": self.flush_count,
+            "flush_failures": self.flush_failures
+        }
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import aiohttp
+from typing import Any, Dict, NamedTuple, Optional
+import logging
+from contextlib import asynccontextmanager
+
+from .single_flight import SingleFlight
+from .concurrency_limiter import AdaptiveLimiter
+from .retry_policy import RetryPolicy
+from .circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPResult(NamedTuple):
+    """一次上游请求的结果"""
+    status: int
+    data: Optional[Any]
+    text: str
+    headers: Dict[str, str]
+
+
+class DeepSeekHTTPClient:
+    """共享的DeepSeek HTTP连接池
+
+    所有智能体共用一个长连接的 aiohttp.ClientSession，避免每次调用
+    重新进行 DNS 解析、TCP 握手和 TLS 协商。
+    """
+
+    def __init__(self,
+                 max_connections: int = 100,
+                 max_connections_per_host: int = 20,
+                 keepalive_timeout: float = 60.0,
+                 dns_cache_ttl: int = 300,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = 60.0,
+                 total_timeout: float = 120.0,
+                 limiter: Optional[AdaptiveLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+
+        # 相同的进行中请求只发送一次
+        self.single_flight = SingleFlight()
+        # 自适应并发上限与重试策略
+        self.limiter = limiter or AdaptiveLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 上游故障时快速失败
+        self.breaker = breaker or CircuitBreaker()
+
+        # 连接池统计
+        self.request_count = 0
+        self.sessions_created = 0
+        self.retry_count = 0
+
+    @classmethod
+    def from_env(cls) -> "DeepSeekHTTPClient":
+        """从环境变量读取连接池配置"""
+        return cls(
+            max_connections=int(os.getenv("DEEPSEEK_MAX_CONNECTIONS", "100")),
+            max_connections_per_host=int(os.getenv("DEEPSEEK_MAX_CONNECTIONS_PER_HOST", "20")),
+            keepalive_timeout=float(os.getenv("DEEPSEEK_KEEPALIVE_TIMEOUT", "60")),
+            dns_cache_ttl=int(os.getenv("DEEPSEEK_DNS_CACHE_TTL", "300")),
+            connect_timeout=float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "10")),
+            read_timeout=float(os.getenv("DEEPSEEK_READ_TIMEOUT", "60")),
+            total_timeout=float(os.getenv("DEEPSEEK_TOTAL_TIMEOUT", "120")),
+            limiter=AdaptiveLimiter.from_env(),
+            retry_policy=RetryPolicy.from_env(),
+            breaker=CircuitBreaker.from_env(),
+        )
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self.sessions_created += 1
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def start(self):
+        """创建连接池（在应用启动时调用）"""
+        await self.get_session()
+        logger.info(f"DeepSeek连接池已创建 - 总连接数: {self.max_connections}, "
+                    f"单主机连接数: {self.max_connections_per_host}")
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """获取共享会话，必要时惰性创建"""
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    self._session = self._create_session()
+        return self._session
+
+    async def close(self):
+        """关闭连接池（在应用关闭时调用）"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("DeepSeek连接池已关闭")
+        self._session = None
+
+    @asynccontextmanager
+    async def post(self, url: str, headers: Dict, payload: Dict):
+        """在共享会话上发起POST请求
+
+        先取得并发槽位再检查熔断器，熔断器打开时立即抛出 CircuitOpenError，
+        排队中的请求不会占用半开状态的探测名额。请求占用一个并发槽位直到
+        响应处理完毕；状态码不是429/5xx且响应体（或流）完整读取后才记为成功，
+        读取中途的网络错误和超时记为失败。收到响应头的耗时用于调整并发上限。
+        """
+        await self.limiter.acquire()
+        try:
+            self.breaker.check()
+        except BaseException:
+            self.limiter.cancel()
+            raise
+        try:
+            session = await self.get_session()
+        except BaseException:
+            self.limiter.cancel()
+            self.breaker.release()
+            raise
+        self.request_count += 1
+
+        start_time = time.monotonic()
+        latency = None
+        success = False
+        cancelled = False
+        try:
+            async with session.post(url, headers=headers, json=payload) as response:
+                latency = time.monotonic() - start_time
+                status_ok = response.status != 429 and response.status < 500
+                try:
+                    yield response
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    raise
+                except Exception:
+                    # 调用方自身的错误（如解析失败），上游已正常响应
+                    success = status_ok
+                    raise
+            success = status_ok
+        except (asyncio.CancelledError, GeneratorExit):
+            cancelled = True
+            raise
+        finally:
+            if cancelled:
+                # 调用方放弃了请求（如客户端断开），不计入上游的成败
+                self.limiter.cancel()
+                self.breaker.release()
+            else:
+                self.limiter.release(latency, success)
+                if success:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+
+    @staticmethod
+    def request_key(url: str, headers: Dict, payload: Dict) -> str:
+        """相同URL、凭证和请求体的请求视为同一请求"""
+        raw = json.dumps([url, headers.get("Authorization", ""), payload],
+                         ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def request_json(self, url: str, headers: Dict, payload: Dict) -> HTTPResult:
+        """发起非流式JSON请求，并发的相同请求合并为一次上游调用"""
+        key = self.request_key(url, headers, payload)
+        return await self.single_flight.do(key, lambda: self._send(url, headers, payload))
+
+    async def _send(self, url: str, headers: Dict, payload: Dict) -> HTTPResult:
+        """发送请求，对429/5xx和网络错误按重试策略退避重试"""
+        attempt = 0
+        while True:
+            try:
+                result = await self._send_once(url, headers, payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                delay = self.retry_policy.compute_delay(attempt)
+                logger.warning(f"DeepSeek请求失败({e.__class__.__name__})，{delay:.2f}s后重试")
+            else:
+                if not self.retry_policy.should_retry(attempt, result.status):
+                    return result
+                retry_after = self.retry_policy.parse_retry_after(result.headers.get("Retry-After"))
+                delay = self.retry_policy.compute_delay(attempt, retry_after)
+                logger.warning(f"DeepSeek返回 {result.status}，{delay:.2f}s后重试")
+
+            attempt += 1
+            self.retry_count += 1
+            await asyncio.sleep(delay)
+
+    async def _send_once(self, url: str, headers: Dict, payload: Dict) -> HTTPResult:
+        async with self.post(url, headers, payload) as response:
+            if response.status == 200:
+                data = await response.json()
+                return HTTPResult(response.status, data, "", dict(response.headers))
+            error_text = await response.text()
+            return HTTPResult(response.status, None, error_text, dict(response.headers))
+
+    @property
+    def is_open(self) -> bool:
+        return self._session is not None and not self._session.closed
+
+    def get_stats(self) -> Dict:
+        """获取连接池统计信息"""
+        return {
+            "is_open": self.is_open,
+            "request_count": self.request_count,
+            "sessions_created": self.sessions_created,
+            "max_connections": self.max_connections,
+            "max_connections_per_host": self.max_connections_per_host,
+            "keepalive_timeout": self.keepalive_timeout,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "total_timeout": self.total_timeout,
+            "retry_count": self.retry_count,
+            "single_flight": self.single_flight.get_stats(),
+            "limiter": self.limiter.get_stats(),
+            "circuit_breaker": self.breaker.get_stats()
+        }
+
+
+_default_client: Optional[DeepSeekHTTPClient] = None
+
+
+def get_default_client() -> DeepSeekHTTPClient:
+    """进程内共享的默认连接池（按环境变量配置），未注入连接池的智能体都使用它"""
+    global _default_client
+    if _default_client is None:
+        _default_client = DeepSeekHTTPClient.from_env()
+    return _default_client
+
+
+async def close_default_client():
+    """关闭默认连接池（在应用关闭时调用）"""
+    if _default_client is not None:
+        await _default_client.close()
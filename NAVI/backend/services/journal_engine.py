@@ -0,0 +1,398 @@
+import os
+import copy
+import json
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import aiofiles
+
+from .serializer import Serializer
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_SNAPSHOT_SUFFIX = ".snapshot.json"
+_JOURNAL_SUFFIX = ".journal"
+_TMP_SUFFIX = ".tmp"
+
+
+class JournalCorruptionError(Exception):
+    """快照或日志无法重放（记录缺失、乱序或引用了不存在的节点）"""
+    pass
+
+
+def _is_node_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+
+def diff_document(old: Dict, new: Dict) -> List[Dict]:
+    """计算文档两个版本之间的变更记录
+
+    文档是嵌套字典，"children" 为子节点列表的字典按子节点 id 逐层比较。
+    新旧版本共享的子树（同一个对象）直接跳过，因此对写时复制的知识图谱，
+    开销只与修改路径上的节点数有关。每条记录形如：
+        {"path": [子节点id, ...], "set": {...}, "del": [...], "children": [...]}
+    children 中的元素是沿用的子节点 id，或者新加入（含移动而来）的完整子树。
+    """
+    ops = []
+    stack: List[Tuple[List, Dict, Dict]] = [([], old, new)]
+    while stack:
+        path, old_node, new_node = stack.pop()
+        old_children = old_node.get("children")
+        new_children = new_node.get("children")
+        diff_children = _is_node_list(old_children) and _is_node_list(new_children)
+
+        op: Dict[str, Any] = {}
+        changed = {}
+        for key, value in new_node.items():
+            if key == "children" and diff_children:
+                continue
+            old_value = old_node.get(key, _MISSING)
+            if old_value is _MISSING or (old_value is not value and old_value != value):
+                changed[key] = value
+        deleted = [key for key in old_node if key not in new_node]
+        if changed:
+            op["set"] = changed
+        if deleted:
+            op["del"] = deleted
+
+        pairs = []
+        if diff_children and not (len(old_children) == len(new_children) and
+                                  all(a is b for a, b in zip(old_children, new_children))):
+            old_by_id: Dict[Any, Optional[Dict]] = {}
+            for child in old_children:
+                child_id = child.get("id")
+                # 同级重复的 id 无法用来定位，对应的子节点整体写入
+                old_by_id[child_id] = None if child_id in old_by_id else child
+            new_counts: Dict[Any, int] = {}
+            for child in new_children:
+                new_counts[child.get("id")] = new_counts.get(child.get("id"), 0) + 1
+
+            entries = []
+            for child in new_children:
+                child_id = child.get("id")
+                old_child = old_by_id.get(child_id) if child_id is not None else None
+                if old_child is None or new_counts[child_id] > 1:
+                    entries.append(child)
+                else:
+                    entries.append(child_id)
+                    if old_child is not child:
+                        pairs.append((path + [child_id], old_child, child))
+            op["children"] = entries
+
+        if op:
+            op["path"] = path
+            ops.append(op)
+        # 先序输出：父节点的 children 记录先于子节点的记录
+        stack.extend(reversed(pairs))
+
+    return ops
+
+
+def apply_ops(document: Dict, ops: List[Dict]):
+    """在文档上原地重放 diff_document 生成的变更记录
+
+    记录与文档对不上时抛出 JournalCorruptionError，此时文档可能已被部分修改。
+    """
+    for op in ops:
+        node = document
+        for child_id in op.get("path", ()):
+            node = next((child for child in node.get("children") or [] if child.get("id") == child_id), None)
+            if node is None:
+                raise JournalCorruptionError(f"变更路径中的节点不存在: {op.get('path')}")
+
+        for key in op.get("del", ()):
+            node.pop(key, None)
+        node.update(op.get("set", {}))
+
+        if "children" in op:
+            by_id = {}
+            for child in node.get("children") or []:
+                by_id.setdefault(child.get("id"), child)
+            missing = [entry for entry in op["children"] if not isinstance(entry, dict) and entry not in by_id]
+            if missing:
+                raise JournalCorruptionError(f"沿用的子节点不存在: {missing}")
+            node["children"] = [
+                entry if isinstance(entry, dict) else by_id[entry]
+                for entry in op["children"]
+            ]
+
+
+def _shadow(document: Dict) -> Dict:
+    """记录已写入的版本：根节点字段深拷贝（调用方可能原地修改，如会话），
+    子节点列表浅拷贝，子树按写时复制的约定与调用方共享"""
+    shadow = {}
+    for key, value in document.items():
+        if key == "children" and _is_node_list(value):
+            shadow[key] = list(value)
+        else:
+            shadow[key] = copy.deepcopy(value)
+    return shadow
+
+
+def _write_atomic(path: str, payload: bytes):
+    tmp_path = path + _TMP_SUFFIX
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class _JournalState:
+    __slots__ = ("document", "seq", "snapshot_seq", "journal_records", "journal_bytes",
+                 "snapshot_bytes", "needs_snapshot")
+
+    def __init__(self, document: Dict, seq: int = 0):
+        self.document = document
+        self.seq = seq
+        self.snapshot_seq = seq
+        self.journal_records = 0
+        self.journal_bytes = 0
+        self.snapshot_bytes = 0
+        self.needs_snapshot = False
+
+
+class JournalEngine:
+    """快照 + 只追加日志的存储引擎
+
+    每个用户每类数据对应一个快照文件（{kind}_{key}.snapshot.json）和一个日志文件
+    （{kind}_{key}.journal）。保存时与上次写入的版本做差异比较，只把变更记录
+    作为一行JSON追加到日志，开销与变化量成正比；日志条数或大小超过阈值时压缩：
+    原子地（临时文件 + os.replace）写入新快照并清空日志。
+
+    加载时读取快照并重放序号更大的日志行。进程在追加时崩溃留下的不完整末行
+    会被丢弃并截断；其他无法重放的情况（中间行损坏、序号不连续、记录引用的
+    节点不存在）抛出 JournalCorruptionError，文件保持原样，不会被当作文档
+    不存在而覆盖。没有快照时兼容读取 json 引擎的 {kind}_{key}.json 文件，
+    首次保存即转为快照。快照按 serializer 的格式编码，日志行始终是JSON。
+    """
+
+    def __init__(self,
+                 data_dir: str,
+                 serializer: Optional[Serializer] = None,
+                 compact_every: int = 200,
+                 compact_ratio: float = 1.0,
+                 min_compact_bytes: int = 64 * 1024,
+                 max_tracked: int = 256):
+        self.data_dir = data_dir
+        self.serializer = serializer or Serializer()
+        self.compact_every = compact_every
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self.max_tracked = max_tracked
+
+        # 最近访问文档的已写入版本（用于差异比较），按LRU淘汰
+        self._states: "OrderedDict[str, _JournalState]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+        self.appended_records = 0
+        self.appended_bytes = 0
+        self.compactions = 0
+        self.torn_records = 0
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = self._locks[name] = asyncio.Lock()
+        return lock
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.data_dir, name + suffix)
+
+    async def save(self, kind: str, key: str, data: Dict):
+        name = f"{kind}_{key}"
+        async with self._lock(name):
+            state = await self._get_state(name)
+            if state is None or state.needs_snapshot:
+                state = state or _JournalState({})
+                await self._compact(name, state, data)
+                self._remember(name, state)
+                return
+
+            ops = diff_document(state.document, data)
+            if ops:
+                seq = state.seq + 1
+                line = json.dumps({"seq": seq, "ops": ops}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                async with aiofiles.open(self._path(name, _JOURNAL_SUFFIX), 'a', encoding='utf-8') as f:
+                    await f.write(line)
+
+                size = len(line.encode("utf-8"))
+                state.seq = seq
+                state.journal_records += 1
+                state.journal_bytes += size
+                self.appended_records += 1
+                self.appended_bytes += size
+
+            state.document = _shadow(data)
+            if (state.journal_records >= self.compact_every or
+                    state.journal_bytes >= max(state.snapshot_bytes * self.compact_ratio, self.min_compact_bytes)):
+                await self._compact(name, state, data)
+
+    async def load(self, kind: str, key: str) -> Optional[Dict]:
+        name = f"{kind}_{key}"
+        async with self._lock(name):
+            state = await self._get_state(name)
+            if state is None:
+                return None
+            # 返回新的根节点，调用方原地修改不会影响已写入的版本
+            return _shadow(state.document)
+
+    async def _get_state(self, name: str) -> Optional[_JournalState]:
+        state = self._states.get(name)
+        if state is not None:
+            self._states.move_to_end(name)
+            return state
+
+        state = await self._read_state(name)
+        if state is not None:
+            self._remember(name, state)
+        return state
+
+    async def _read_state(self, name: str) -> Optional[_JournalState]:
+        snapshot_path = self._path(name, _SNAPSHOT_SUFFIX)
+        journal_path = self._path(name, _JOURNAL_SUFFIX)
+        legacy_path = self._path(name, ".json")
+
+        state = None
+        if os.path.exists(snapshot_path):
+            async with aiofiles.open(snapshot_path, 'rb') as f:
+                content = await f.read()
+            try:
+                snapshot = self.serializer.loads(content)
+                state = _JournalState(snapshot["data"], snapshot["seq"])
+            except Exception as e:
+                raise JournalCorruptionError(f"快照无法读取: {name}: {e}") from e
+            state.snapshot_bytes = len(content)
+        elif os.path.exists(legacy_path):
+            async with aiofiles.open(legacy_path, 'rb') as f:
+                state = _JournalState(self.serializer.loads(await f.read()))
+            state.needs_snapshot = True
+
+        if os.path.exists(journal_path):
+            async with aiofiles.open(journal_path, 'rb') as f:
+                content = await f.read()
+
+            if content and state is None:
+                logger.warning(f"日志缺少快照，从空文档重放: {name}")
+                state = _JournalState({})
+            offset = 0
+            lines = content.splitlines(keepends=True)
+            for number, line in enumerate(lines):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is None or not line.endswith(b"\n"):
+                    if number < len(lines) - 1:
+                        raise JournalCorruptionError(f"日志记录损坏: {name} @ {offset}")
+                    # 追加时崩溃留下的不完整末行：丢弃并截断，避免后续追加接在残行之后
+                    self.torn_records += 1
+                    logger.warning(f"丢弃不完整的日志记录: {name} @ {offset}")
+                    os.truncate(journal_path, offset)
+                    break
+
+                offset += len(line)
+                try:
+                    seq, ops = record["seq"], record["ops"]
+                except (KeyError, TypeError) as e:
+                    raise JournalCorruptionError(f"日志记录损坏: {name} @ {offset}") from e
+                if seq > state.seq:
+                    # 压缩前崩溃时日志开头可能是快照已包含的旧记录，其余记录必须连续
+                    if seq != state.seq + 1:
+                        raise JournalCorruptionError(f"日志序号不连续: {name}: {state.seq} -> {seq}")
+                    apply_ops(state.document, ops)
+                    state.seq = seq
+                    state.journal_records += 1
+            state.journal_bytes = offset
+
+        if state is not None:
+            state.document = _shadow(state.document)
+        return state
+
+    async def _compact(self, name: str, state: _JournalState, data: Dict):
+        """写入快照并清空日志
+
+        快照记录其包含的日志序号；若在清空日志前崩溃，重放时会跳过这些旧记录。
+        """
+        payload = self.serializer.dumps({"seq": state.seq, "data": data})
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _write_atomic, self._path(name, _SNAPSHOT_SUFFIX), payload)
+
+        journal_path = self._path(name, _JOURNAL_SUFFIX)
+        if os.path.exists(journal_path):
+            os.truncate(journal_path, 0)
+
+        state.document = _shadow(data)
+        state.snapshot_seq = state.seq
+        state.snapshot_bytes = len(payload)
+        state.journal_records = 0
+        state.journal_bytes = 0
+        state.needs_snapshot = False
+        self.compactions += 1
+
+    def _remember(self, name: str, state: _JournalState):
+        self._states[name] = state
+        self._states.move_to_end(name)
+        while len(self._states) > self.max_tracked:
+            evicted, _ = self._states.popitem(last=False)
+            lock = self._locks.get(evicted)
+            if lock is not None and not lock.locked():
+                del self._locks[evicted]
+
+    @staticmethod
+    def _document_name(filename: str) -> str:
+        for suffix in (_SNAPSHOT_SUFFIX + _TMP_SUFFIX, _SNAPSHOT_SUFFIX, _JOURNAL_SUFFIX, ".json"):
+            if filename.endswith(suffix):
+                return filename[:-len(suffix)]
+        return filename
+
+    async def keys(self, kind: str) -> List[str]:
+        prefix = f"{kind}_"
+        return sorted({
+            self._document_name(filename)[len(prefix):]
+            for filename in os.listdir(self.data_dir)
+            if filename.startswith(prefix) and not filename.endswith(_TMP_SUFFIX)
+        })
+
+    async def cleanup(self, cutoff: datetime) -> int:
+        # 快照和日志同属一个文档，按其中最新的修改时间整体删除
+        groups: Dict[str, List[str]] = {}
+        for filename in os.listdir(self.data_dir):
+            file_path = os.path.join(self.data_dir, filename)
+            if os.path.isfile(file_path):
+                groups.setdefault(self._document_name(filename), []).append(file_path)
+
+        deleted_count = 0
+        for name, paths in groups.items():
+            file_time = datetime.fromtimestamp(max(os.path.getmtime(path) for path in paths))
+            if file_time < cutoff:
+                for path in paths:
+                    os.remove(path)
+                    deleted_count += 1
+                self._states.pop(name, None)
+                logger.info(f"删除过期文档: {name}")
+
+        return deleted_count
+
+    async def stats(self) -> Dict:
+        total_size = 0
+        file_count = 0
+        for filename in os.listdir(self.data_dir):
+            file_path = os.path.join(self.data_dir, filename)
+            if os.path.isfile(file_path):
+                total_size += os.path.getsize(file_path)
+                file_count += 1
+
+        return {
+            "total_files": file_count,
+            "total_size_bytes": total_size,
+            "tracked_documents": len(self._states),
+            "appended_records": self.appended_records,
+            "appended_bytes": self.appended_bytes,
+            "compactions": self.compactions,
+            "torn_records": self.torn_records
+        }
@@ -0,0 +1,168 @@
+import re
+import math
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+_LATIN_PATTERN = re.compile(r"[a-z][a-z0-9+#]*")
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]+")
+# 助词、系动词、连词等虚字：出现即作为中文片段的分隔符
+_SPLIT_PATTERN = re.compile(r"[的了吗呢吧啊呀么是在和与及或把被让给从很都也就]+")
+
+STOPWORDS = frozenset({
+    '一个', '什么', '怎么', '为什么', '如何', '我们', '你们', '他们', '这个', '那个', '这些', '那些',
+    '可以', '没有', '自己', '就是', '还是', '因为', '所以', '但是', '如果', '需要', '进行', '通过',
+    '以及', '或者', '然后', '是否', '一下', '时候', '问题', '这样', '那样', '什么是',
+    'the', 'is', 'are', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'with', 'what', 'how', 'why',
+    'this', 'that', 'it', 'be', 'an', 'as', 'by', 'can', 'do', 'does'
+})
+# 以这些字开头或结尾的中文n-gram多为跨词片段，不作为关键词
+EDGE_STOP_CHARS = frozenset('我你他她它这那一不个而')
+
+
+def node_text(node: Dict) -> str:
+    """节点中用于关键词统计的文本：优先使用原始问答，否则使用标题和内容"""
+    metadata = node.get("metadata") or {}
+    parts = [
+        metadata.get("user_question"),
+        metadata.get("learning_response"),
+        metadata.get("questioning_response")
+    ]
+    parts = [part for part in parts if part]
+    if not parts:
+        parts = [node.get("title", ""), node.get("content", "")]
+    return " ".join(parts)
+
+
+class DocumentFrequencies:
+    """文档频率统计（每个用户/图谱一份），用于TF-IDF加权"""
+
+    def __init__(self):
+        self.doc_count = 0
+        self.doc_freq: Counter = Counter()
+
+    def add(self, terms: Iterable[str]):
+        self.doc_count += 1
+        self.doc_freq.update(set(terms))
+
+    def remove(self, terms: Iterable[str]):
+        self.doc_count = max(self.doc_count - 1, 0)
+        for term in set(terms):
+            self.doc_freq[term] -= 1
+            if self.doc_freq[term] <= 0:
+                del self.doc_freq[term]
+
+    def copy(self) -> "DocumentFrequencies":
+        stats = DocumentFrequencies()
+        stats.doc_count = self.doc_count
+        stats.doc_freq = self.doc_freq.copy()
+        return stats
+
+    def idf(self, term: str) -> float:
+        return math.log((1 + self.doc_count) / (1 + self.doc_freq.get(term, 0))) + 1.0
+
+
+class KeywordExtractor:
+    """关键词提取器
+
+    英文按单词切分，中文先在虚字处断开，再把短片段整体（及其二元组）、
+    长片段的二元组作为候选词。候选词按 TF-IDF 打分（提供文档频率统计时），
+    较长的候选词略有加权，被更高分候选词包含的子串不再重复输出。
+    正则和停用词表在模块加载时构建，实例可在多个请求间复用。
+    """
+
+    def __init__(self,
+                 stopwords: frozenset = STOPWORDS,
+                 max_segment_length: int = 4,
+                 length_boost: float = 0.15):
+        self.stopwords = stopwords
+        self.max_segment_length = max_segment_length
+        self.length_boost = length_boost
+
+    def terms(self, text: str) -> List[str]:
+        """将文本切分为候选词（保留重复，用于统计词频）"""
+        if not text:
+            return []
+
+        text = unicodedata.normalize("NFKC", text).lower()
+        terms = [
+            word for word in _LATIN_PATTERN.findall(text)
+            if len(word) > 1 and word not in self.stopwords
+        ]
+
+        for run in _CJK_PATTERN.findall(text):
+            for segment in _SPLIT_PATTERN.split(run):
+                terms.extend(self._segment_terms(segment))
+
+        return terms
+
+    def _segment_terms(self, segment: str) -> List[str]:
+        if len(segment) < 2:
+            return []
+
+        candidates = [segment] if len(segment) <= self.max_segment_length else []
+        if len(segment) > 2:
+            candidates.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+
+        return [
+            term for term in candidates
+            if term not in self.stopwords
+            and term[0] not in EDGE_STOP_CHARS
+            and term[-1] not in EDGE_STOP_CHARS
+        ]
+
+    def extract(self,
+                text: str,
+                top_k: int = 5,
+                stats: Optional[DocumentFrequencies] = None) -> List[str]:
+        """提取关键词
+
+        Args:
+            text: 待提取的文本
+            top_k: 返回的关键词数量
+            stats: 语料的文档频率统计，为空时只按词频打分
+        """
+        return self._rank(self.terms(text), top_k, stats)
+
+    def extract_batch(self,
+                      texts: List[str],
+                      top_k: int = 5,
+                      stats: Optional[DocumentFrequencies] = None,
+                      update_stats: bool = True) -> List[List[str]]:
+        """批量提取关键词（导入或重建索引时使用）
+
+        每段文本只切分一次；update_stats=True 时先把整批文本计入文档频率，
+        使同一批内的文本也能相互参照。
+        """
+        all_terms = [self.terms(text) for text in texts]
+
+        if stats is None:
+            stats = DocumentFrequencies()
+            update_stats = True
+        if update_stats:
+            for terms in all_terms:
+                stats.add(terms)
+
+        return [self._rank(terms, top_k, stats) for terms in all_terms]
+
+    def _rank(self, terms: List[str], top_k: int, stats: Optional[DocumentFrequencies]) -> List[str]:
+        if not terms:
+            return []
+
+        counts = Counter(terms)
+        total = len(terms)
+        scores = {}
+        for term, count in counts.items():
+            score = count / total * (1 + self.length_boost * (len(term) - 2))
+            if stats is not None:
+                score *= stats.idf(term)
+            scores[term] = score
+
+        keywords = []
+        for term in sorted(scores, key=lambda t: (-scores[t], -len(t), t)):
+            if any(term in chosen for chosen in keywords):
+                continue
+            keywords.append(term)
+            if len(keywords) >= top_k:
+                break
+        return keywords
@@ -1,17 +1,65 @@
-import json
 import uuid
-from typing import Dict, List, Optional, Any
+import base64
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
 import logging
 
+from .graph_index import GraphIndex, NOTE_TYPES
+from .near_duplicate import NearDuplicateIndex, duplicate_text
+from .keyword_extractor import KeywordExtractor, node_text
+
 logger = logging.getLogger(__name__)
 
 
 class KnowledgeGraphService:
-    """知识图谱服务"""
-
-    def __init__(self):
-        self.graph_cache = {}
+    """知识图谱服务
+
+    图谱以嵌套字典的形式在接口间传递，服务按根节点对象为每个图谱维护一份
+    GraphIndex（LRU缓存）。传入的图谱被视为不可变值：所有修改都以写时复制的
+    方式返回新图谱，新旧图谱共享未修改的子树，因此调用方不应原地修改已交给
+    服务的图谱或其返回值。
+    """
+
+    def __init__(self,
+                 max_cached_graphs: int = 64,
+                 min_parent_score: float = 1.0,
+                 max_parent_depth: int = 3,
+                 duplicate_threshold: float = 0.8):
+        self.max_cached_graphs = max_cached_graphs
+        # 父节点选择：候选得分下限，以及新节点父节点的最大深度
+        self.min_parent_score = min_parent_score
+        self.max_parent_depth = max_parent_depth
+        self.keyword_extractor = KeywordExtractor()
+        # 笔记问题的估计Jaccard相似度达到该值即视为近似重复
+        self.duplicate_threshold = duplicate_threshold
+        # id(根节点) -> GraphIndex
+        self.graph_cache: "OrderedDict[int, GraphIndex]" = OrderedDict()
+
+    def get_index(self, graph: Dict) -> GraphIndex:
+        """获取图谱索引，不存在时构建"""
+        key = id(graph)
+        index = self.graph_cache.get(key)
+        if index is not None and index.root is graph:
+            self.graph_cache.move_to_end(key)
+            return index
+
+        index = GraphIndex(graph)
+        self._cache_index(index)
+        return index
+
+    def release_index(self, graph: Dict):
+        """释放图谱的索引（图谱不再使用时调用）"""
+        index = self.graph_cache.get(id(graph))
+        if index is not None and index.root is graph:
+            del self.graph_cache[id(graph)]
+
+    def _cache_index(self, index: GraphIndex):
+        key = id(index.root)
+        self.graph_cache[key] = index
+        self.graph_cache.move_to_end(key)
+        while len(self.graph_cache) > self.max_cached_graphs:
+            self.graph_cache.popitem(last=False)
 
     def create_default_graph(self) -> Dict:
         """创建默认知识图谱"""
@@ -48,8 +96,16 @@ class KnowledgeGraphService:
                           graph: Dict,
                           user_question: str,
                           learning_response: str,
-                          questioning_response: Optional[str] = None) -> Dict:
-        """添加学习节点到知识图谱"""
+                          questioning_response: Optional[str] = None,
+                          dedupe: bool = True) -> Dict:
+        """添加学习节点到知识图谱
+
+        dedupe=True 时，若已有问题近似重复的学习笔记，则合并到该笔记而不新建节点。
+
+        写入时去重只作用于本方法和 add_questioning_node。服务端接口中的笔记由客户端
+        通过 /api/knowledge/update 的 add 操作以客户端生成的ID添加，写入时不去重
+        （合并会使客户端持有的节点ID失效），这部分重复由 scripts.dedupe_graphs 离线合并。
+        """
 
         # 创建新的学习节点
         new_node = {
@@ -63,11 +119,16 @@ class KnowledgeGraphService:
                 "user_question": user_question,
                 "learning_response": learning_response[:500],  # 截断以节省空间
                 "questioning_response": questioning_response[:500] if questioning_response else None,
-                "keywords": self._extract_keywords(user_question + " " + learning_response)
+                "keywords": self._extract_keywords(user_question + " " + learning_response, graph=graph)
             },
             "children": []
         }
 
+        if dedupe:
+            duplicate = self._find_duplicate(graph, new_node)
+            if duplicate is not None:
+                return self._merge_duplicate(graph, duplicate, new_node)
+
         # 确定插入位置
         target_parent = self._find_best_parent(graph, new_node)
 
@@ -81,8 +142,9 @@ class KnowledgeGraphService:
     def add_questioning_node(self,
                              graph: Dict,
                              user_question: str,
-                             questioning_response: str) -> Dict:
-        """添加质疑节点到知识图谱"""
+                             questioning_response: str,
+                             dedupe: bool = True) -> Dict:
+        """添加质疑节点到知识图谱（近似重复时合并，同 add_learning_node）"""
 
         new_node = {
             "id": f"questioning_{uuid.uuid4().hex[:8]}",
@@ -94,11 +156,16 @@ class KnowledgeGraphService:
             "metadata": {
                 "user_question": user_question,
                 "questioning_response": questioning_response[:500],
-                "keywords": self._extract_keywords(user_question + " " + questioning_response)
+                "keywords": self._extract_keywords(user_question + " " + questioning_response, graph=graph)
             },
             "children": []
         }
 
+        if dedupe:
+            duplicate = self._find_duplicate(graph, new_node)
+            if duplicate is not None:
+                return self._merge_duplicate(graph, duplicate, new_node)
+
         # 质疑节点通常添加到"问题思考"分类下
         questions_parent = self._find_node_by_id(graph, "questions")
         if not questions_parent:
@@ -114,112 +181,325 @@ class KnowledgeGraphService:
 
         return updated_graph
 
-    def update_node(self, graph: Dict, node_id: str, updates: Dict) -> Dict:
-        """更新知识图谱节点"""
+    def _find_duplicate(self, graph: Dict, new_node: Dict) -> Optional[Dict]:
+        """查找与新节点近似重复的同类型笔记"""
+        index = self.get_index(graph)
+        duplicates = index.get_duplicate_index(self.duplicate_threshold)
+        for node_id, similarity in duplicates.query(duplicate_text(new_node)):
+            node = index.get(node_id)
+            if node.get("type") == new_node.get("type"):
+                logger.info(f"发现近似重复笔记: {node_id} (相似度 {similarity:.2f})")
+                return node
+        return None
 
-        def update_recursive(node):
-            if node["id"] == node_id:
-                node.update(updates)
-                node["updated_at"] = datetime.now().isoformat()
-                return True
+    def _merge_duplicate(self, graph: Dict, existing: Dict, duplicate: Dict) -> Dict:
+        """将重复笔记合并到已有笔记：累计重复次数，补全已有笔记缺少的回答"""
+        metadata = dict(existing.get("metadata") or {})
+        duplicate_metadata = duplicate.get("metadata") or {}
+
+        metadata["duplicate_count"] = (metadata.get("duplicate_count", 0) +
+                                       duplicate_metadata.get("duplicate_count", 0) + 1)
+        metadata["last_asked_at"] = duplicate.get("updated_at") or datetime.now().isoformat()
+        for key in ("learning_response", "questioning_response"):
+            if not metadata.get(key) and duplicate_metadata.get(key):
+                metadata[key] = duplicate_metadata[key]
+
+        return self.update_node(graph, existing["id"], {"metadata": metadata})
+
+    def deduplicate_graph(self, graph: Dict) -> Tuple[Dict, List[Tuple[str, str]]]:
+        """批量去重：按先序保留先出现的笔记，把后出现的近似重复笔记合并进去
+
+        重复笔记的子节点移动到保留的笔记下，不会丢失。
+
+        Returns:
+            (去重后的图谱, [(被合并的节点ID, 保留的节点ID), ...])
+        """
+        index = self.get_index(graph)
+        notes = [
+            node for node, _ in index.iter_nodes()
+            if node.get("type") in NOTE_TYPES and node.get("id") is not None
+        ]
+
+        kept = NearDuplicateIndex(threshold=self.duplicate_threshold)
+        merges = []
+        for node in notes:
+            text = duplicate_text(node)
+            target_id = next(
+                (node_id for node_id, _ in kept.query(text)
+                 if index.get(node_id).get("type") == node.get("type")),
+                None
+            )
+            if target_id is None:
+                kept.add(node["id"], text)
+            else:
+                merges.append((node["id"], target_id))
 
-            if "children" in node:
-                for child in node["children"]:
-                    if update_recursive(child):
-                        return True
-            return False
+        for duplicate_id, target_id in merges:
+            duplicate = self.get_index(graph).get(duplicate_id)
+            for child in list(duplicate.get("children") or []):
+                graph = self.move_node(graph, child["id"], target_id)
+            graph = self._merge_duplicate(graph, self.get_index(graph).get(target_id), duplicate)
+            graph = self.delete_node(graph, duplicate_id)
 
-        updated_graph = json.loads(json.dumps(graph))  # 深拷贝
+        if merges:
+            logger.info(f"图谱去重: 合并 {len(merges)} 个重复笔记")
+        return graph, merges
 
-        if update_recursive(updated_graph):
-            logger.info(f"更新节点: {node_id}")
-            return updated_graph
-        else:
+    def update_node(self, graph: Dict, node_id: str, updates: Dict) -> Dict:
+        """更新知识图谱节点"""
+        index = self.get_index(graph)
+        path = index.path_to(node_id)
+        if path is None:
             logger.warning(f"未找到节点: {node_id}")
             return graph
 
+        updated_graph, copies = self._copy_path(index, path)
+        node = copies[-1]
+        node.update(updates)
+        node["updated_at"] = datetime.now().isoformat()
+
+        if "id" in updates or "children" in updates:
+            # 结构发生变化，新图谱的索引在下次访问时重建
+            self._drop_index(index)
+        else:
+            self._advance_index(index, updated_graph, path, copies)
+
+        logger.info(f"更新节点: {node_id}")
+        return updated_graph
+
     def delete_node(self, graph: Dict, node_id: str) -> Dict:
-        """删除知识图谱节点"""
+        """删除知识图谱节点（根节点不可删除）"""
+        index = self.get_index(graph)
+        path = index.path_to(node_id)
+        if path is None or len(path) < 2:
+            logger.warning(f"未找到可删除的节点: {node_id}")
+            return graph
 
-        def delete_recursive(node):
-            if "children" in node:
-                node["children"] = [
-                    child for child in node["children"]
-                    if child["id"] != node_id
-                ]
-                for child in node["children"]:
-                    delete_recursive(child)
+        updated_graph, copies = self._copy_path(index, path[:-1])
+        parent = copies[-1]
+        parent["children"] = [
+            child for child in parent["children"]
+            if child.get("id") != node_id
+        ]
 
-        updated_graph = json.loads(json.dumps(graph))  # 深拷贝
-        delete_recursive(updated_graph)
+        self._advance_index(index, updated_graph, path[:-1], copies)
+        index.remove_subtree(node_id)
 
         logger.info(f"删除节点: {node_id}")
         return updated_graph
 
-    def search_nodes(self, graph: Dict, query: str) -> List[Dict]:
-        """搜索知识图谱节点"""
-        results = []
-        query_lower = query.lower()
-
-        def search_recursive(node):
-            # 检查标题和内容
-            if (query_lower in node.get("title", "").lower() or
-                    query_lower in node.get("content", "").lower()):
-                results.append({
-                    "node": node,
-                    "relevance": self._calculate_relevance(node, query)
-                })
-
-            # 检查关键词
-            if "metadata" in node and "keywords" in node["metadata"]:
-                keywords = node["metadata"]["keywords"]
-                if any(query_lower in keyword.lower() for keyword in keywords):
-                    results.append({
-                        "node": node,
-                        "relevance": self._calculate_relevance(node, query)
-                    })
+    def move_node(self, graph: Dict, node_id: str, new_parent_id: str, position: Optional[int] = None) -> Dict:
+        """将节点（连同子树）移动到新的父节点下"""
+        index = self.get_index(graph)
+        node = index.get(node_id)
+        target_path = index.path_to(new_parent_id)
+        if node is None or target_path is None:
+            raise ValueError(f"节点不存在: {node_id if node is None else new_parent_id}")
+        if node_id in target_path:
+            raise ValueError(f"不能将节点移动到其自身的子树下: {node_id}")
+
+        updated_graph = self.delete_node(graph, node_id)
+        return self._insert_node(updated_graph, new_parent_id, node, position)
+
+    def apply_patch(self, graph: Dict, operations: List[Dict], base_version: Optional[int] = None) -> Dict:
+        """按顺序原子地应用一组增量操作
+
+        支持的操作（JSON-Patch 风格，按节点ID寻址）:
+            {"op": "add", "parent_id": ..., "node": {...}, "position": 可选}
+            {"op": "update", "id": ..., "fields": {...}}
+            {"op": "move", "id": ..., "parent_id": ..., "position": 可选}
+            {"op": "delete", "id": ...}
+
+        图谱根节点的 revision 字段即图谱版本，每次成功应用后加一；被修改的节点
+        记录修改时的版本。若操作的目标节点在 base_version 之后已被修改，或操作
+        本身无法执行，则整组操作都不生效，返回冲突列表。写时复制保证失败时原图谱
+        不受影响；索引随操作转移到中间版本上，失败时丢弃，原图谱的索引在下次使用时
+        重建，缓存中不会留下中间版本的索引。
+
+        Returns:
+            {"graph": 结果图谱, "version": 版本, "applied": 应用的操作数, "conflicts": [...]}
+        """
+        current_version = graph.get("revision", 0)
+        if base_version is None:
+            base_version = current_version
+        new_version = current_version + 1
+
+        if base_version > current_version:
+            return {"graph": graph, "version": current_version, "applied": 0, "conflicts": [
+                {"index": None, "op": None, "reason": f"版本 {base_version} 不存在，当前版本为 {current_version}"}
+            ]}
+
+        conflicts = []
+        working = graph
+        for position, operation in enumerate(operations):
+            try:
+                working = self._apply_operation(working, operation, base_version, new_version)
+            except (KeyError, ValueError, TypeError) as e:
+                conflicts.append({"index": position, "op": operation.get("op"), "reason": str(e)})
+
+        if conflicts or working is graph:
+            if conflicts:
+                logger.warning(f"增量更新冲突: {len(conflicts)} 个操作无法应用")
+                if working is not graph:
+                    self.release_index(working)
+            return {"graph": graph, "version": current_version, "applied": 0, "conflicts": conflicts}
+
+        # working 的根节点已是本次复制出的新对象，可以直接写入版本号
+        working["revision"] = new_version
+        logger.info(f"应用增量更新: {len(operations)} 个操作, 版本 {current_version} -> {new_version}")
+        return {"graph": working, "version": new_version, "applied": len(operations), "conflicts": []}
+
+    def _apply_operation(self, graph: Dict, operation: Dict, base_version: int, new_version: int) -> Dict:
+        index = self.get_index(graph)
+        op = operation.get("op")
+
+        if op == "add":
+            node = dict(operation["node"])
+            node.setdefault("id", f"manual_{uuid.uuid4().hex[:8]}")
+            self._check_new_ids(index, node)
+            now = datetime.now().isoformat()
+            node.setdefault("created_at", now)
+            node.setdefault("updated_at", now)
+            node.setdefault("children", [])
+            node["revision"] = new_version
+            parent_id = operation["parent_id"]
+            if parent_id not in index:
+                raise ValueError(f"父节点不存在: {parent_id}")
+            return self._insert_node(graph, parent_id, node, operation.get("position"))
+
+        node_id = operation["id"]
+        node = index.get(node_id)
+        if node is None:
+            raise ValueError(f"节点不存在: {node_id}")
+        # 本次操作组内新增或修改过的节点（版本为 new_version）不算冲突
+        if base_version < node.get("revision", 0) < new_version:
+            raise ValueError(f"节点 {node_id} 已在版本 {node['revision']} 被修改")
+
+        if op == "update":
+            fields = dict(operation["fields"])
+            if "id" in fields or "children" in fields:
+                raise ValueError("update 操作不能修改 id 或 children")
+            fields["revision"] = new_version
+            return self.update_node(graph, node_id, fields)
+
+        if op == "move":
+            moved = self.move_node(graph, node_id, operation["parent_id"], operation.get("position"))
+            return self.update_node(moved, node_id, {"revision": new_version})
+
+        if op == "delete":
+            if node is graph:
+                raise ValueError("不能删除根节点")
+            return self.delete_node(graph, node_id)
+
+        raise ValueError(f"未知操作: {op}")
+
+    @staticmethod
+    def _check_new_ids(index: GraphIndex, node: Dict):
+        """检查新增子树中的节点ID：每个节点都必须有ID，且不能与图谱中已有的节点
+        或子树内的其他节点重复（否则索引会把它的子节点挂到别的祖先下）"""
+        seen = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if not isinstance(current, dict):
+                raise ValueError("子节点必须是对象")
+            node_id = current.get("id")
+            if node_id is None:
+                raise ValueError(f"子节点缺少ID: {current.get('title', '')}")
+            if node_id in index or node_id in seen:
+                raise ValueError(f"节点已存在: {node_id}")
+            seen.add(node_id)
+            children = current.get("children") or []
+            if not isinstance(children, list):
+                raise ValueError(f"节点的 children 必须是列表: {node_id}")
+            stack.extend(children)
+
+    def search_nodes(self, graph: Dict, query: str, top_k: Optional[int] = None) -> List[Dict]:
+        """搜索知识图谱节点
+
+        基于图谱的BM25倒排索引检索标题、内容和关键词，结果按相关性降序排列，
+        每个节点最多出现一次。top_k 为空时返回全部命中节点。
+        """
+        index = self.get_index(graph)
+        hits = index.get_search_index().search(query, top_k)
+        return [index.nodes[node_id] for node_id, _ in hits]
+
+    def get_node_page(self, graph: Dict, node_id: str, limit: int = 20) -> Optional[Dict]:
+        """获取节点本身及其前 limit 个子节点的摘要（不含更深的子树）"""
+        index = self.get_index(graph)
+        node = index.get(node_id)
+        if node is None:
+            return None
 
-            if "children" in node:
-                for child in node["children"]:
-                    search_recursive(child)
+        page = self.get_children_page(graph, node_id, limit=limit)
+        return {
+            "node": self._node_summary(index, node),
+            "children": page["children"],
+            "next_cursor": page["next_cursor"]
+        }
 
-        search_recursive(graph)
+    def get_children_page(self, graph: Dict, node_id: str,
+                          cursor: Optional[str] = None, limit: int = 20) -> Optional[Dict]:
+        """游标分页获取子节点摘要
 
-        # 按相关性排序
-        results.sort(key=lambda x: x["relevance"], reverse=True)
+        游标记录上一页最后一个子节点的位置和ID；位置因插入/删除发生偏移时
+        按ID重新定位，因此翻页期间的修改不会导致重复或遗漏已返回之前的节点。
+        """
+        index = self.get_index(graph)
+        node = index.get(node_id)
+        if node is None:
+            return None
 
-        return [result["node"] for result in results]
+        children = node.get("children") or []
+        start = self._decode_cursor(cursor, children) if cursor else 0
+        page = children[start:start + limit]
+        end = start + len(page)
 
-    def get_graph_stats(self, graph: Dict) -> Dict:
-        """获取知识图谱统计信息"""
-        stats = {
-            "total_nodes": 0,
-            "learning_nodes": 0,
-            "questioning_nodes": 0,
-            "manual_nodes": 0,
-            "max_depth": 0,
-            "created_at": graph.get("created_at"),
-            "updated_at": graph.get("updated_at")
+        return {
+            "children": [self._node_summary(index, child) for child in page],
+            "total": len(children),
+            "next_cursor": self._encode_cursor(end - 1, page[-1]) if page and end < len(children) else None
         }
 
-        def count_recursive(node, depth=0):
-            stats["total_nodes"] += 1
-            stats["max_depth"] = max(stats["max_depth"], depth)
-
-            node_type = node.get("type", "manual")
-            if node_type == "learning":
-                stats["learning_nodes"] += 1
-            elif node_type == "questioning":
-                stats["questioning_nodes"] += 1
-            else:
-                stats["manual_nodes"] += 1
-
-            if "children" in node:
-                for child in node["children"]:
-                    count_recursive(child, depth + 1)
+    def get_ancestor_path(self, graph: Dict, node_id: str) -> Optional[List[Dict]]:
+        """获取从根节点到指定节点的路径（节点摘要列表）"""
+        index = self.get_index(graph)
+        path = index.path_to(node_id)
+        if path is None:
+            return None
+        return [self._node_summary(index, index.get(path_id)) for path_id in path]
+
+    def _node_summary(self, index: GraphIndex, node: Dict) -> Dict:
+        """节点摘要：去掉子树，附上子节点数和子树规模"""
+        summary = {key: value for key, value in node.items() if key != "children"}
+        summary["child_count"] = len(node.get("children") or [])
+        summary["subtree_size"] = index.get_subtree_size(node.get("id"))
+        return summary
+
+    @staticmethod
+    def _encode_cursor(position: int, child: Dict) -> str:
+        raw = f"{position}:{child.get('id', '')}"
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, children: List[Dict]) -> int:
+        """游标转换为下一页的起始位置"""
+        try:
+            position, child_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split(":", 1)
+            position = int(position)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("无效的分页游标")
+
+        if 0 <= position < len(children) and children[position].get("id") == child_id:
+            return position + 1
+        for i, child in enumerate(children):
+            if child.get("id") == child_id:
+                return i + 1
+        raise ValueError("分页游标对应的节点已不存在")
 
-        count_recursive(graph)
-        return stats
+    def get_graph_stats(self, graph: Dict) -> Dict:
+        """获取知识图谱统计信息（由索引增量维护，无需遍历图谱）"""
+        return self.get_index(graph).get_stats()
 
     def _extract_title(self, text: str, max_length: int = 30) -> str:
         """从文本中提取标题"""
@@ -248,131 +528,142 @@ class KnowledgeGraphService:
         content += f"记录时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         return content
 
-    def _extract_keywords(self, text: str, max_keywords: int = 5) -> List[str]:
-        """提取关键词"""
-        # 简单的关键词提取
-        import re
-
-        # 移除标点符号，分割单词
-        words = re.findall(r'[\u4e00-\u9fa5a-zA-Z0-9]+', text.lower())
-
-        # 过滤短词和停用词
-        stopwords = {'的', '了', '在', '是', '我', '有', '和', '就', '不', '人', '都', '一', '一个', '上', '也', '很', '到', '说', '要',
-                     '去', '你', '会', '着', '没有', '看', '好', '自己', '这'}
-
-        filtered_words = [word for word in words if len(word) > 1 and word not in stopwords]
-
-        # 简单的词频统计
-        word_count = {}
-        for word in filtered_words:
-            word_count[word] = word_count.get(word, 0) + 1
-
-        # 按频率排序，返回前N个
-        sorted_words = sorted(word_count.items(), key=lambda x: x[1], reverse=True)
-        return [word for word, count in sorted_words[:max_keywords]]
-
-    def _find_best_parent(self, graph: Dict, new_node: Dict) -> Dict:
-        """为新节点找到最佳父节点"""
-        # 简单的匹配逻辑：根据关键词相似度
-        new_keywords = set(new_node.get("metadata", {}).get("keywords", []))
-
-        best_parent = graph  # 默认父节点是根节点
-        best_score = 0
-
-        def find_recursive(node):
-            nonlocal best_parent, best_score
-
-            if node.get("type") == "system" and node.get("id") in ["learning_notes"]:
-                # 学习节点倾向于放在学习笔记下
-                if new_node.get("type") == "learning":
-                    return node
-
-            # 计算关键词相似度
-            node_keywords = set(node.get("metadata", {}).get("keywords", []))
-            common_keywords = new_keywords.intersection(node_keywords)
-            score = len(common_keywords)
-
-            if score > best_score:
-                best_score = score
-                best_parent = node
-
+    def _extract_keywords(self, text: str, max_keywords: int = 5, graph: Optional[Dict] = None) -> List[str]:
+        """提取关键词（提供图谱时按该用户语料的文档频率做TF-IDF加权）"""
+        stats = self.get_index(graph).get_term_stats(self.keyword_extractor) if graph is not None else None
+        return self.keyword_extractor.extract(text, max_keywords, stats)
+
+    def extract_keywords_batch(self,
+                               texts: List[str],
+                               graph: Optional[Dict] = None,
+                               max_keywords: int = 5) -> List[List[str]]:
+        """批量提取关键词，批内文本与图谱已有语料共同参与文档频率统计"""
+        stats = None
+        if graph is not None:
+            # 复制一份统计，避免把未入图的文本计入图谱的语料
+            stats = self.get_index(graph).get_term_stats(self.keyword_extractor).copy()
+        return self.keyword_extractor.extract_batch(texts, max_keywords, stats)
+
+    def reindex_keywords(self, graph: Dict, max_keywords: int = 5) -> Dict:
+        """用当前的提取器为图谱中的笔记节点重新提取关键词，返回新图谱"""
+        nodes = [node for node, _ in self.get_index(graph).iter_nodes()]
+        keywords = self.keyword_extractor.extract_batch(
+            [node_text(node) for node in nodes], max_keywords
+        )
+
+        # 逆先序处理，保证子节点的副本先于父节点生成
+        copies: Dict[int, Dict] = {}
+        for node, node_keywords in zip(reversed(nodes), reversed(keywords)):
+            copy = dict(node)
+            metadata = node.get("metadata")
+            if metadata and ("keywords" in metadata or "user_question" in metadata):
+                copy["metadata"] = {**metadata, "keywords": node_keywords}
             if "children" in node:
-                for child in node["children"]:
-                    result = find_recursive(child)
-                    if result:
-                        return result
+                copy["children"] = [copies.pop(id(child)) for child in node["children"]]
+            copies[id(node)] = copy
 
-            return None
+        logger.info(f"重新提取关键词: {len(nodes)} 个节点")
+        return copies[id(graph)]
 
-        result = find_recursive(graph)
-        return result if result else best_parent
+    def _find_best_parent(self, graph: Dict, new_node: Dict) -> Dict:
+        """为新节点找到最佳父节点
+
+        通过关键词倒排表只对与新节点有共同关键词的候选节点打分，得分为共同
+        关键词的IDF之和。得分最高且达到 min_parent_score 的候选作为父节点；
+        候选过深时改挂到其位于 max_parent_depth 层的祖先（主题）下，避免相关
+        笔记串成长链。没有合适候选时，学习节点放在"学习笔记"下，其余放在根节点。
+        """
+        index = self.get_index(graph)
+        new_keywords = set(index.node_keywords(new_node))
+
+        scores: Dict[str, float] = {}
+        for keyword in new_keywords:
+            candidates = index.keyword_postings.get(keyword)
+            if not candidates:
+                continue
+            weight = index.keyword_idf(keyword)
+            for node_id in candidates:
+                scores[node_id] = scores.get(node_id, 0.0) + weight
+
+        if scores:
+            # 同分时取较浅的节点，再按ID保证结果稳定
+            best_id = max(scores, key=lambda node_id: (scores[node_id], -index.depth(node_id), node_id))
+            if scores[best_id] >= self.min_parent_score:
+                if index.depth(best_id) > self.max_parent_depth:
+                    best_id = index.path_to(best_id)[self.max_parent_depth]
+                return index.get(best_id)
+
+        if new_node.get("type") == "learning":
+            learning_notes = index.get("learning_notes")
+            if learning_notes is not None:
+                return learning_notes
+
+        return graph
 
     def _find_node_by_id(self, graph: Dict, node_id: str) -> Optional[Dict]:
         """根据ID查找节点"""
-        if graph.get("id") == node_id:
-            return graph
-
-        if "children" in graph:
-            for child in graph["children"]:
-                result = self._find_node_by_id(child, node_id)
-                if result:
-                    return result
-
-        return None
+        return self.get_index(graph).get(node_id)
 
     def _find_node_by_title(self, graph: Dict, title: str) -> Optional[Dict]:
         """根据标题查找节点"""
-        if graph.get("title") == title:
+        return self.get_index(graph).find_by_title(title)
+
+    def _copy_path(self, index: GraphIndex, path: List[str]) -> Tuple[Dict, List[Dict]]:
+        """写时复制：只浅拷贝从根节点到目标节点路径上的节点
+
+        路径之外的子树在新旧图谱之间共享，因此单次修改的开销是 O(depth)
+        加上路径上各节点的子节点数，而不是整个图谱的大小。
+
+        Returns:
+            (新的根节点, 路径上各节点的新副本)
+        """
+        new_root = dict(index.root)
+        copies = [new_root]
+
+        current = new_root
+        for node_id in path[1:]:
+            original = index.get(node_id)
+            children = list(current["children"])
+            position = next((i for i, child in enumerate(children) if child is original), None)
+            if position is None:
+                raise ValueError(f"索引中的父节点与图谱不一致: {node_id}")
+            copy = dict(original)
+            children[position] = copy
+            current["children"] = children
+            copies.append(copy)
+            current = copy
+
+        return new_root, copies
+
+    def _advance_index(self, index: GraphIndex, new_root: Dict, path: List[str], copies: List[Dict]):
+        """将索引转移到新版本图谱上（旧版本再次使用时重建索引）"""
+        self._drop_index(index)
+        for node_id, copy in zip(path, copies):
+            index.replace(node_id, copy)
+        index.root = new_root
+        index.touch()
+        self._cache_index(index)
+
+    def _drop_index(self, index: GraphIndex):
+        key = id(index.root)
+        if self.graph_cache.get(key) is index:
+            del self.graph_cache[key]
+
+    def _insert_node(self, graph: Dict, parent_id: str, new_node: Dict, position: Optional[int] = None) -> Dict:
+        """在指定父节点下插入新节点（position 为空时追加到末尾）"""
+        index = self.get_index(graph)
+        path = index.path_to(parent_id)
+        if path is None:
+            logger.warning(f"未找到父节点: {parent_id}")
             return graph
 
-        if "children" in graph:
-            for child in graph["children"]:
-                result = self._find_node_by_title(child, title)
-                if result:
-                    return result
-
-        return None
-
-    def _insert_node(self, graph: Dict, parent_id: str, new_node: Dict) -> Dict:
-        """在指定父节点下插入新节点"""
-        updated_graph = json.loads(json.dumps(graph))  # 深拷贝
+        updated_graph, copies = self._copy_path(index, path)
+        parent = copies[-1]
+        children = list(parent.get("children", []))
+        children.insert(len(children) if position is None else position, new_node)
+        parent["children"] = children
+        parent["updated_at"] = datetime.now().isoformat()
 
-        def insert_recursive(node):
-            if node["id"] == parent_id:
-                if "children" not in node:
-                    node["children"] = []
-                node["children"].append(new_node)
-                node["updated_at"] = datetime.now().isoformat()
-                return True
-
-            if "children" in node:
-                for child in node["children"]:
-                    if insert_recursive(child):
-                        return True
-            return False
-
-        insert_recursive(updated_graph)
+        self._advance_index(index, updated_graph, path, copies)
+        index.add_subtree(new_node, parent_id)
         return updated_graph
-
-    def _calculate_relevance(self, node: Dict, query: str) -> float:
-        """计算节点与查询的相关性"""
-        relevance = 0.0
-        query_lower = query.lower()
-
-        # 标题匹配
-        title = node.get("title", "").lower()
-        if query_lower in title:
-            relevance += 0.5
-
-        # 内容匹配
-        content = node.get("content", "").lower()
-        if query_lower in content:
-            relevance += 0.3
-
-        # 关键词匹配
-        keywords = node.get("metadata", {}).get("keywords", [])
-        for keyword in keywords:
-            if query_lower in keyword.lower():
-                relevance += 0.2
-
-        return min(relevance, 1.0)
\ No newline at end of file
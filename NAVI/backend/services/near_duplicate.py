@@ -0,0 +1,136 @@
+import re
+import zlib
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+
+def duplicate_text(node: Dict) -> str:
+    """节点中用于查重的文本：用户的原始问题
+
+    同一个问题每次生成的回答都不同，回答不参与比较；没有原始问题的节点使用标题。
+    归一化（全半角、大小写、标点空白）由 MinHasher 完成。
+    """
+    metadata = node.get("metadata") or {}
+    return metadata.get("user_question") or node.get("title", "")
+
+
+class MinHasher:
+    """MinHash签名生成器
+
+    文本归一化（全半角统一、小写、去除标点空白）后切分为字符 shingle，
+    用 num_perm 组线性哈希 (a*x + b) mod p 取最小值作为签名。
+    两个签名相同位置取值相等的比例即两段文本 Jaccard 相似度的估计。
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        text = _NON_WORD_PATTERN.sub("", unicodedata.normalize("NFKC", text or "").lower())
+        if len(text) <= self.shingle_size:
+            return {text} if text else set()
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """计算文本的MinHash签名，空文本返回None"""
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) & _MERSENNE_PRIME for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        # a, x < 2^31，乘积不会溢出 uint64
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.count_nonzero(a == b)) / len(a)
+
+
+class NearDuplicateIndex:
+    """基于LSH分桶的近似重复检测索引
+
+    签名被切成 bands 段，每段作为一个桶键；至少有一段完全相同的文档成为候选，
+    再用签名估计的相似度确认是否达到 threshold。默认 16×4 的分段在相似度
+    约 0.5 以上开始召回，0.8 以上几乎必然召回。
+    """
+
+    def __init__(self, hasher: Optional[MinHasher] = None, bands: int = 16, threshold: float = 0.8):
+        self.hasher = hasher or MinHasher()
+        if self.hasher.num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.bands = bands
+        self.rows = self.hasher.num_perm // bands
+        self.threshold = threshold
+
+        self.signatures: Dict[str, np.ndarray] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.signatures
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def add(self, doc_id: str, text: str):
+        """添加（或替换）文档"""
+        self.remove(doc_id)
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return
+
+        self.signatures[doc_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_id: str):
+        signature = self.signatures.pop(doc_id, None)
+        if signature is None:
+            return
+
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(doc_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def query(self, text: str, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """查找与文本近似重复的文档，按相似度降序返回 (doc_id, similarity)"""
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return []
+        return self.query_signature(signature, exclude)
+
+    def query_signature(self, signature: np.ndarray, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        candidates: Set[str] = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        candidates.discard(exclude)
+
+        matches = []
+        for doc_id in candidates:
+            similarity = MinHasher.similarity(signature, self.signatures[doc_id])
+            if similarity >= self.threshold:
+                matches.append((doc_id, similarity))
+        matches.sort(key=lambda item: item[1], reverse=True)
+        return matches
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """智能体响应缓存
+
+    以 (agent_id, model, temperature, 归一化消息序列) 为键缓存DeepSeek的完整响应。
+    内存中按LRU淘汰，条目超过TTL后失效，可选地持久化到磁盘。
+    """
+
+    def __init__(self,
+                 max_entries: int = 1000,
+                 ttl_seconds: float = 24 * 3600,
+                 persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+
+        # key -> (写入时间戳, 响应数据)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.persist_path:
+            self.load()
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """从环境变量读取缓存配置"""
+        return cls(
+            max_entries=int(os.getenv("NAVI_RESPONSE_CACHE_SIZE", "1000")),
+            ttl_seconds=float(os.getenv("NAVI_RESPONSE_CACHE_TTL", str(24 * 3600))),
+            persist_path=os.getenv("NAVI_RESPONSE_CACHE_PATH") or None,
+        )
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """归一化文本：全半角统一、去除首尾空白、合并连续空白"""
+        text = unicodedata.normalize("NFKC", text or "")
+        return " ".join(text.split())
+
+    def make_key(self, agent_id: str, model: str, temperature: float, messages: List[Dict]) -> str:
+        """生成缓存键"""
+        normalized = [
+            [message.get("role", ""), self.normalize_text(message.get("content", ""))]
+            for message in messages
+        ]
+        raw = json.dumps([agent_id, model, round(temperature, 3), normalized],
+                         ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Dict]:
+        """读取缓存，未命中或已过期时返回None
+
+        过期条目在被LRU淘汰前仍保留在内存中，allow_stale=True 时可读取，
+        供上游不可用时降级使用。读到过期条目计入 stale_hits 而不是 hits；
+        降级读取发生在一次普通读取未命中之后，找不到条目时不再重复计入 misses。
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            if not allow_stale:
+                self.misses += 1
+            return None
+
+        stored_at, value = entry
+        expired = time.time() - stored_at > self.ttl_seconds
+        if expired and not allow_stale:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if expired:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict):
+        """写入缓存，超过容量时淘汰最久未使用的条目"""
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def load(self) -> int:
+        """从磁盘加载未过期的缓存条目"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return 0
+
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"加载响应缓存失败: {e}")
+            return 0
+
+        now = time.time()
+        for key, stored_at, value in entries:
+            if now - stored_at <= self.ttl_seconds:
+                self._entries[key] = (stored_at, value)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        logger.info(f"加载响应缓存: {len(self._entries)} 条")
+        return len(self._entries)
+
+    def save(self) -> bool:
+        """将缓存写入磁盘（先写临时文件再替换，避免写坏）"""
+        if not self.persist_path:
+            return False
+
+        try:
+            directory = os.path.dirname(self.persist_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            entries = [[key, stored_at, value] for key, (stored_at, value) in self._entries.items()]
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+
+            logger.info(f"保存响应缓存: {len(entries)} 条")
+            return True
+
+        except Exception as e:
+            logger.error(f"保存响应缓存失败: {e}")
+            return False
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "persist_path": self.persist_path
+        }
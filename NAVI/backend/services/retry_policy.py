@@ -0,0 +1,65 @@
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略
+
+    对 429 和 5xx 以及网络错误重试；若响应带有 Retry-After，
+    等待时间不少于服务端要求的时长。
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 8.0,
+                 max_retry_after: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """从环境变量读取重试配置"""
+        return cls(
+            max_retries=int(os.getenv("DEEPSEEK_MAX_RETRIES", "3")),
+            base_delay=float(os.getenv("DEEPSEEK_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("DEEPSEEK_RETRY_MAX_DELAY", "8")),
+        )
+
+    def should_retry(self, attempt: int, status: Optional[int] = None) -> bool:
+        """attempt 为已重试次数；status 为None表示网络错误"""
+        if attempt >= self.max_retries:
+            return False
+        return status is None or status in self.RETRY_STATUSES
+
+    def compute_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """计算第 attempt 次重试前的等待时间（full jitter）"""
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析 Retry-After 头（秒数或HTTP日期）"""
+        if not value:
+            return None
+
+        value = value.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,125 @@
+import re
+import math
+import heapq
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+_LATIN_PATTERN = re.compile(r"[a-z0-9]+")
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]+")
+
+
+def tokenize(text: str, unigrams: bool = False) -> List[str]:
+    """分词：拉丁字母/数字按单词切分，中文按相邻二元组（bigram）切分
+
+    单字成段的中文保留为单字词。unigrams=True 时额外输出每个中文单字，
+    用于建立索引，使"栈"这样的单字查询也能命中。
+    """
+    if not text:
+        return []
+
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = _LATIN_PATTERN.findall(text)
+    for run in _CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+            continue
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        if unigrams:
+            tokens.extend(run)
+    return tokens
+
+
+class InvertedIndex:
+    """BM25倒排索引
+
+    文档由标题、内容和关键词组成，标题词频按 title_weight 加权。
+    支持增量添加/删除文档，检索结果按文档去重并返回得分最高的 top_k 个。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, title_weight: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+
+        # term -> {doc_id: 词频}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # doc_id -> 文档词频表
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_terms
+
+    @staticmethod
+    def node_fields(node: Dict) -> Tuple[str, str, Tuple[str, ...]]:
+        """节点中参与检索的字段，用于判断节点是否需要重新索引"""
+        keywords = (node.get("metadata") or {}).get("keywords") or []
+        return node.get("title", ""), node.get("content", ""), tuple(keywords)
+
+    def add_node(self, doc_id: str, node: Dict):
+        title, content, keywords = self.node_fields(node)
+        self.add(doc_id, title, content + " " + " ".join(keywords))
+
+    def add(self, doc_id: str, title: str, body: str):
+        """添加（或替换）文档"""
+        if doc_id in self.doc_terms:
+            self.remove(doc_id)
+
+        terms = Counter(tokenize(body, unigrams=True))
+        for term in tokenize(title, unigrams=True):
+            terms[term] += self.title_weight
+
+        length = sum(terms.values())
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: str):
+        """删除文档"""
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        n = len(self.doc_terms)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """BM25检索，返回按得分降序排列的 (doc_id, score)"""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.doc_terms:
+            return []
+
+        avg_length = self.total_length / len(self.doc_terms) or 1.0
+        scores: Dict[str, float] = {}
+
+        for term in query_terms:
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if top_k is None:
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
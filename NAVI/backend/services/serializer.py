@@ -0,0 +1,137 @@
+import os
+import gzip
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 格式头：魔数 + 头版本 + 编码 + 压缩方式，共7字节
+MAGIC = b"NAVI"
+HEADER_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+CODECS = {"json": 1, "orjson": 2, "msgpack": 3}
+COMPRESSIONS = {"none": 0, "gzip": 1, "zstd": 2}
+
+_CODEC_NAMES = {value: key for key, value in CODECS.items()}
+_COMPRESSION_NAMES = {value: key for key, value in COMPRESSIONS.items()}
+# 这些编码的未压缩输出就是普通JSON，不加格式头，文件仍可直接阅读
+_PLAIN_JSON_CODECS = ("json", "orjson")
+
+
+class SerializationError(Exception):
+    """无法编码或解码存储数据"""
+    pass
+
+
+def _require(module: Any, name: str, package: str):
+    if module is None:
+        raise SerializationError(f"{name} 需要安装 {package}")
+
+
+class Serializer:
+    """存储数据的序列化器
+
+    编码可选 json（标准库）、orjson（更快的JSON编码器）、msgpack（二进制），
+    压缩可选 none、gzip、zstd。除未压缩的JSON外，输出以格式头开头，
+    读取时按格式头选择解码方式；没有格式头的数据按普通JSON读取，
+    因此切换格式后旧文件仍可透明读取。orjson、msgpack、zstandard 为可选依赖。
+    """
+
+    def __init__(self, codec: str = "json", compression: str = "none", level: int = 3):
+        if codec not in CODECS:
+            raise SerializationError(f"未知的编码: {codec}，可选 {', '.join(CODECS)}")
+        if compression not in COMPRESSIONS:
+            raise SerializationError(f"未知的压缩方式: {compression}，可选 {', '.join(COMPRESSIONS)}")
+        if codec == "orjson":
+            _require(orjson, "orjson 编码", "orjson")
+        elif codec == "msgpack":
+            _require(msgpack, "msgpack 编码", "msgpack")
+        if compression == "zstd":
+            _require(zstandard, "zstd 压缩", "zstandard")
+
+        self.codec = codec
+        self.compression = compression
+        self.level = level
+
+    @classmethod
+    def from_env(cls) -> "Serializer":
+        """从环境变量读取存储格式"""
+        return cls(
+            codec=os.getenv("NAVI_STORAGE_FORMAT", "json"),
+            compression=os.getenv("NAVI_STORAGE_COMPRESSION", "none"),
+        )
+
+    @property
+    def name(self) -> str:
+        return self.codec if self.compression == "none" else f"{self.codec}+{self.compression}"
+
+    def dumps(self, obj: Any) -> bytes:
+        payload = self._encode(obj)
+        if self.compression == "none" and self.codec in _PLAIN_JSON_CODECS:
+            return payload
+
+        header = MAGIC + bytes((HEADER_VERSION, CODECS[self.codec], COMPRESSIONS[self.compression]))
+        return header + self._compress(payload)
+
+    def loads(self, data: Any) -> Any:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not data.startswith(MAGIC):
+            return self._decode_json(data)
+
+        if len(data) < HEADER_SIZE or data[len(MAGIC)] != HEADER_VERSION:
+            raise SerializationError("不支持的格式头")
+        codec = _CODEC_NAMES.get(data[len(MAGIC) + 1])
+        compression = _COMPRESSION_NAMES.get(data[len(MAGIC) + 2])
+        if codec is None or compression is None:
+            raise SerializationError("未知的编码或压缩方式")
+
+        payload = self._decompress(data[HEADER_SIZE:], compression)
+        if codec == "msgpack":
+            _require(msgpack, "msgpack 解码", "msgpack")
+            return msgpack.unpackb(payload, raw=False)
+        return self._decode_json(payload)
+
+    def _encode(self, obj: Any) -> bytes:
+        if self.codec == "orjson":
+            return orjson.dumps(obj)
+        if self.codec == "msgpack":
+            return msgpack.packb(obj, use_bin_type=True)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def _decode_json(payload: bytes) -> Any:
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "gzip":
+            # mtime=0 使相同内容的压缩结果相同
+            return gzip.compress(payload, compresslevel=min(self.level, 9), mtime=0)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(payload)
+        return payload
+
+    @staticmethod
+    def _decompress(payload: bytes, compression: str) -> bytes:
+        if compression == "gzip":
+            return gzip.decompress(payload)
+        if compression == "zstd":
+            _require(zstandard, "zstd 解压", "zstandard")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        return payload
@@ -0,0 +1,183 @@
+import os
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Set
+import logging
+
+from .deepseek_service import DeepSeekService
+from .storage_service import StorageService
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSummarizer:
+    """会话滚动摘要
+
+    每个会话保存一段滚动摘要和尚未被摘要的最近几轮对话。每累计 refresh_every
+    轮新对话，就在后台用一次低 max_tokens 的调用把它们并入摘要，
+    使每轮提示词的大小不随会话长度增长。
+
+    内存中按LRU保留最近活跃的 max_sessions 个会话（每轮对话后都已保存，
+    淘汰时无需写回），正在刷新摘要的会话不会被淘汰。
+    """
+
+    SUMMARY_PROMPT = """你负责维护学习对话的滚动摘要。请将"已有摘要"与"新增对话"合并为一段新的摘要。
+
+要求：
+- 保留用户的学习目标、已掌握和尚未理解的知识点、重要结论
+- 删除寒暄和重复内容
+- 使用简洁的中文，不超过300字
+- 只输出摘要正文"""
+
+    def __init__(self,
+                 storage: StorageService,
+                 deepseek: DeepSeekService,
+                 refresh_every: int = 6,
+                 summary_max_tokens: int = 300,
+                 max_pending_turns: int = 24,
+                 max_sessions: int = 1000):
+        self.storage = storage
+        self.deepseek = deepseek
+        self.refresh_every = refresh_every
+        self.summary_max_tokens = summary_max_tokens
+        self.max_pending_turns = max_pending_turns
+        self.max_sessions = max_sessions
+
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.refresh_count = 0
+        self.refresh_failures = 0
+
+    @classmethod
+    def from_env(cls, storage: StorageService, deepseek: DeepSeekService) -> "ConversationSummarizer":
+        """从环境变量读取摘要配置"""
+        return cls(
+            storage,
+            deepseek,
+            refresh_every=int(os.getenv("NAVI_SUMMARY_EVERY_TURNS", "6")),
+            summary_max_tokens=int(os.getenv("NAVI_SUMMARY_MAX_TOKENS", "300")),
+            max_sessions=int(os.getenv("NAVI_SUMMARY_CACHE_SIZE", "1000")),
+        )
+
+    async def _get_session(self, session_id: str) -> Dict:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+
+        session = await self.storage.load_session(session_id) or {}
+        session.setdefault("session_id", session_id)
+        session.setdefault("summary", "")
+        session.setdefault("turns", [])
+        session.setdefault("turn_count", 0)
+        session.setdefault("summarized_turns", 0)
+        # 旧会话的对话没有序号，按 turn_count 倒推
+        first_seq = session["turn_count"] - len(session["turns"]) + 1
+        for offset, turn in enumerate(session["turns"]):
+            turn.setdefault("seq", first_seq + offset)
+
+        # 加载期间其他请求可能已经加载了同一会话
+        session = self._sessions.setdefault(session_id, session)
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        return session
+
+    def _evict(self):
+        for cached_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if cached_id not in self._refreshing:
+                del self._sessions[cached_id]
+
+    async def get_context(self, session_id: str) -> Dict:
+        """获取注入智能体的会话上下文：最近未摘要的对话和滚动摘要"""
+        session = await self._get_session(session_id)
+        return {
+            "conversation_history": list(session["turns"]),
+            "conversation_summary": session["summary"] or None
+        }
+
+    async def record_turn(self, session_id: str, user_message: str, response: str):
+        """记录一轮对话，必要时在后台刷新摘要"""
+        session = await self._get_session(session_id)
+        session["turn_count"] += 1
+        session["turns"].append({
+            "seq": session["turn_count"],
+            "content": user_message,
+            "response": response,
+            "timestamp": datetime.now().isoformat()
+        })
+
+        # 摘要持续失败时丢弃最旧的对话，避免无限增长
+        if len(session["turns"]) > self.max_pending_turns:
+            del session["turns"][:len(session["turns"]) - self.max_pending_turns]
+
+        await self.storage.save_session(session_id, session)
+
+        if len(session["turns"]) >= self.refresh_every and session_id not in self._refreshing:
+            self._refreshing.add(session_id)
+            task = asyncio.create_task(self._refresh(session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, session_id: str):
+        try:
+            session = await self._get_session(session_id)
+            turns = list(session["turns"])
+            if not turns:
+                return
+
+            dialogue = "\n".join(
+                f"用户: {turn['content']}\n助手: {turn['response']}" for turn in turns
+            )
+            messages = [
+                {"role": "system", "content": self.SUMMARY_PROMPT},
+                {"role": "user", "content": f"已有摘要：\n{session['summary'] or '（无）'}\n\n新增对话：\n{dialogue}"}
+            ]
+
+            result = await self.deepseek.chat_completion(
+                messages, temperature=0.3, max_tokens=self.summary_max_tokens
+            )
+            if not result.get("success"):
+                self.refresh_failures += 1
+                logger.warning(f"会话摘要刷新失败: {session_id} - {result.get('error')}")
+                return
+
+            summary = result["data"]["choices"][0]["message"]["content"].strip()
+
+            # 按序号移除已并入摘要的对话：刷新期间新增的对话保留，
+            # 期间因超出 max_pending_turns 被丢弃的对话也不会错删其他对话
+            last_seq = turns[-1]["seq"]
+            session["summary"] = summary
+            session["turns"] = [turn for turn in session["turns"] if turn["seq"] > last_seq]
+            session["summarized_turns"] += len(turns)
+            session["summary_updated_at"] = datetime.now().isoformat()
+            await self.storage.save_session(session_id, session)
+
+            self.refresh_count += 1
+            logger.info(f"会话摘要已刷新: {session_id}, 合并 {len(turns)} 轮对话")
+
+        except Exception as e:
+            self.refresh_failures += 1
+            logger.error(f"会话摘要刷新异常: {e}")
+        finally:
+            self._refreshing.discard(session_id)
+
+    async def wait_pending(self):
+        """等待所有后台摘要任务完成（在应用关闭时调用）"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        """获取摘要统计信息"""
+        return {
+            "cached_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "refreshing": len(self._refreshing),
+            "refresh_every": self.refresh_every,
+            "refresh_count": self.refresh_count,
+            "refresh_failures": self.refresh_failures
+        }
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """合并相同的进行中请求
+
+    同一个键上并发的调用只会触发一次上游请求，其余调用等待并共享同一个结果
+    （包括异常）。上游请求运行在独立任务中，发起者被取消不会影响其他等待者。
+    共享的结果对象应视为只读。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn()，若相同键的调用已在进行中则等待其结果"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+            self.leader_count += 1
+        else:
+            self.coalesced_count += 1
+            logger.debug(f"合并进行中的请求: {key[:12]}")
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 标记异常已被读取，避免无人等待时输出告警
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def get_stats(self) -> Dict:
+        """获取合并统计信息"""
+        return {
+            "in_flight": self.in_flight,
+            "upstream_requests": self.leader_count,
+            "coalesced_requests": self.coalesced_count
+        }
@@ -0,0 +1,139 @@
+import os
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+
+from .serializer import Serializer
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS idx_documents_updated_at ON documents (updated_at);
+"""
+
+
+class SQLiteEngine:
+    """SQLite 存储引擎
+
+    会话和知识图谱存放在同一个数据库文件的 documents 表中（WAL 模式，
+    读写互不阻塞），updated_at 建有索引，过期清理和统计都是索引查询，
+    无需遍历数据目录。连接只在一个专用线程中使用，所有阻塞调用都通过
+    run_in_executor 执行，不占用事件循环。
+
+    data 列按 serializer 的格式存放（未压缩JSON为文本，其余为二进制）。
+    数据库中没有的文档会尝试读取 json 引擎的 {kind}_{key}.json 文件并导入。
+    """
+
+    def __init__(self, data_dir: str, serializer: Optional[Serializer] = None, filename: str = "navi.db"):
+        self.data_dir = data_dir
+        self.serializer = serializer or Serializer()
+        self.path = os.path.join(data_dir, filename)
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="navi-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _save(self, kind: str, key: str, payload: bytes, updated_at: float):
+        self._connect().execute(
+            "INSERT INTO documents (kind, key, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (kind, key, payload, updated_at)
+        )
+
+    def _load(self, kind: str, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT data FROM documents WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        legacy_path = os.path.join(self.data_dir, f"{kind}_{key}.json")
+        if not os.path.exists(legacy_path):
+            return None
+        with open(legacy_path, "rb") as f:
+            payload = self.serializer.dumps(self.serializer.loads(f.read()))
+        self._save(kind, key, payload, os.path.getmtime(legacy_path))
+        logger.info(f"导入JSON文件到SQLite: {legacy_path}")
+        return payload
+
+    def _keys(self, kind: str) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT key FROM documents WHERE kind = ? ORDER BY key", (kind,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _cleanup(self, cutoff: float) -> int:
+        cursor = self._connect().execute("DELETE FROM documents WHERE updated_at < ?", (cutoff,))
+        return cursor.rowcount
+
+    def _stats(self) -> Dict:
+        conn = self._connect()
+        by_kind = {
+            kind: {"documents": count, "data_bytes": size}
+            for kind, count, size in conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0) FROM documents GROUP BY kind"
+            )
+        }
+        oldest, newest = conn.execute("SELECT MIN(updated_at), MAX(updated_at) FROM documents").fetchone()
+
+        files = [path for path in (self.path, self.path + "-wal", self.path + "-shm") if os.path.exists(path)]
+        return {
+            "total_files": len(files),
+            "total_size_bytes": sum(os.path.getsize(path) for path in files),
+            "total_documents": sum(item["documents"] for item in by_kind.values()),
+            "documents_by_kind": by_kind,
+            "oldest_updated_at": datetime.fromtimestamp(oldest).isoformat() if oldest else None,
+            "newest_updated_at": datetime.fromtimestamp(newest).isoformat() if newest else None
+        }
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def save(self, kind: str, key: str, data: Dict):
+        payload = self.serializer.dumps(data)
+        await self._run(self._save, kind, key, payload, time.time())
+
+    async def load(self, kind: str, key: str) -> Optional[Dict]:
+        payload = await self._run(self._load, kind, key)
+        return self.serializer.loads(payload) if payload is not None else None
+
+    async def keys(self, kind: str) -> List[str]:
+        return await self._run(self._keys, kind)
+
+    async def cleanup(self, cutoff: datetime) -> int:
+        deleted_count = await self._run(self._cleanup, cutoff.timestamp())
+        if deleted_count:
+            logger.info(f"删除过期文档: {deleted_count} 条")
+        return deleted_count
+
+    async def stats(self) -> Dict:
+        return await self._run(self._stats)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
@@ -1,4 +1,3 @@
-import json
 import os
 import asyncio
 from typing import Dict, List, Optional, Any
@@ -6,15 +5,139 @@ from datetime import datetime, timedelta
 import logging
 import aiofiles
 
+from .serializer import Serializer
+from .backup_store import BackupStore
+from .journal_engine import JournalCorruptionError, JournalEngine
+from .sqlite_engine import SQLiteEngine
+from .write_behind import WriteBehindEngine
+
 logger = logging.getLogger(__name__)
 
 
-class StorageService:
-    """存储服务 - 处理数据持久化"""
+class JsonFileEngine:
+    """默认存储引擎：每个用户每类数据一个文件，每次保存整体重写
+
+    文件名沿用 {kind}_{key}.json，内容按 serializer 的格式编码（可能带格式头）。
+    """
+
+    def __init__(self, data_dir: str, serializer: Optional[Serializer] = None):
+        self.data_dir = data_dir
+        self.serializer = serializer or Serializer()
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.data_dir, f"{kind}_{key}.json")
+
+    async def save(self, kind: str, key: str, data: Dict):
+        async with aiofiles.open(self._path(kind, key), 'wb') as f:
+            await f.write(self.serializer.dumps(data))
+
+    async def load(self, kind: str, key: str) -> Optional[Dict]:
+        file_path = self._path(kind, key)
+        if not os.path.exists(file_path):
+            return None
+
+        async with aiofiles.open(file_path, 'rb') as f:
+            content = await f.read()
+            return self.serializer.loads(content)
+
+    async def keys(self, kind: str) -> List[str]:
+        prefix, suffix = f"{kind}_", ".json"
+        return sorted(
+            filename[len(prefix):-len(suffix)]
+            for filename in os.listdir(self.data_dir)
+            if filename.startswith(prefix) and filename.endswith(suffix)
+        )
 
-    def __init__(self, data_dir: str = "data"):
+    async def cleanup(self, cutoff: datetime) -> int:
+        deleted_count = 0
+        for filename in os.listdir(self.data_dir):
+            file_path = os.path.join(self.data_dir, filename)
+
+            if os.path.isfile(file_path):
+                file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
+
+                if file_time < cutoff:
+                    os.remove(file_path)
+                    deleted_count += 1
+                    logger.info(f"删除过期文件: {filename}")
+
+        return deleted_count
+
+    async def stats(self) -> Dict:
+        total_size = 0
+        file_count = 0
+
+        for filename in os.listdir(self.data_dir):
+            file_path = os.path.join(self.data_dir, filename)
+            if os.path.isfile(file_path):
+                total_size += os.path.getsize(file_path)
+                file_count += 1
+
+        return {"total_files": file_count, "total_size_bytes": total_size}
+
+
+class StorageService:
+    """存储服务 - 处理数据持久化
+
+    具体的读写由存储引擎完成：
+    - json: 每个用户一个JSON文件，每次保存整体重写（默认）
+    - journal: 快照 + 只追加的变更日志，保存开销与变化量成正比
+    - sqlite: SQLite数据库（WAL模式），按 updated_at 索引清理和统计
+
+    write_behind_delay > 0 时在引擎外包一层写回缓存（WriteBehindEngine），
+    同一文档在该时间窗口内的多次保存合并为一次写入。写回缓存默认关闭：
+    启用后 save_* 返回 True 只表示数据已进入缓存，进程异常退出时最多丢失
+    最近 write_behind_delay * 5 秒内的保存（正常关闭时 close 会全部写入）。
+    """
+
+    ENGINES = ("json", "journal", "sqlite")
+
+    def __init__(self,
+                 data_dir: str = "data",
+                 engine: str = "json",
+                 serializer: Optional[Serializer] = None,
+                 write_behind_delay: float = 0.0,
+                 max_dirty: int = 1000):
         self.data_dir = data_dir
         self.ensure_data_directory()
+        self.backups = BackupStore(os.path.join(data_dir, "backups"))
+
+        self.serializer = serializer or Serializer()
+        if engine == "json":
+            self.engine = JsonFileEngine(data_dir, self.serializer)
+        elif engine == "journal":
+            self.engine = JournalEngine(data_dir, self.serializer)
+        elif engine == "sqlite":
+            self.engine = SQLiteEngine(data_dir, self.serializer)
+        else:
+            raise ValueError(f"未知的存储引擎: {engine}，可选 {', '.join(self.ENGINES)}")
+        self.engine_name = engine
+
+        if write_behind_delay > 0:
+            self.engine = WriteBehindEngine(self.engine, delay=write_behind_delay, max_dirty=max_dirty)
+
+    @classmethod
+    def from_env(cls, data_dir: Optional[str] = None) -> "StorageService":
+        """从环境变量读取数据目录和存储引擎，data_dir 不为空时覆盖 NAVI_DATA_DIR"""
+        return cls(
+            data_dir or os.getenv("NAVI_DATA_DIR", "data"),
+            engine=os.getenv("NAVI_STORAGE_ENGINE", "json"),
+            serializer=Serializer.from_env(),
+            write_behind_delay=float(os.getenv("NAVI_WRITE_BEHIND_SECONDS", "0")),
+            max_dirty=int(os.getenv("NAVI_WRITE_BEHIND_MAX_DIRTY", "1000")),
+        )
+
+    async def close(self):
+        """写入尚未落盘的数据并释放存储引擎持有的资源（应用关闭时调用）"""
+        close = getattr(self.engine, "close", None)
+        if close is not None:
+            await close()
+
+    def get_write_behind_stats(self) -> Optional[Dict]:
+        """获取写回缓存的统计信息（未启用时为 None）"""
+        if isinstance(self.engine, WriteBehindEngine):
+            return self.engine.get_stats()
+        return None
 
     def ensure_data_directory(self):
         """确保数据目录存在"""
@@ -23,15 +146,12 @@ class StorageService:
             logger.info(f"创建数据目录: {self.data_dir}")
 
     async def save_session(self, user_id: str, session_data: Dict) -> bool:
-        """保存用户会话数据"""
+        """保存用户会话数据（启用写回缓存时只保证已进入缓存）"""
         try:
-            file_path = os.path.join(self.data_dir, f"session_{user_id}.json")
-
             # 添加时间戳
             session_data["updated_at"] = datetime.now().isoformat()
 
-            async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(session_data, ensure_ascii=False, indent=2))
+            await self.engine.save("session", user_id, session_data)
 
             logger.info(f"保存会话数据: {user_id}")
             return True
@@ -41,32 +161,27 @@ class StorageService:
             return False
 
     async def load_session(self, user_id: str) -> Optional[Dict]:
-        """加载用户会话数据"""
-        try:
-            file_path = os.path.join(self.data_dir, f"session_{user_id}.json")
+        """加载用户会话数据
 
-            if not os.path.exists(file_path):
-                return None
-
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return json.loads(content)
+        数据损坏时抛出 JournalCorruptionError，而不是返回 None 让调用方当作新用户。
+        """
+        try:
+            return await self.engine.load("session", user_id)
 
+        except JournalCorruptionError:
+            raise
         except Exception as e:
             logger.error(f"加载会话数据失败: {e}")
             return None
 
     async def save_knowledge_graph(self, user_id: str, graph_data: Dict) -> bool:
-        """保存知识图谱数据"""
+        """保存知识图谱数据（启用写回缓存时只保证已进入缓存）"""
         try:
-            file_path = os.path.join(self.data_dir, f"knowledge_graph_{user_id}.json")
-
             # 添加版本信息和时间戳
             graph_data["version"] = "1.0.0"
             graph_data["updated_at"] = datetime.now().isoformat()
 
-            async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(graph_data, ensure_ascii=False, indent=2))
+            await self.engine.save("knowledge_graph", user_id, graph_data)
 
             logger.info(f"保存知识图谱: {user_id}")
             return True
@@ -76,70 +191,71 @@ class StorageService:
             return False
 
     async def load_knowledge_graph(self, user_id: str) -> Optional[Dict]:
-        """加载知识图谱数据"""
-        try:
-            file_path = os.path.join(self.data_dir, f"knowledge_graph_{user_id}.json")
-
-            if not os.path.exists(file_path):
-                return None
+        """加载知识图谱数据
 
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return json.loads(content)
+        数据损坏时抛出 JournalCorruptionError，避免调用方创建默认图谱覆盖原有数据。
+        """
+        try:
+            return await self.engine.load("knowledge_graph", user_id)
 
+        except JournalCorruptionError:
+            raise
         except Exception as e:
             logger.error(f"加载知识图谱失败: {e}")
             return None
 
+    async def list_graph_users(self) -> List[str]:
+        """列出已保存知识图谱的用户ID"""
+        return await self.engine.keys("knowledge_graph")
+
     async def backup_user_data(self, user_id: str) -> bool:
-        """备份用户数据"""
+        """备份用户数据（内容寻址的增量备份，未变化的部分不重复保存）"""
         try:
-            backup_dir = os.path.join(self.data_dir, "backups")
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = os.path.join(backup_dir, f"backup_{user_id}_{timestamp}.json")
-
             # 收集所有用户数据
-            session_data = await self.load_session(user_id)
-            knowledge_graph = await self.load_knowledge_graph(user_id)
-
-            backup_data = {
-                "user_id": user_id,
-                "backup_time": datetime.now().isoformat(),
-                "session_data": session_data,
-                "knowledge_graph": knowledge_graph
+            documents = {
+                "session_data": await self.load_session(user_id),
+                "knowledge_graph": await self.load_knowledge_graph(user_id)
             }
 
-            async with aiofiles.open(backup_file, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(backup_data, ensure_ascii=False, indent=2))
+            loop = asyncio.get_running_loop()
+            manifest = await loop.run_in_executor(None, self.backups.backup, user_id, documents)
 
-            logger.info(f"备份用户数据: {user_id} -> {backup_file}")
+            logger.info(f"备份用户数据: {user_id} -> {manifest['backup_id']} "
+                        f"(新增 {manifest['new_chunks']} 个分块, {manifest['new_bytes']} 字节)")
             return True
 
         except Exception as e:
             logger.error(f"备份用户数据失败: {e}")
             return False
 
-    async def cleanup_old_data(self, days: int = 30) -> int:
-        """清理过期数据"""
+    async def restore_user_data(self, user_id: str, backup_id: Optional[str] = None) -> bool:
+        """从备份还原用户数据，backup_id 为空时使用最新的备份"""
         try:
-            cutoff_date = datetime.now() - timedelta(days=days)
-            deleted_count = 0
+            loop = asyncio.get_running_loop()
+            documents = await loop.run_in_executor(None, self.backups.restore, user_id, backup_id)
+
+            if documents.get("session_data") is not None:
+                await self.save_session(user_id, documents["session_data"])
+            if documents.get("knowledge_graph") is not None:
+                await self.save_knowledge_graph(user_id, documents["knowledge_graph"])
 
-            for filename in os.listdir(self.data_dir):
-                file_path = os.path.join(self.data_dir, filename)
+            logger.info(f"还原用户数据: {user_id} <- {backup_id or '最新备份'}")
+            return True
 
-                if os.path.isfile(file_path):
-                    file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
+        except Exception as e:
+            logger.error(f"还原用户数据失败: {e}")
+            return False
 
-                    if file_time < cutoff_date:
-                        os.remove(file_path)
-                        deleted_count += 1
-                        logger.info(f"删除过期文件: {filename}")
+    async def gc_backups(self, keep_last: int = 24, max_age_days: Optional[float] = None) -> Dict:
+        """删除超出保留策略的备份并回收不再引用的分块"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.backups.gc, keep_last, max_age_days)
 
-            return deleted_count
+    async def cleanup_old_data(self, days: int = 30) -> int:
+        """清理过期数据"""
+        try:
+            cutoff_date = datetime.now() - timedelta(days=days)
+            return await self.engine.cleanup(cutoff_date)
 
         except Exception as e:
             logger.error(f"清理过期数据失败: {e}")
@@ -148,22 +264,17 @@ class StorageService:
     async def get_storage_stats(self) -> Dict:
         """获取存储统计信息"""
         try:
-            total_size = 0
-            file_count = 0
-
-            for filename in os.listdir(self.data_dir):
-                file_path = os.path.join(self.data_dir, filename)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
-                    file_count += 1
+            stats = await self.engine.stats()
+            total_size = stats["total_size_bytes"]
 
             return {
-                "total_files": file_count,
-                "total_size_bytes": total_size,
+                **stats,
                 "total_size_mb": round(total_size / (1024 * 1024), 2),
-                "data_directory": self.data_dir
+                "data_directory": self.data_dir,
+                "engine": self.engine_name,
+                "format": self.serializer.name
             }
 
         except Exception as e:
             logger.error(f"获取存储统计失败: {e}")
-            return {}
\ No newline at end of file
+            return {}
@@ -0,0 +1,203 @@
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _DirtyEntry:
+    __slots__ = ("data", "first_saved", "last_saved", "version")
+
+    def __init__(self, data: Dict, now: float):
+        self.data = data
+        self.first_saved = now
+        self.last_saved = now
+        self.version = 0
+
+
+class WriteBehindEngine:
+    """写回缓存：包装任意存储引擎，合并短时间内的重复保存
+
+    save 只把文档标记为脏并记录最新版本；文档在 delay 秒内没有新的保存
+    （或距第一次未写入的保存已超过 max_delay 秒）时由后台任务写入底层引擎。
+    脏文档数超过 max_dirty 时，最早变脏的文档立即写入（淘汰）；close 时
+    写入全部脏文档。读取优先返回尚未写入的版本。未写入的保存只在内存中，
+    进程异常退出时会丢失，丢失窗口最长为 max_delay 秒。
+
+    保存的文档在写入前仍被引用，调用方之后的原地修改也会被写入，
+    这与"保存最新状态"的语义一致。
+    """
+
+    def __init__(self, engine, delay: float = 2.0, max_delay: Optional[float] = None, max_dirty: int = 1000):
+        self.engine = engine
+        self.delay = delay
+        self.max_delay = max_delay if max_delay is not None else delay * 5
+        self.max_dirty = max_dirty
+
+        self._dirty: "OrderedDict[Tuple[str, str], _DirtyEntry]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.saves = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.flush_failures = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+
+    def _bind_loop(self):
+        # 锁和事件绑定在创建它们的事件循环上（测试中每个用例一个循环）
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = None
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def save(self, kind: str, key: str, data: Dict):
+        if self._closed:
+            await self.engine.save(kind, key, data)
+            return
+
+        self._bind_loop()
+        now = time.monotonic()
+        self.saves += 1
+        entry = self._dirty.get((kind, key))
+        if entry is not None:
+            entry.data = data
+            entry.last_saved = now
+            entry.version += 1
+            self.coalesced += 1
+        else:
+            self._dirty[(kind, key)] = _DirtyEntry(data, now)
+            while len(self._dirty) > self.max_dirty:
+                self.evictions += 1
+                if not await self._flush_key(next(iter(self._dirty))):
+                    # 写入失败或写入期间又有新的保存时暂时超出上限，由后台任务稍后处理
+                    break
+
+        self._ensure_task()
+        self._wakeup.set()
+
+    async def load(self, kind: str, key: str) -> Optional[Dict]:
+        entry = self._dirty.get((kind, key))
+        if entry is not None:
+            return entry.data
+        return await self.engine.load(kind, key)
+
+    async def keys(self, kind: str) -> List[str]:
+        keys = set(await self.engine.keys(kind))
+        keys.update(key for dirty_kind, key in self._dirty if dirty_kind == kind)
+        return sorted(keys)
+
+    async def cleanup(self, cutoff: datetime) -> int:
+        await self.flush()
+        return await self.engine.cleanup(cutoff)
+
+    async def stats(self) -> Dict:
+        stats = await self.engine.stats()
+        stats["write_behind"] = self.get_stats()
+        return stats
+
+    async def close(self):
+        """停止后台任务并写入全部脏文档"""
+        self._closed = True
+        self._bind_loop()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+        close = getattr(self.engine, "close", None)
+        if close is not None:
+            await close()
+
+    async def flush(self):
+        """立即写入全部脏文档"""
+        self._bind_loop()
+        for dirty_key in list(self._dirty):
+            await self._flush_key(dirty_key)
+
+    def _due_at(self, entry: _DirtyEntry) -> float:
+        return min(entry.last_saved + self.delay, entry.first_saved + self.max_delay)
+
+    async def _flush_loop(self):
+        while True:
+            if not self._dirty:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            due = [dirty_key for dirty_key, entry in self._dirty.items() if self._due_at(entry) <= now]
+            for dirty_key in due:
+                await self._flush_key(dirty_key)
+
+            if self._dirty:
+                # 之后的保存只会更晚到期，睡到当前最早的到期时间即可
+                next_due = min(self._due_at(entry) for entry in self._dirty.values())
+                await asyncio.sleep(max(next_due - time.monotonic(), 0.01))
+
+    async def _flush_key(self, dirty_key: Tuple[str, str]) -> bool:
+        """写入一个脏文档，返回该文档是否已不在脏表中
+
+        写入完成前文档一直留在脏表中，期间的读取仍能拿到最新版本；写入期间
+        有新的保存时保留文档，由后续的写入处理。
+        """
+        async with self._flush_lock:
+            entry = self._dirty.get(dirty_key)
+            if entry is None:
+                return True
+            version = entry.version
+
+            start = time.perf_counter()
+            try:
+                await self.engine.save(*dirty_key, entry.data)
+            except Exception as e:
+                self.flush_failures += 1
+                logger.error(f"写回失败: {dirty_key[0]}_{dirty_key[1]}: {e}")
+                # 写入期间没有新的保存时推迟到 delay 秒后重试
+                if entry.version == version:
+                    entry.first_saved = entry.last_saved = time.monotonic()
+                return False
+
+            elapsed = time.perf_counter() - start
+            self.writes += 1
+            self.flush_time_total += elapsed
+            self.flush_time_max = max(self.flush_time_max, elapsed)
+
+            if self._dirty.get(dirty_key) is entry and entry.version == version:
+                del self._dirty[dirty_key]
+                return True
+            return False
+
+    def get_stats(self) -> Dict:
+        return {
+            "dirty": len(self._dirty),
+            "max_dirty": self.max_dirty,
+            "delay_seconds": self.delay,
+            "saves": self.saves,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            # 每次保存实际产生的写入次数，小于1说明合并生效
+            "write_amplification": self.writes / self.saves if self.saves else 0.0,
+            "evictions": self.evictions,
+            "flush_failures": self.flush_failures,
+            "avg_flush_ms": self.flush_time_total / self.writes * 1000 if self.writes else 0.0,
+            "max_flush_ms": self.flush_time_max * 1000
+        }
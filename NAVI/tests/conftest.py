@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# 后端模块以 backend 目录为根导入（与 uvicorn main:app 的运行方式一致）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+# 测试期间的用户数据写入临时目录
+os.environ.setdefault("NAVI_DATA_DIR", tempfile.mkdtemp(prefix="navi-test-"))
@@ -52,6 +52,35 @@ class TestAgents:
             assert response['role'] == '批判思考助手'
             assert '质疑' in response['content']
 
+    @pytest.mark.asyncio
+    async def test_stream_response(self, learning_agent):
+        """测试流式响应先产出token，最后产出带元数据的done"""
+        async def fake_stream(messages):
+            for piece in ["递归", "是", "函数调用自身。"]:
+                yield {"choices": [{"delta": {"content": piece}}]}
+            yield {"choices": [], "usage": {"total_tokens": 42}}
+
+        with patch.object(learning_agent, 'stream_deepseek_api', fake_stream):
+            chunks = [chunk async for chunk in learning_agent.stream_response("什么是递归？", {})]
+
+        tokens = [c["content"] for c in chunks if c["type"] == "token"]
+        assert tokens == ["递归", "是", "函数调用自身。"]
+        done = chunks[-1]
+        assert done["type"] == "done"
+        assert done["response"]["content"] == "递归是函数调用自身。"
+        assert done["response"]["metadata"]["tokens_used"] == 42
+        assert learning_agent.total_tokens == 42
+
+    def test_history_packed_to_budget(self, learning_agent):
+        """测试对话历史按token预算装填，而不是固定保留3轮"""
+        short_history = [{"content": f"问题{i}", "sender": "user"} for i in range(6)]
+        messages = learning_agent._build_message_sequence("继续", {"conversation_history": short_history})
+        assert len(messages) == 2 + 6
+
+        long_history = [{"content": "很长的内容" * 2000, "sender": "user"} for _ in range(5)]
+        _, prompt_tokens = learning_agent._build_prompt("继续", {"conversation_history": long_history})
+        assert prompt_tokens <= learning_agent._get_prompt_budget() + 5
+
     def test_agent_weight_initialization(self, learning_agent, questioning_agent, balancing_agent):
         """测试智能体权重初始化"""
         assert learning_agent.base_weight == 1.618  # 黄金比例
@@ -62,4 +91,95 @@ class TestAgents:
         """测试温度参数设置"""
         assert learning_agent._get_temperature() == 0.3  # 较低，更确定性
         assert questioning_agent._get_temperature() == 0.7  # 较高，更创造性
-        assert balancing_agent._get_temperature() == 0.5  # 中等
\ No newline at end of file
+        assert balancing_agent._get_temperature() == 0.5  # 中等
+
+
+class TestHTTPClient:
+    def test_agents_share_http_client(self):
+        """测试智能体共享同一个连接池"""
+        from services.http_client import DeepSeekHTTPClient
+
+        client = DeepSeekHTTPClient(max_connections_per_host=5)
+        learning = DeepSeekLearningAgent("learning_agent", "test_api_key", http_client=client)
+        questioning = DeepSeekQuestioningAgent("questioning_agent", "test_api_key", http_client=client)
+
+        assert learning.http_client is questioning.http_client
+        assert client.get_stats()["max_connections_per_host"] == 5
+
+    def test_agents_default_to_shared_client(self):
+        """测试未注入连接池的智能体使用同一个默认连接池，而不是各建一个"""
+        from services.http_client import get_default_client
+
+        learning = DeepSeekLearningAgent("learning_agent", "test_api_key")
+        questioning = DeepSeekQuestioningAgent("questioning_agent", "test_api_key")
+
+        assert learning.http_client is questioning.http_client is get_default_client()
+
+    @pytest.mark.asyncio
+    async def test_session_reused_across_calls(self):
+        """测试连接池会话在多次获取之间复用"""
+        from services.http_client import DeepSeekHTTPClient
+
+        client = DeepSeekHTTPClient()
+        await client.start()
+        first = await client.get_session()
+        second = await client.get_session()
+
+        assert first is second
+        assert client.sessions_created == 1
+
+        await client.close()
+        assert not client.is_open
+
+
+class TestResponseCaching:
+    @pytest.mark.asyncio
+    async def test_generate_response_uses_cache(self):
+        """测试相同问题第二次命中缓存，opt-out时不使用缓存"""
+        from services.http_client import HTTPResult
+        from services.response_cache import ResponseCache
+
+        agent = DeepSeekLearningAgent("learning_agent", "test_api_key", response_cache=ResponseCache())
+        upstream = {'choices': [{'message': {'content': '递归是函数调用自身'}}]}
+
+        with patch.object(agent.http_client, 'request_json', new_callable=AsyncMock) as mock_request:
+            mock_request.return_value = HTTPResult(200, upstream, "", {})
+
+            await agent.generate_response("什么是递归？", {})
+            await agent.generate_response("什么是递归？", {})
+            assert mock_request.call_count == 1
+
+            await agent.generate_response("什么是递归？", {}, use_cache=False)
+            assert mock_request.call_count == 2
+
+        stats = agent.get_stats()
+        assert stats["cache_hits"] == 1
+        assert stats["cache_misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_serves_stale_cache(self):
+        """测试熔断时返回过期缓存，无缓存时返回后备响应"""
+        from services.http_client import DeepSeekHTTPClient
+        from services.circuit_breaker import CircuitBreaker
+        from services.response_cache import ResponseCache
+
+        client = DeepSeekHTTPClient(breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=60))
+        client.breaker.record_failure()
+        cache = ResponseCache(ttl_seconds=0)
+        agent = DeepSeekLearningAgent("learning_agent", "test_api_key",
+                                      http_client=client, response_cache=cache)
+
+        messages = agent._build_message_sequence("什么是递归？", {})
+        cache.set(agent._cache_key(messages), {'choices': [{'message': {'content': '递归是函数调用自身'}}]})
+
+        response = await agent.generate_response("什么是递归？", {})
+        assert response['content'] == '递归是函数调用自身'
+
+        response = await agent.generate_response("什么是装饰器？", {})
+        assert response['metadata'].get('is_fallback')
+
+        # 降级读取的过期条目单独计数，不算作命中
+        stats = cache.get_stats()
+        assert stats["hits"] == 0
+        assert stats["stale_hits"] == 1
+        assert stats["misses"] == 2
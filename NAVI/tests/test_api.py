@@ -1,9 +1,20 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 from backend.main import app
 
 client = TestClient(app)
 
+
+def parse_sse(text):
+    """把SSE响应体解析为 (事件名, 数据) 列表"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
 class TestAPI:
     def test_health_check(self):
         """测试健康检查端点"""
@@ -37,6 +48,17 @@ class TestAPI:
         response = client.post("/api/learning", json={})
         assert response.status_code == 422  # 验证错误
 
+    def test_storage_keys_validated(self):
+        """测试含路径分隔符的 user_id / session_id 被拒绝"""
+        for user_id in ("../etc", "a/b", "a\\b", ".."):
+            response = client.get("/api/knowledge/graph", params={"user_id": user_id})
+            assert response.status_code == 422
+            response = client.post("/api/knowledge/update", json={"user_id": user_id, "operations": []})
+            assert response.status_code == 422
+        response = client.post("/api/learning", json={"message": "递归", "session_id": "../s1"})
+        assert response.status_code == 422
+        assert client.get("/api/knowledge/graph", params={"user_id": "alice@example.com"}).status_code == 200
+
     def test_knowledge_update(self):
         """测试知识图谱更新"""
         response = client.post("/api/knowledge/update", json={
@@ -47,4 +69,151 @@ class TestAPI:
                 "children": []
             }
         })
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+
+    def test_knowledge_patch(self):
+        """测试知识图谱增量更新与版本冲突"""
+        response = client.post("/api/knowledge/update", json={
+            "user_id": "patch_user",
+            "base_version": 0,
+            "operations": [
+                {"op": "add", "parent_id": "learning_notes", "node": {"id": "n1", "title": "递归"}},
+                {"op": "update", "id": "n1", "fields": {"content": "函数调用自身"}}
+            ]
+        })
+        assert response.status_code == 200
+        assert response.json()["version"] == 1
+
+        # 基于旧版本修改已变更的节点会产生冲突，且整组操作都不生效
+        response = client.post("/api/knowledge/update", json={
+            "user_id": "patch_user",
+            "base_version": 0,
+            "operations": [
+                {"op": "add", "parent_id": "questions", "node": {"id": "n2", "title": "质疑"}},
+                {"op": "delete", "id": "n1"}
+            ]
+        })
+        assert response.status_code == 409
+        assert response.json()["conflicts"][0]["index"] == 1
+
+        stats = client.get("/api/knowledge/stats", params={"user_id": "patch_user"}).json()
+        assert stats["total_nodes"] == 4
+
+    def test_knowledge_node_pagination(self):
+        """测试按需加载节点与祖先路径"""
+        response = client.get("/api/knowledge/nodes/root", params={"user_id": "page_user", "limit": 1})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["node"]["child_count"] == 2
+        assert len(data["children"]) == 1
+
+        response = client.get("/api/knowledge/nodes/root/children",
+                              params={"user_id": "page_user", "cursor": data["next_cursor"]})
+        assert [child["id"] for child in response.json()["children"]] == ["questions"]
+
+        response = client.get("/api/knowledge/nodes/questions/path", params={"user_id": "page_user"})
+        assert [node["id"] for node in response.json()["path"]] == ["root", "questions"]
+        assert client.get("/api/knowledge/nodes/missing", params={"user_id": "page_user"}).status_code == 404
+
+    def test_knowledge_stats(self):
+        """测试知识图谱统计"""
+        response = client.get("/api/knowledge/stats", params={"user_id": "stats_user"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["user_id"] == "stats_user"
+        assert data["total_nodes"] == 3
+        assert data["subtree_counts"] == {"learning_notes": 1, "questions": 1}
+
+    def test_orchestrate_endpoint(self):
+        """测试多智能体编排端点"""
+        from unittest.mock import AsyncMock, MagicMock, patch
+
+        learning = MagicMock()
+        learning.generate_response = AsyncMock(return_value={"content": "学习内容", "metadata": {}})
+        questioning = MagicMock()
+        questioning.generate_response = AsyncMock(return_value={"content": "质疑内容", "metadata": {}})
+        balancing = MagicMock()
+        balancing.synthesize_responses = AsyncMock(return_value={"content": "综合建议", "metadata": {}})
+
+        with patch("backend.main.learning_agent", learning), \
+                patch("backend.main.questioning_agent", questioning), \
+                patch("backend.main.balancing_agent", balancing):
+            response = client.post("/api/orchestrate", json={
+                "message": "什么是递归？",
+                "context": [],
+                "use_cache": False
+            })
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["synthesis"]["content"] == "综合建议"
+        assert balancing.synthesize_responses.call_args.kwargs["use_cache"] is False
+        assert set(data["timings"]) >= {"learning", "questioning", "synthesis", "total"}
+        args = balancing.synthesize_responses.call_args[0]
+        assert args[0]["content"] == "学习内容"
+        assert args[1]["content"] == "质疑内容"
+
+    @pytest.mark.parametrize("path, agent_name, response_type", [
+        ("/api/learning/stream", "learning_agent", "learning"),
+        ("/api/questioning/stream", "questioning_agent", "questioning"),
+        ("/api/chat/stream", "balancing_agent", "chat"),
+    ])
+    def test_stream_endpoints(self, path, agent_name, response_type):
+        """测试流式端点的SSE事件，以及流结束后记录会话轮次"""
+        from unittest.mock import AsyncMock, MagicMock, patch
+
+        async def stream_response(message, context, use_cache=True):
+            yield {"type": "token", "content": "递归"}
+            yield {"type": "token", "content": "是"}
+            yield {"type": "done", "response": {"content": "递归是", "metadata": {"cached": False}}}
+
+        agent = MagicMock()
+        agent.stream_response = stream_response
+        summarizer = MagicMock()
+        summarizer.get_context = AsyncMock(return_value={})
+        summarizer.record_turn = AsyncMock()
+
+        with patch(f"backend.main.{agent_name}", agent), patch("backend.main.summarizer", summarizer):
+            response = client.post(path, json={
+                "message": "什么是递归？",
+                "context": [],
+                "session_id": "stream_session"
+            })
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.text)
+        assert events == [
+            ("token", {"content": "递归"}),
+            ("token", {"content": "是"}),
+            ("done", {"type": response_type, "metadata": {"cached": False}}),
+        ]
+        summarizer.record_turn.assert_awaited_once_with("stream_session", "什么是递归？", "递归是")
+
+    def test_stream_error_event(self):
+        """测试流式输出中途出错时发送error事件且不记录会话轮次"""
+        from unittest.mock import AsyncMock, MagicMock, patch
+
+        async def stream_response(message, context, use_cache=True):
+            yield {"type": "token", "content": "递归"}
+            raise RuntimeError("上游中断")
+
+        agent = MagicMock()
+        agent.stream_response = stream_response
+        summarizer = MagicMock()
+        summarizer.get_context = AsyncMock(return_value={})
+        summarizer.record_turn = AsyncMock()
+
+        with patch("backend.main.questioning_agent", agent), patch("backend.main.summarizer", summarizer):
+            response = client.post("/api/questioning/stream", json={
+                "message": "什么是递归？",
+                "context": [],
+                "session_id": "stream_session"
+            })
+
+        assert response.status_code == 200
+        assert parse_sse(response.text) == [
+            ("token", {"content": "递归"}),
+            ("error", {"detail": "上游中断"}),
+        ]
+        summarizer.record_turn.assert_not_awaited()
@@ -0,0 +1,462 @@
+import pytest
+from services.knowledge_service import KnowledgeGraphService
+from services.graph_index import GraphIndex
+
+
+def build_chain(depth: int) -> dict:
+    """构造一条深度为 depth 的链状图谱"""
+    root = {"id": "n0", "title": "节点0", "content": "", "type": "manual", "children": []}
+    node = root
+    for i in range(1, depth + 1):
+        child = {"id": f"n{i}", "title": f"节点{i}", "content": "", "type": "manual", "children": []}
+        node["children"].append(child)
+        node = child
+    return root
+
+
+class TestGraphIndex:
+    def test_lookup_and_path(self):
+        """测试ID/标题查找与祖先路径"""
+        graph = KnowledgeGraphService().create_default_graph()
+        index = GraphIndex(graph)
+
+        assert index.get("questions")["title"] == "问题思考"
+        assert index.find_by_title("学习笔记")["id"] == "learning_notes"
+        assert index.path_to("questions") == ["root", "questions"]
+        assert index.depth("root") == 0
+        assert index.path_to("missing") is None
+
+    def test_deep_graph_without_recursion(self):
+        """测试深图谱不会触发递归深度限制"""
+        graph = build_chain(5000)
+        index = GraphIndex(graph)
+
+        assert len(index) == 5001
+        assert index.depth("n5000") == 5000
+        assert [depth for _, depth in index.iter_nodes()][-1] == 5000
+
+
+class TestKnowledgeGraphService:
+    def setup_method(self):
+        self.service = KnowledgeGraphService()
+        self.graph = self.service.create_default_graph()
+
+    def test_insert_keeps_input_unchanged(self):
+        """测试插入返回新图谱且不修改原图谱"""
+        updated = self.service.add_questioning_node(self.graph, "递归为什么会栈溢出？", "因为调用层数过深")
+
+        assert self.graph["children"][1]["children"] == []
+        questions = self.service._find_node_by_id(updated, "questions")
+        assert len(questions["children"]) == 1
+        assert questions["children"][0]["type"] == "questioning"
+
+    def test_update_and_delete(self):
+        """测试更新与删除节点"""
+        updated = self.service.update_node(self.graph, "questions", {"title": "思考"})
+        assert self.service._find_node_by_title(updated, "思考")["id"] == "questions"
+        assert self.service._find_node_by_title(self.graph, "思考") is None
+
+        deleted = self.service.delete_node(updated, "questions")
+        assert self.service._find_node_by_id(deleted, "questions") is None
+        assert [child["id"] for child in deleted["children"]] == ["learning_notes"]
+
+        # 根节点和不存在的节点不会被删除
+        assert self.service.delete_node(self.graph, "root")["id"] == "root"
+        assert self.service.update_node(self.graph, "missing", {"title": "x"}) is self.graph
+
+    def test_stats_on_deep_graph(self):
+        """测试深图谱统计"""
+        stats = self.service.get_graph_stats(build_chain(3000))
+        assert stats["total_nodes"] == 3001
+        assert stats["max_depth"] == 3000
+        assert stats["manual_nodes"] == 3001
+
+    def test_stats_maintained_incrementally(self):
+        """测试统计信息随修改增量维护，与重新统计结果一致"""
+        graph = self.service.add_learning_node(self.graph, "什么是递归？", "递归是函数调用自身")
+        graph = self.service.add_questioning_node(graph, "递归一定慢吗？", "不一定")
+        note_id = graph["children"][0]["children"][0]["id"]
+        graph = self.service._insert_node(graph, note_id, {"id": "deep", "title": "尾递归", "children": []})
+        graph = self.service.update_node(graph, "deep", {"type": "questioning"})
+
+        stats = self.service.get_graph_stats(graph)
+        assert stats["total_nodes"] == 6
+        assert stats["learning_nodes"] == 1
+        assert stats["questioning_nodes"] == 2
+        assert stats["max_depth"] == 3
+        assert stats["subtree_counts"] == {"learning_notes": 3, "questions": 2}
+        assert stats["last_modified"] is not None
+
+        graph = self.service.delete_node(graph, note_id)
+        stats = self.service.get_graph_stats(graph)
+        rebuilt = GraphIndex(graph).get_stats()
+        for key in ("total_nodes", "learning_nodes", "questioning_nodes", "manual_nodes",
+                    "max_depth", "type_counts", "subtree_counts"):
+            assert stats[key] == rebuilt[key]
+        assert stats["max_depth"] == 2
+
+    def test_copy_on_write_shares_untouched_subtrees(self):
+        """测试写时复制：只复制根到修改节点的路径"""
+        graph = self.service.add_questioning_node(self.graph, "问题一", "思考一")
+        updated = self.service.add_learning_node(graph, "什么是递归？", "递归是函数调用自身")
+
+        learning_notes = self.service._find_node_by_id(updated, "learning_notes")
+        assert len(learning_notes["children"]) == 1
+        # 未修改的子树与原图谱共享
+        assert updated["children"][1] is graph["children"][1]
+        assert updated["children"][0] is not graph["children"][0]
+        assert graph["children"][0]["children"] == []
+
+        # 旧版本图谱仍可继续使用
+        assert self.service._find_node_by_id(graph, "learning_notes")["children"] == []
+
+    def test_mutations_on_deep_graph(self):
+        """测试深图谱上的修改不受递归限制"""
+        graph = build_chain(5000)
+        updated = self.service._insert_node(graph, "n5000", {"id": "leaf", "title": "叶子", "children": []})
+        updated = self.service.update_node(updated, "n4999", {"title": "改名"})
+        updated = self.service.delete_node(updated, "n10")
+
+        index = self.service.get_index(updated)
+        assert "leaf" not in index
+        assert index.find_by_title("改名") is None
+        assert len(index) == 10
+        assert self.service.get_index(graph).depth("n5000") == 5000
+
+
+class TestSearchIndex:
+    def setup_method(self):
+        self.service = KnowledgeGraphService()
+        graph = self.service.create_default_graph()
+        graph = self.service.add_learning_node(graph, "什么是递归？", "递归是函数调用自身，需要终止条件")
+        graph = self.service.add_learning_node(graph, "Python列表推导式", "list comprehension 的写法")
+        self.graph = self.service.add_questioning_node(graph, "递归一定比循环慢吗？", "递归有函数调用开销")
+
+    def test_tokenize(self):
+        """测试中文二元组与英文单词分词"""
+        from services.search_index import tokenize
+        assert tokenize("递归算法 Python3") == ["python3", "递归", "归算", "算法"]
+        assert "栈" in tokenize("栈溢出", unigrams=True)
+
+    def test_bm25_ranking_without_duplicates(self):
+        """测试BM25排序且结果不重复"""
+        results = self.service.search_nodes(self.graph, "递归")
+        ids = [node["id"] for node in results]
+        assert len(ids) == len(set(ids)) == 2
+        assert all("递归" in node["title"] for node in results)
+
+        assert self.service.search_nodes(self.graph, "comprehension")[0]["title"] == "Python列表推导式"
+        assert len(self.service.search_nodes(self.graph, "递归", top_k=1)) == 1
+        assert self.service.search_nodes(self.graph, "不存在的词") == []
+
+    def test_index_maintained_incrementally(self):
+        """测试修改后检索索引增量更新"""
+        self.service.search_nodes(self.graph, "递归")
+        node = self.service.search_nodes(self.graph, "循环")[0]
+
+        updated = self.service.update_node(self.graph, node["id"], {"title": "迭代与尾调用", "content": "尾调用优化", "metadata": {}})
+        assert self.service.search_nodes(updated, "循环") == []
+        assert self.service.search_nodes(updated, "尾调用")[0]["id"] == node["id"]
+
+        deleted = self.service.delete_node(updated, "learning_notes")
+        assert self.service.search_nodes(deleted, "递归") == []
+        assert len(self.service.get_index(deleted).search_index) == len(self.service.get_index(deleted))
+
+
+class TestParentSelection:
+    def setup_method(self):
+        self.service = KnowledgeGraphService()
+        self.graph = self.service.create_default_graph()
+
+    def _note(self, keywords):
+        return {"id": "new", "type": "learning", "metadata": {"keywords": keywords}, "children": []}
+
+    def test_defaults_to_learning_notes(self):
+        """测试没有相关节点时学习节点放在学习笔记下"""
+        parent = self.service._find_best_parent(self.graph, self._note(["递归"]))
+        assert parent["id"] == "learning_notes"
+
+    def test_clusters_under_related_topic(self):
+        """测试按IDF加权的关键词重合选择父节点"""
+        graph = self.service._insert_node(self.graph, "learning_notes", {
+            "id": "topic_recursion", "title": "递归", "type": "manual",
+            "metadata": {"keywords": ["递归", "函数"]}, "children": []})
+        graph = self.service._insert_node(graph, "learning_notes", {
+            "id": "topic_python", "title": "Python", "type": "manual",
+            "metadata": {"keywords": ["python", "函数"]}, "children": []})
+
+        # 共同的常见词"函数"权重低于少见词"递归"
+        assert self.service._find_best_parent(graph, self._note(["递归", "函数"]))["id"] == "topic_recursion"
+        assert self.service._find_best_parent(graph, self._note(["python"]))["id"] == "topic_python"
+
+    def test_deep_candidates_attach_to_topic(self):
+        """测试候选过深时挂到其主题祖先下"""
+        graph = self.graph
+        parent_id = "learning_notes"
+        for i in range(5):
+            graph = self.service._insert_node(graph, parent_id, {
+                "id": f"n{i}", "title": f"笔记{i}", "type": "learning",
+                "metadata": {"keywords": [f"词{i}"]}, "children": []})
+            parent_id = f"n{i}"
+
+        parent = self.service._find_best_parent(graph, self._note(["词4"]))
+        assert self.service.get_index(graph).depth(parent["id"]) == self.service.max_parent_depth
+
+
+class TestKeywordExtractor:
+    def setup_method(self):
+        from services.keyword_extractor import KeywordExtractor
+        self.extractor = KeywordExtractor()
+
+    def test_cjk_segmentation(self):
+        """测试中文按虚字断开并切分为短词，而不是整句作为一个关键词"""
+        keywords = self.extractor.extract("什么是递归？递归是函数调用自身的一种编程技巧")
+        assert keywords[0] == "递归"
+        assert "函数" in keywords
+        assert all(len(keyword) <= 4 for keyword in keywords)
+        assert self.extractor.extract("Python list comprehension in Python")[0] == "python"
+
+    def test_batch_uses_document_frequencies(self):
+        """测试批量提取时常见词的权重被降低"""
+        results = self.extractor.extract_batch(["递归函数的终止条件", "递归和循环的区别", "二叉树的递归遍历"])
+        assert results[1][0] == "区别"
+        assert results[2][0] == "递归遍历"
+
+    def test_service_reindex_keywords(self):
+        """测试为整个图谱重新提取关键词"""
+        service = KnowledgeGraphService()
+        graph = service.add_learning_node(service.create_default_graph(), "什么是递归？", "递归是函数调用自身")
+        graph = service.update_node(graph, graph["children"][0]["children"][0]["id"],
+                                    {"metadata": {"user_question": "什么是递归？", "keywords": ["旧词"]}})
+
+        reindexed = service.reindex_keywords(graph)
+        note = reindexed["children"][0]["children"][0]
+        assert note["metadata"]["keywords"] == ["递归"]
+        assert "metadata" not in reindexed
+        assert service.get_index(reindexed).keyword_postings["递归"] == {note["id"]}
+        assert graph["children"][0]["children"][0]["metadata"]["keywords"] == ["旧词"]
+
+
+class TestApplyPatch:
+    def setup_method(self):
+        self.service = KnowledgeGraphService()
+        self.graph = self.service.create_default_graph()
+
+    def test_operations_applied_in_order(self):
+        """测试按顺序应用增量操作并递增版本"""
+        result = self.service.apply_patch(self.graph, [
+            {"op": "add", "parent_id": "learning_notes", "node": {"id": "a", "title": "A"}},
+            {"op": "add", "parent_id": "a", "node": {"id": "b", "title": "B"}},
+            {"op": "move", "id": "b", "parent_id": "questions", "position": 0},
+            {"op": "update", "id": "a", "fields": {"title": "A2"}},
+            {"op": "delete", "id": "a"}
+        ], base_version=0)
+
+        graph = result["graph"]
+        assert result["version"] == graph["revision"] == 1
+        assert result["conflicts"] == []
+        assert self.service.get_index(graph).path_to("b") == ["root", "questions", "b"]
+        assert "a" not in self.service.get_index(graph)
+        assert "revision" not in self.graph
+
+    def test_conflicts_are_atomic(self):
+        """测试冲突时整组操作都不生效"""
+        first = self.service.apply_patch(self.graph, [
+            {"op": "update", "id": "questions", "fields": {"title": "思考"}}
+        ], base_version=0)["graph"]
+
+        result = self.service.apply_patch(first, [
+            {"op": "add", "parent_id": "root", "node": {"id": "x", "title": "X"}},
+            {"op": "update", "id": "questions", "fields": {"title": "问题"}},
+            {"op": "move", "id": "learning_notes", "parent_id": "learning_notes"},
+            {"op": "delete", "id": "missing"}
+        ], base_version=0)
+
+        assert result["graph"] is first
+        assert result["version"] == 1
+        assert [conflict["index"] for conflict in result["conflicts"]] == [1, 2, 3]
+        assert "x" not in self.service.get_index(first)
+
+    def test_failed_patch_leaves_no_partial_index(self):
+        """测试失败的增量更新不会在缓存中留下中间版本的索引"""
+        result = self.service.apply_patch(self.graph, [
+            {"op": "add", "parent_id": "root", "node": {"id": "x", "title": "X"}},
+            {"op": "delete", "id": "missing"}
+        ], base_version=0)
+
+        assert result["graph"] is self.graph
+        assert len(self.service.graph_cache) == 0
+        assert "x" not in self.service.get_index(self.graph)
+
+    def test_added_subtree_ids_validated(self):
+        """测试新增子树中缺少ID或ID重复的节点被拒绝"""
+        for node in (
+            {"id": "x", "title": "X", "children": [{"id": "questions", "title": "Q"}]},
+            {"id": "x", "title": "X", "children": [{"id": "y", "title": "Y"}, {"id": "y", "title": "Y2"}]},
+            {"id": "x", "title": "X", "children": [{"title": "无ID", "children": [{"id": "y", "title": "Y"}]}]},
+        ):
+            result = self.service.apply_patch(self.graph, [
+                {"op": "add", "parent_id": "root", "node": node}
+            ], base_version=0)
+            assert result["graph"] is self.graph
+            assert len(result["conflicts"]) == 1
+
+
+class TestKnowledgeGraphStore:
+    @pytest.mark.asyncio
+    async def test_lazy_load_flush_and_eviction(self, tmp_path):
+        """测试懒加载、修改即写回以及LRU淘汰后重新加载"""
+        from services.storage_service import StorageService
+        from services.graph_store import KnowledgeGraphStore
+
+        storage = StorageService(str(tmp_path))
+        store = KnowledgeGraphStore(storage, KnowledgeGraphService(), max_graphs=1)
+
+        graph = await store.get("alice")
+        assert graph["id"] == "root"
+        assert await store.get("alice") is graph
+        assert await storage.load_knowledge_graph("alice") is None
+
+        result = await store.apply_patch("alice", [
+            {"op": "add", "parent_id": "learning_notes", "node": {"id": "n1", "title": "递归"}}
+        ])
+        assert result["version"] == 1
+        saved = await storage.load_knowledge_graph("alice")
+        assert saved["revision"] == 1
+
+        await store.get("bob")
+        assert store.evictions == 1
+
+        reloaded = await store.get("alice")
+        assert reloaded is not graph
+        assert store.knowledge_service.get_index(reloaded).get("n1")["title"] == "递归"
+        assert store.get_stats()["flush_count"] == 1
+        # 被淘汰的图谱从紧凑层还原，不再读盘
+        assert store.compact_hits == 1
+        assert store.misses == 2
+
+
+class TestCompactGraph:
+    def test_lossless_round_trip(self):
+        """测试紧凑节点与JSON形式之间的无损转换"""
+        import json
+        from services.compact_graph import CompactNode, TextPool, pack_graph, unpack_graph
+
+        service = KnowledgeGraphService()
+        graph = service.add_learning_node(service.create_default_graph(), "什么是递归？", "递归是函数调用自身", "真的吗？")
+        graph = service.add_learning_node(graph, "什么是递归？", "递归是函数调用自身", dedupe=False)
+        graph["custom"] = {"tags": ["a", 1, None, True], "when": "2024-01-01T00:00:00Z"}
+        graph["children"][1]["created_at"] = "2024-01-01T08:00:00.000000"
+
+        pool = TextPool()
+        compact = pack_graph(graph, pool)
+        assert isinstance(compact, CompactNode)
+        assert not hasattr(compact, "__dict__")
+        assert json.dumps(unpack_graph(compact), ensure_ascii=False) == json.dumps(graph, ensure_ascii=False)
+
+        # 时间戳存为整数，重复文本只保留一份
+        assert isinstance(compact.created_at, int)
+        first = compact.children[0].children[0]
+        second = first.children[0]
+        assert first.metadata[0][1] is second.metadata[0][1]
+
+
+class TestNearDuplicate:
+    def test_lsh_detects_near_duplicates(self):
+        """测试MinHash+LSH只召回近似重复的文本"""
+        from services.near_duplicate import NearDuplicateIndex
+
+        index = NearDuplicateIndex()
+        index.add("a", "什么是递归？递归是函数直接或间接调用自身的编程技巧，需要终止条件。")
+        index.add("b", "Python列表推导式可以用一行代码生成列表")
+
+        matches = index.query("什么是递归?递归是函数直接或间接调用自身的编程技巧,需要终止条件")
+        assert [doc_id for doc_id, _ in matches] == ["a"]
+        assert index.query("哈希表的冲突如何解决") == []
+
+        index.remove("a")
+        assert "a" not in index
+        assert index.query("什么是递归？递归是函数直接或间接调用自身的编程技巧，需要终止条件。") == []
+
+    def test_add_merges_duplicate_note(self):
+        """测试重复提问合并到已有笔记，而不是新建节点"""
+        service = KnowledgeGraphService()
+        graph = service.add_learning_node(service.create_default_graph(), "什么是递归？", "递归是函数调用自身的编程技巧")
+        note_id = service.get_index(graph).find_by_title("什么是递归？")["id"]
+
+        merged = service.add_learning_node(graph, "什么是递归?", "递归是函数调用自身的编程技巧", "递归一定需要终止条件吗？")
+        index = service.get_index(merged)
+        assert index.get_stats()["learning_nodes"] == 1
+        metadata = index.get(note_id)["metadata"]
+        assert metadata["duplicate_count"] == 1
+        assert metadata["questioning_response"] == "递归一定需要终止条件吗？"
+
+        # 不同类型的笔记不合并
+        merged = service.add_questioning_node(merged, "什么是递归？", "递归是函数调用自身的编程技巧")
+        assert service.get_index(merged).get_stats()["questioning_nodes"] == 1
+
+    def test_duplicates_keyed_on_question(self):
+        """测试查重只比较问题：同一问题的不同回答合并，不同问题的相同回答不合并"""
+        service = KnowledgeGraphService()
+        graph = service.add_learning_node(service.create_default_graph(), "什么是递归？", "递归是函数调用自身的编程技巧")
+        graph = service.add_learning_node(graph, "什么是递归", "递归就是一个函数在执行过程中又调用了它自己")
+        assert service.get_index(graph).get_stats()["learning_nodes"] == 1
+
+        graph = service.add_learning_node(graph, "什么是迭代？", "递归是函数调用自身的编程技巧")
+        assert service.get_index(graph).get_stats()["learning_nodes"] == 2
+
+    def test_deduplicate_graph(self):
+        """测试批量去重保留先出现的笔记并接管重复笔记的子节点"""
+        service = KnowledgeGraphService()
+        graph = service.create_default_graph()
+        for _ in range(3):
+            graph = service.add_learning_node(graph, "什么是递归？", "递归是函数调用自身的编程技巧", dedupe=False)
+        graph = service.add_learning_node(graph, "哈希表", "哈希表通过散列函数定位元素", dedupe=False)
+        index = service.get_index(graph)
+        first_id, second_id, third_id = index.titles["什么是递归？"]
+        graph = service.apply_patch(graph, [
+            {"op": "add", "parent_id": third_id, "node": {"id": "child", "title": "尾递归"}}
+        ])["graph"]
+
+        deduped, merges = service.deduplicate_graph(graph)
+        index = service.get_index(deduped)
+        assert sorted(merges) == sorted([(second_id, first_id), (third_id, first_id)])
+        assert index.titles["什么是递归？"] == [first_id]
+        assert index.get(first_id)["metadata"]["duplicate_count"] == 2
+        assert index.parent_of("child")["id"] == first_id
+        assert index.find_by_title("哈希表")
+
+        assert service.deduplicate_graph(deduped) == (deduped, [])
+
+
+class TestPagination:
+    def setup_method(self):
+        self.service = KnowledgeGraphService()
+        graph = self.service.create_default_graph()
+        for i in range(5):
+            graph = self.service._insert_node(graph, "learning_notes", {"id": f"n{i}", "title": f"笔记{i}", "children": []})
+        self.graph = self.service._insert_node(graph, "n0", {"id": "leaf", "title": "叶子", "children": []})
+
+    def test_node_page_and_cursor(self):
+        """测试节点首屏与游标分页"""
+        page = self.service.get_node_page(self.graph, "learning_notes", limit=2)
+        assert page["node"]["child_count"] == 5
+        assert page["node"]["subtree_size"] == 7
+        assert "children" not in page["node"]
+        assert [child["id"] for child in page["children"]] == ["n0", "n1"]
+        assert page["children"][0]["child_count"] == 1
+
+        # 翻页期间在前面插入节点，游标按ID重新定位
+        graph = self.service._insert_node(self.graph, "learning_notes", {"id": "new", "children": []}, position=0)
+        rest = self.service.get_children_page(graph, "learning_notes", page["next_cursor"], limit=10)
+        assert [child["id"] for child in rest["children"]] == ["n2", "n3", "n4"]
+        assert rest["next_cursor"] is None
+
+        with pytest.raises(ValueError):
+            self.service.get_children_page(graph, "learning_notes", "bad-cursor")
+
+    def test_ancestor_path(self):
+        """测试祖先路径"""
+        path = self.service.get_ancestor_path(self.graph, "leaf")
+        assert [node["id"] for node in path] == ["root", "learning_notes", "n0", "leaf"]
+        assert self.service.get_ancestor_path(self.graph, "missing") is None
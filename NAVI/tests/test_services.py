@@ -0,0 +1,681 @@
+import pytest
+import json
+import asyncio
+from unittest.mock import patch
+from services.response_cache import ResponseCache
+from services.single_flight import SingleFlight
+from services.concurrency_limiter import AdaptiveLimiter, UpstreamOverloadedError
+from services.retry_policy import RetryPolicy
+from services.http_client import DeepSeekHTTPClient, HTTPResult
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.history_packer import estimate_tokens, pack_messages, truncate_to_tokens
+
+
+class TestResponseCache:
+    def test_key_normalizes_messages(self):
+        """测试缓存键对空白和全半角归一化"""
+        cache = ResponseCache()
+        a = cache.make_key("learning_agent", "deepseek-chat", 0.3,
+                           [{"role": "user", "content": "  什么是递归？ "}])
+        b = cache.make_key("learning_agent", "deepseek-chat", 0.3,
+                           [{"role": "user", "content": "什么是递归?"}])
+        c = cache.make_key("questioning_agent", "deepseek-chat", 0.3,
+                           [{"role": "user", "content": "什么是递归?"}])
+        assert a == b
+        assert a != c
+
+    def test_lru_eviction_and_ttl(self):
+        """测试LRU淘汰与TTL过期"""
+        cache = ResponseCache(max_entries=2, ttl_seconds=60)
+        cache.set("a", {"v": 1})
+        cache.set("b", {"v": 2})
+        cache.get("a")
+        cache.set("c", {"v": 3})
+
+        assert cache.get("b") is None
+        assert cache.get("a") == {"v": 1}
+        assert cache.evictions == 1
+
+        with patch("services.response_cache.time.time", return_value=10 ** 12):
+            assert cache.get("a") is None
+
+    def test_persistence(self, tmp_path):
+        """测试缓存写盘后可重新加载"""
+        path = str(tmp_path / "cache.json")
+        cache = ResponseCache(persist_path=path)
+        cache.set("key", {"choices": [{"message": {"content": "递归"}}]})
+        assert cache.save()
+
+        restored = ResponseCache(persist_path=path)
+        assert restored.get("key")["choices"][0]["message"]["content"] == "递归"
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_calls_coalesce(self):
+        """测试并发的相同请求只调用一次上游"""
+        flight = SingleFlight()
+        calls = 0
+
+        async def upstream():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"content": "递归"}
+
+        results = await asyncio.gather(*[flight.do("same", upstream) for _ in range(5)])
+
+        assert calls == 1
+        assert all(r == {"content": "递归"} for r in results)
+        assert flight.get_stats()["coalesced_requests"] == 4
+        assert flight.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_errors_are_shared(self):
+        """测试上游异常传递给所有等待者"""
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(flight.do("k", failing), flight.do("k", failing),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+
+class TestAdaptiveLimiter:
+    @pytest.mark.asyncio
+    async def test_aimd_adjustment(self):
+        """测试成功时加性增长、失败时乘性下降"""
+        limiter = AdaptiveLimiter(initial_limit=4, max_limit=10, decrease_cooldown=0)
+
+        await limiter.acquire()
+        limiter.release(0.1, True)
+        assert limiter.limit == pytest.approx(4.25)
+
+        await limiter.acquire()
+        limiter.release(None, False)
+        assert limiter.limit == pytest.approx(4.25 * 0.7)
+
+    @pytest.mark.asyncio
+    async def test_queue_overflow_sheds(self):
+        """测试队列满时立即拒绝"""
+        limiter = AdaptiveLimiter(initial_limit=1, max_queue=1)
+        await limiter.acquire()
+
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queue_depth == 1
+
+        with pytest.raises(UpstreamOverloadedError):
+            await limiter.acquire()
+        assert limiter.shed_count == 1
+
+        limiter.release(0.1, True)
+        await waiter
+        assert limiter.in_flight == 1
+
+
+class TestRetryPolicy:
+    def test_retry_after_is_honoured(self):
+        """测试Retry-After头决定最短等待时间"""
+        policy = RetryPolicy(base_delay=0.01, max_delay=0.02)
+        assert policy.parse_retry_after("3") == 3.0
+        assert policy.parse_retry_after(None) is None
+        assert policy.compute_delay(0, retry_after=3.0) == 3.0
+        assert policy.compute_delay(5) <= 0.02
+
+    def test_should_retry_statuses(self):
+        policy = RetryPolicy(max_retries=2)
+        assert policy.should_retry(0, 429)
+        assert policy.should_retry(1, 503)
+        assert not policy.should_retry(0, 400)
+        assert not policy.should_retry(2, 503)
+
+    @pytest.mark.asyncio
+    async def test_client_retries_on_503(self):
+        """测试HTTP客户端遇到503后重试并返回成功结果"""
+        client = DeepSeekHTTPClient(retry_policy=RetryPolicy(base_delay=0, max_delay=0))
+        responses = [HTTPResult(503, None, "busy", {}), HTTPResult(200, {"ok": True}, "", {})]
+
+        async def fake_send_once(url, headers, payload):
+            return responses.pop(0)
+
+        with patch.object(client, '_send_once', fake_send_once):
+            result = await client.request_json("http://test", {}, {})
+
+        assert result.status == 200
+        assert client.retry_count == 1
+
+
+class TestCircuitBreaker:
+    def test_state_transitions(self):
+        """测试 closed -> open -> half_open -> closed 状态转换"""
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow_request()
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+
+        breaker.recovery_timeout = 0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow_request()
+        assert not breaker.allow_request()  # 半开状态只放行一个探测请求
+
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_failure_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        assert breaker.allow_request()
+        breaker.recovery_timeout = 60
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_fails_fast(self):
+        """测试熔断时HTTP客户端不发起请求"""
+        client = DeepSeekHTTPClient(breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=60))
+        client.breaker.record_failure()
+
+        with pytest.raises(CircuitOpenError):
+            await client.request_json("http://test", {}, {})
+        assert client.request_count == 0
+        assert client.limiter.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_success_recorded_after_body_completes(self):
+        """测试响应体读取中途失败计入熔断，完整读取后才记为成功"""
+        import aiohttp
+        from contextlib import asynccontextmanager
+
+        class FakeResponse:
+            status = 200
+
+        class FakeSession:
+            @asynccontextmanager
+            async def post(self, url, headers=None, json=None):
+                yield FakeResponse()
+
+        client = DeepSeekHTTPClient(breaker=CircuitBreaker(failure_threshold=1, recovery_timeout=60))
+
+        async def fake_get_session():
+            return FakeSession()
+
+        with patch.object(client, 'get_session', fake_get_session):
+            with pytest.raises(aiohttp.ClientPayloadError):
+                async with client.post("http://test", {}, {}):
+                    raise aiohttp.ClientPayloadError("响应体被截断")
+            assert client.breaker.state == CircuitBreaker.OPEN
+            assert client.limiter.in_flight == 0
+
+            client.breaker.recovery_timeout = 0
+            async with client.post("http://test", {}, {}):
+                assert client.breaker.state == CircuitBreaker.HALF_OPEN
+            assert client.breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_cancelled_requests_not_recorded(self):
+        """测试被取消的请求只归还槽位，不影响并发上限和错误率"""
+        from contextlib import asynccontextmanager
+
+        class FakeResponse:
+            status = 200
+
+        class FakeSession:
+            @asynccontextmanager
+            async def post(self, url, headers=None, json=None):
+                yield FakeResponse()
+
+        client = DeepSeekHTTPClient()
+        limit = client.limiter.limit
+
+        async def fake_get_session():
+            return FakeSession()
+
+        with patch.object(client, 'get_session', fake_get_session):
+            for _ in range(5):
+                with pytest.raises(asyncio.CancelledError):
+                    async with client.post("http://test", {}, {}):
+                        raise asyncio.CancelledError()
+
+        assert client.limiter.limit == limit
+        assert client.limiter.completed_count == 0
+        assert client.limiter.in_flight == 0
+
+
+class TestHistoryPacker:
+    def test_estimate_tokens_mixed_text(self):
+        """测试中英文混合文本的token估算"""
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("递归") == 2  # 2 * 0.6
+        assert estimate_tokens("recursion") == 3  # 9 * 0.3
+        assert estimate_tokens("什么是 recursion") > estimate_tokens("recursion")
+
+    def test_pack_newest_first_within_budget(self):
+        """测试从最新消息开始装填且不超出预算"""
+        messages = [{"role": "user", "content": f"第{i}个问题" + "内容" * 50} for i in range(10)]
+        packed, used = pack_messages(messages, budget=200)
+
+        assert used <= 200
+        assert packed[-1]["content"].startswith("第9个问题")
+        assert len(packed) < len(messages)
+
+    def test_oversized_message_truncated(self):
+        """测试超长消息被截断而不是整体丢弃"""
+        long_text = "递归" * 1000
+        packed, used = pack_messages([{"role": "user", "content": long_text}],
+                                     budget=500, max_message_tokens=100)
+        assert len(packed) == 1
+        assert packed[0]["content"].endswith("（已截断）")
+        assert estimate_tokens(truncate_to_tokens(long_text, 100)) <= 101
+
+
+class FakeDeepSeek:
+    def __init__(self):
+        self.calls = []
+
+    async def chat_completion(self, messages, **kwargs):
+        self.calls.append((messages, kwargs))
+        return {"success": True, "data": {"choices": [{"message": {"content": "用户在学习递归"}}]}}
+
+
+class TestConversationSummarizer:
+    @pytest.mark.asyncio
+    async def test_summary_refreshed_every_k_turns(self, tmp_path):
+        """测试每K轮在后台刷新摘要并保存到会话"""
+        from services.storage_service import StorageService
+        from services.session_summarizer import ConversationSummarizer
+
+        storage = StorageService(str(tmp_path))
+        deepseek = FakeDeepSeek()
+        summarizer = ConversationSummarizer(storage, deepseek, refresh_every=3, summary_max_tokens=100)
+
+        for i in range(3):
+            await summarizer.record_turn("s1", f"问题{i}", f"回答{i}")
+        await summarizer.wait_pending()
+
+        assert len(deepseek.calls) == 1
+        assert deepseek.calls[0][1]["max_tokens"] == 100
+
+        context = await summarizer.get_context("s1")
+        assert context["conversation_summary"] == "用户在学习递归"
+        assert context["conversation_history"] == []
+
+        saved = await storage.load_session("s1")
+        assert saved["summary"] == "用户在学习递归"
+        assert saved["summarized_turns"] == 3
+
+    @pytest.mark.asyncio
+    async def test_turns_recorded_during_refresh_are_kept(self, tmp_path):
+        """测试刷新期间新增并被截断的对话按序号保留，会话缓存有上限"""
+        from services.storage_service import StorageService
+        from services.session_summarizer import ConversationSummarizer
+
+        class SlowDeepSeek(FakeDeepSeek):
+            def __init__(self):
+                super().__init__()
+                self.release = asyncio.Event()
+
+            async def chat_completion(self, messages, **kwargs):
+                await self.release.wait()
+                return await super().chat_completion(messages, **kwargs)
+
+        deepseek = SlowDeepSeek()
+        summarizer = ConversationSummarizer(StorageService(str(tmp_path)), deepseek,
+                                            refresh_every=3, max_pending_turns=4, max_sessions=2)
+
+        for i in range(6):
+            await summarizer.record_turn("s1", f"问题{i}", f"回答{i}")
+            await asyncio.sleep(0)
+        deepseek.release.set()
+        await summarizer.wait_pending()
+
+        # 摘要合并了前3轮；超出上限时已丢弃第1轮，剩余的第4~6轮都保留
+        history = (await summarizer.get_context("s1"))["conversation_history"]
+        assert [turn["content"] for turn in history] == ["问题3", "问题4", "问题5"]
+
+        await summarizer.record_turn("s2", "问题", "回答")
+        await summarizer.record_turn("s3", "问题", "回答")
+        assert summarizer.get_stats()["cached_sessions"] == 2
+        assert (await summarizer.get_context("s1"))["conversation_summary"] == "用户在学习递归"
+
+
+class TestJournalEngine:
+    @pytest.mark.asyncio
+    async def test_replay_matches_saved_graph(self, tmp_path):
+        """测试日志重放后的图谱与最后一次保存的图谱一致"""
+        from services.storage_service import StorageService
+        from services.knowledge_service import KnowledgeGraphService
+
+        service = KnowledgeGraphService()
+        storage = StorageService(str(tmp_path), engine="journal")
+        graph = service.create_default_graph()
+        await storage.save_knowledge_graph("alice", graph)
+
+        for i in range(5):
+            graph = service.add_learning_node(graph, f"问题{i}", f"回答{i}", dedupe=False)
+            await storage.save_knowledge_graph("alice", graph)
+        note_ids = service.get_index(graph).titles
+        graph = service.move_node(graph, note_ids["问题3"][0], note_ids["问题0"][0])
+        graph = service.delete_node(graph, note_ids["问题1"][0])
+        graph = service.update_node(graph, note_ids["问题4"][0], {"title": "改名"})
+        await storage.save_knowledge_graph("alice", graph)
+
+        reloaded = await StorageService(str(tmp_path), engine="journal").load_knowledge_graph("alice")
+        assert reloaded == graph
+
+        # 每次保存只追加变化的部分
+        stats = await storage.get_storage_stats()
+        assert stats["appended_records"] == 6
+        assert stats["appended_bytes"] < 6 * len(json.dumps(graph, ensure_ascii=False))
+
+    @pytest.mark.asyncio
+    async def test_torn_record_and_compaction(self, tmp_path):
+        """测试丢弃不完整的末行日志，以及压缩后从快照加载"""
+        from services.journal_engine import JournalEngine
+
+        engine = JournalEngine(str(tmp_path), compact_every=3)
+        for i in range(5):
+            await engine.save("session", "s1", {"turns": list(range(i))})
+        assert engine.compactions == 2  # 首次保存 + 第3条日志
+
+        with open(tmp_path / "session_s1.journal", "a", encoding="utf-8") as f:
+            f.write('{"seq": 99, "ops": [{"pa')
+
+        reloaded = JournalEngine(str(tmp_path))
+        assert await reloaded.load("session", "s1") == {"turns": [0, 1, 2, 3]}
+        assert reloaded.torn_records == 1
+
+        await reloaded.save("session", "s1", {"turns": [0]})
+        assert await JournalEngine(str(tmp_path)).load("session", "s1") == {"turns": [0]}
+
+    @pytest.mark.asyncio
+    async def test_corrupt_journal_is_not_treated_as_missing(self, tmp_path):
+        """测试日志记录损坏时报错，图谱存储不会用默认图谱覆盖原有数据"""
+        from services.storage_service import StorageService
+        from services.graph_store import KnowledgeGraphStore
+        from services.journal_engine import JournalCorruptionError
+        from services.knowledge_service import KnowledgeGraphService
+
+        service = KnowledgeGraphService()
+        storage = StorageService(str(tmp_path), engine="journal")
+        graph = service.create_default_graph()
+        await storage.save_knowledge_graph("alice", graph)
+        for i in range(3):
+            graph = service.add_learning_node(graph, f"问题{i}", f"回答{i}", dedupe=False)
+            await storage.save_knowledge_graph("alice", graph)
+
+        journal_path = tmp_path / "knowledge_graph_alice.journal"
+        lines = journal_path.read_text(encoding="utf-8").splitlines(keepends=True)
+        record = json.loads(lines[1])
+        record["ops"][0]["path"] = ["不存在的节点"]
+        lines[1] = json.dumps(record, ensure_ascii=False) + "\n"
+        journal_path.write_text("".join(lines), encoding="utf-8")
+        snapshot = (tmp_path / "knowledge_graph_alice.snapshot.json").read_bytes()
+
+        store = KnowledgeGraphStore(StorageService(str(tmp_path), engine="journal"), service)
+        with pytest.raises(JournalCorruptionError):
+            await store.get("alice")
+        with pytest.raises(JournalCorruptionError):
+            await store.update("alice", lambda current: service.add_learning_node(current, "新问题", "新回答"))
+
+        assert (tmp_path / "knowledge_graph_alice.snapshot.json").read_bytes() == snapshot
+        assert journal_path.read_text(encoding="utf-8") == "".join(lines)
+
+        # 中间行损坏不按不完整末行处理，也不会截断后面的记录
+        lines[1] = '{"seq": 2, "ops": [{"pa\n'
+        journal_path.write_text("".join(lines), encoding="utf-8")
+        with pytest.raises(JournalCorruptionError):
+            await StorageService(str(tmp_path), engine="journal").load_knowledge_graph("alice")
+        assert journal_path.read_text(encoding="utf-8") == "".join(lines)
+
+    @pytest.mark.asyncio
+    async def test_reads_json_engine_files(self, tmp_path):
+        """测试切换引擎后仍能读取 json 引擎保存的数据"""
+        from services.storage_service import StorageService
+
+        await StorageService(str(tmp_path)).save_session("s1", {"summary": "递归"})
+        storage = StorageService(str(tmp_path), engine="journal")
+        assert (await storage.load_session("s1"))["summary"] == "递归"
+
+        await storage.save_session("s1", {"summary": "动态规划"})
+        assert (tmp_path / "session_s1.snapshot.json").exists()
+        assert await storage.engine.keys("session") == ["s1"]
+
+
+class TestSQLiteEngine:
+    @pytest.mark.asyncio
+    async def test_round_trip_cleanup_and_stats(self, tmp_path):
+        """测试SQLite引擎的读写、按 updated_at 清理和统计"""
+        import sqlite3
+        from datetime import datetime, timedelta
+        from services.storage_service import StorageService
+
+        storage = StorageService(str(tmp_path), engine="sqlite")
+        try:
+            assert await storage.load_session("s1") is None
+            await storage.save_session("s1", {"summary": "递归"})
+            await storage.save_knowledge_graph("alice", {"id": "root", "children": []})
+            await storage.save_knowledge_graph("bob", {"id": "root", "children": []})
+
+            assert (await storage.load_session("s1"))["summary"] == "递归"
+            assert await storage.list_graph_users() == ["alice", "bob"]
+
+            with sqlite3.connect(tmp_path / "navi.db") as conn:
+                assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+                old = (datetime.now() - timedelta(days=40)).timestamp()
+                conn.execute("UPDATE documents SET updated_at = ? WHERE key = 'bob'", (old,))
+
+            assert await storage.cleanup_old_data(days=30) == 1
+            stats = await storage.get_storage_stats()
+            assert stats["engine"] == "sqlite"
+            assert stats["total_documents"] == 2
+            assert stats["documents_by_kind"]["knowledge_graph"]["documents"] == 1
+        finally:
+            await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_imports_json_engine_files(self, tmp_path):
+        """测试数据库中没有的文档从 json 引擎文件导入"""
+        from services.storage_service import StorageService
+
+        await StorageService(str(tmp_path)).save_session("s1", {"summary": "递归"})
+
+        storage = StorageService(str(tmp_path), engine="sqlite")
+        try:
+            assert (await storage.load_session("s1"))["summary"] == "递归"
+            (tmp_path / "session_s1.json").unlink()
+            assert (await storage.load_session("s1"))["summary"] == "递归"
+        finally:
+            await storage.close()
+
+
+class TestWriteBehindEngine:
+    @pytest.mark.asyncio
+    async def test_coalesces_saves_within_window(self, tmp_path):
+        """测试时间窗口内的多次保存合并为一次写入"""
+        from services.storage_service import StorageService
+
+        storage = StorageService(str(tmp_path), write_behind_delay=0.05)
+        for i in range(5):
+            await storage.save_session("s1", {"turn_count": i})
+
+        # 写入前读取到的是最新版本，文件尚未生成
+        assert (await storage.load_session("s1"))["turn_count"] == 4
+        assert not (tmp_path / "session_s1.json").exists()
+
+        await asyncio.sleep(0.2)
+        assert json.loads((tmp_path / "session_s1.json").read_text(encoding="utf-8"))["turn_count"] == 4
+        stats = storage.get_write_behind_stats()
+        assert stats["writes"] == 1
+        assert stats["coalesced"] == 4
+        assert stats["write_amplification"] == pytest.approx(0.2)
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_evicts_when_full_and_flushes_on_close(self, tmp_path):
+        """测试脏文档超过上限时立即写入，关闭时写入其余文档"""
+        from services.storage_service import StorageService
+
+        storage = StorageService(str(tmp_path), write_behind_delay=60, max_dirty=2)
+        for user_id in ("a", "b", "c"):
+            await storage.save_knowledge_graph(user_id, {"id": "root", "children": []})
+
+        assert (tmp_path / "knowledge_graph_a.json").exists()
+        assert storage.get_write_behind_stats()["evictions"] == 1
+        assert await storage.list_graph_users() == ["a", "b", "c"]
+
+        await storage.close()
+        assert (tmp_path / "knowledge_graph_c.json").exists()
+        assert storage.get_write_behind_stats()["dirty"] == 0
+
+    @pytest.mark.asyncio
+    async def test_document_stays_visible_until_written(self):
+        """测试写入完成前仍能读到脏文档，写入失败或期间有新保存时保留"""
+        from services.write_behind import WriteBehindEngine
+
+        class SlowEngine:
+            def __init__(self):
+                self.saved = {}
+                self.fail = False
+                self.started = asyncio.Event()
+                self.release = asyncio.Event()
+
+            async def save(self, kind, key, data):
+                self.started.set()
+                await self.release.wait()
+                if self.fail:
+                    raise OSError("disk full")
+                self.saved[(kind, key)] = dict(data)
+
+            async def load(self, kind, key):
+                return self.saved.get((kind, key))
+
+        inner = SlowEngine()
+        engine = WriteBehindEngine(inner, delay=60)
+        await engine.save("session", "s1", {"turn_count": 1})
+
+        flush = asyncio.create_task(engine.flush())
+        await inner.started.wait()
+        assert (await engine.load("session", "s1"))["turn_count"] == 1
+        await engine.save("session", "s1", {"turn_count": 2})
+        inner.release.set()
+        await flush
+
+        # 写入的是旧版本，新版本仍待写入
+        assert inner.saved[("session", "s1")]["turn_count"] == 1
+        assert (await engine.load("session", "s1"))["turn_count"] == 2
+
+        inner.fail = True
+        await engine.flush()
+        assert engine.get_stats()["flush_failures"] == 1
+        assert (await engine.load("session", "s1"))["turn_count"] == 2
+
+        inner.fail = False
+        await engine.flush()
+        assert inner.saved[("session", "s1")]["turn_count"] == 2
+        assert engine.get_stats()["dirty"] == 0
+        await engine.close()
+
+
+class TestSerializer:
+    def test_round_trip_and_legacy_files(self):
+        """测试各格式往返一致，且没有格式头的旧JSON可直接读取"""
+        from services.serializer import MAGIC, Serializer
+
+        data = {"id": "root", "title": "知识图谱", "children": [{"id": "n1", "revision": 3}]}
+        plain = Serializer().dumps(data)
+        assert json.loads(plain) == data
+
+        compressed = Serializer(compression="gzip").dumps(data)
+        assert compressed.startswith(MAGIC)
+        assert Serializer(compression="gzip").dumps(data) == compressed
+
+        legacy = json.dumps(data, ensure_ascii=False, indent=2)
+        for payload in (plain, compressed, legacy, legacy.encode("utf-8")):
+            # 任一配置都能按格式头读取其他格式写入的数据
+            assert Serializer().loads(payload) == data
+            assert Serializer(compression="gzip").loads(payload) == data
+
+    def test_unknown_format_rejected(self):
+        """测试未知的编码、压缩方式和格式头报错"""
+        from services.serializer import MAGIC, Serializer, SerializationError
+
+        with pytest.raises(SerializationError):
+            Serializer(codec="yaml")
+        with pytest.raises(SerializationError):
+            Serializer(compression="lzma")
+        with pytest.raises(SerializationError):
+            Serializer().loads(MAGIC + bytes((1, 9, 0)) + b"{}")
+
+    @pytest.mark.asyncio
+    async def test_storage_reads_files_after_format_change(self, tmp_path):
+        """测试切换存储格式后仍能读取旧格式的文件"""
+        from services.storage_service import StorageService
+        from services.serializer import Serializer
+
+        await StorageService(str(tmp_path)).save_session("s1", {"summary": "递归"})
+        storage = StorageService(str(tmp_path), engine="journal", serializer=Serializer(compression="gzip"))
+        assert (await storage.load_session("s1"))["summary"] == "递归"
+
+        await storage.save_session("s1", {"summary": "动态规划"})
+        assert (await StorageService(str(tmp_path), engine="journal").load_session("s1"))["summary"] == "动态规划"
+
+
+class TestBackupStore:
+    def test_chunking_is_content_defined(self):
+        """测试局部修改只影响附近的分块"""
+        import random
+        from services.backup_store import chunk_boundaries
+
+        rng = random.Random(7)
+        data = bytes(rng.getrandbits(8) for _ in range(200000))
+        edited = data[:100000] + b"inserted" + data[100000:]
+
+        def chunks(payload):
+            starts = [0] + chunk_boundaries(payload)
+            return [payload[a:b] for a, b in zip(starts, starts[1:])]
+
+        original = chunks(data)
+        assert b"".join(original) == data
+        assert len(set(chunks(edited)) - set(original)) <= 2
+
+    @pytest.mark.asyncio
+    async def test_incremental_backup_restore_and_gc(self, tmp_path):
+        """测试重复备份不新增分块、还原指定备份以及回收旧备份"""
+        from services.storage_service import StorageService
+
+        storage = StorageService(str(tmp_path))
+        graph = {"id": "root", "children": [{"id": f"n{i}", "content": f"笔记{i}" * 200} for i in range(50)]}
+        await storage.save_knowledge_graph("alice", graph)
+        await storage.save_session("alice", {"summary": "递归"})
+
+        assert await storage.backup_user_data("alice")
+        first_id = storage.backups.list_backups("alice")[0]
+        chunk_count = storage.backups.stats()["chunks"]
+        assert await storage.backup_user_data("alice")
+        assert storage.backups.stats()["chunks"] == chunk_count
+
+        graph["children"][10]["content"] = "修改后的笔记"
+        await storage.save_knowledge_graph("alice", graph)
+        assert await storage.backup_user_data("alice")
+        assert chunk_count < storage.backups.stats()["chunks"] <= chunk_count + 3
+
+        assert await storage.restore_user_data("alice", first_id)
+        restored = await storage.load_knowledge_graph("alice")
+        assert restored["children"][10]["content"] == "笔记10" * 200
+        assert (await storage.load_session("alice"))["summary"] == "递归"
+
+        storage.backups.grace_seconds = 0
+        result = await storage.gc_backups(keep_last=1)
+        assert result["removed_manifests"] == 2
+        assert result["removed_chunks"] >= 1
+        latest = storage.backups.restore("alice")
+        assert latest["knowledge_graph"]["children"][10]["content"] == "修改后的笔记"
@@ -26,7 +26,9 @@ def get_ai_tutor_service():
             neo4j_uri=settings.NEO4J_URI,
             neo4j_user=settings.NEO4J_USER,
             neo4j_password=settings.NEO4J_PASSWORD,
-            deepseek_key=settings.DEEPSEEK_API_KEY
+            deepseek_key=settings.DEEPSEEK_API_KEY,
+            breaker_failure_threshold=settings.AI_BREAKER_FAILURE_THRESHOLD,
+            breaker_recovery_timeout=settings.AI_BREAKER_RECOVERY_TIMEOUT
         )
     return ai_tutor_service
 
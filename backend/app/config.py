@@ -38,6 +38,8 @@ class Settings(BaseSettings):
 
     # 性能配置
     AI_REQUEST_TIMEOUT: int = 30
+    AI_BREAKER_FAILURE_THRESHOLD: int = 5  # 连续失败次数达到后熔断
+    AI_BREAKER_RECOVERY_TIMEOUT: int = 30  # 熔断后多少秒开始探测恢复
     MAX_CONVERSATION_HISTORY: int = 10
     CACHE_TTL: int = 300  # 5分钟
 
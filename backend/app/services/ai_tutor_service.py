@@ -6,6 +6,8 @@ from neo4j import GraphDatabase
 from sqlalchemy.orm import Session
 from app.models.user import User
 from app.database import get_db
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.history_packer import estimate_tokens, pack_messages
 import logging
 import time
 
@@ -15,7 +17,10 @@ logger = logging.getLogger("ai_tutor")
 
 
 class DeepSeekAITutorService:
-    def __init__(self, neo4j_uri: str, neo4j_user: str, neo4j_password: str, deepseek_key: str):
+    FALLBACK_REPLY = "抱歉，AI导师暂时无法响应，请稍后重试。"
+
+    def __init__(self, neo4j_uri: str, neo4j_user: str, neo4j_password: str, deepseek_key: str,
+                 breaker_failure_threshold: int = 5, breaker_recovery_timeout: float = 30.0):
         self.neo4j_driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password))
         self.api_key = deepseek_key
         self.api_base = "https://api.deepseek.com/v1"
@@ -31,8 +36,17 @@ class DeepSeekAITutorService:
         self.total_tokens = 0
         self.error_count = 0
 
+        # 上游故障时熔断，直接返回降级回复而不是等待超时
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=breaker_failure_threshold,
+            recovery_timeout=breaker_recovery_timeout
+        )
+
     async def call_deepseek_api(self, messages: List[Dict], max_tokens: int = 1000, temperature: float = 0.7):
         """调用DeepSeek API"""
+        if not self.circuit_breaker.allow_request():
+            return self.FALLBACK_REPLY
+
         start_time = time.time()
         self.call_count += 1
 
@@ -53,14 +67,38 @@ class DeepSeekAITutorService:
                     headers=self.headers,
                     json=payload
                 )
+            except httpx.TransportError as e:
+                # 网络错误和超时说明上游不可用，计入熔断
+                self.error_count += 1
+                self.circuit_breaker.record_failure()
+                logger.error(f"DeepSeek API调用失败: {e}")
+                return self.FALLBACK_REPLY
+            except asyncio.CancelledError:
+                # 客户端断开不是上游故障，只归还半开状态的探测名额
+                self.circuit_breaker.release()
+                raise
+            except Exception as e:
+                # 其他异常同样没有拿到上游结果，必须记录结果以免探测名额一直被占用
+                self.error_count += 1
+                self.circuit_breaker.record_failure()
+                logger.error(f"DeepSeek API调用失败: {e}")
+                return self.FALLBACK_REPLY
+
+            # 只有限流和服务端错误计入熔断；其他4xx是请求本身的问题，上游仍然可用
+            if response.status_code == 429 or response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+            try:
                 response.raise_for_status()
                 result = response.json()
 
                 content = result["choices"][0]["message"]["content"]
 
                 # 统计Token使用
-                input_tokens = sum(len(msg["content"]) for msg in messages) / 1.5
-                output_tokens = len(content) / 1.5
+                input_tokens = sum(estimate_tokens(msg["content"]) for msg in messages)
+                output_tokens = estimate_tokens(content)
                 self.total_tokens += input_tokens + output_tokens
 
                 duration = time.time() - start_time
@@ -71,7 +109,7 @@ class DeepSeekAITutorService:
             except Exception as e:
                 self.error_count += 1
                 logger.error(f"DeepSeek API调用失败: {e}")
-                return "抱歉，AI导师暂时无法响应，请稍后重试。"
+                return self.FALLBACK_REPLY
 
     async def process_user_message(self, user_id: int, message: str, conversation_history: List[Dict]) -> Dict[
         str, Any]:
@@ -161,11 +199,16 @@ class DeepSeekAITutorService:
         else:
             return {"type": "CHAT", "keywords": [], "confidence": 0.5, "reason": "默认分类"}
 
-    def _optimize_history(self, history: List[Dict], max_messages: int = 10) -> List[Dict]:
-        """优化对话历史，控制Token数量"""
-        if len(history) <= max_messages:
-            return history
-        return history[-max_messages:]
+    def _optimize_history(self, history: List[Dict], max_tokens: int = 1500,
+                          max_messages: int = 10) -> List[Dict]:
+        """优化对话历史，控制Token数量
+
+        从最新的消息开始按token预算装填，超长的单条消息会被截断。
+        """
+        packed, used_tokens = pack_messages(history[-max_messages:], max_tokens,
+                                            max_message_tokens=max_tokens // 2)
+        logger.debug(f"对话历史装填: {len(packed)}/{len(history)} 条, 约 {used_tokens} tokens")
+        return packed
 
     async def _handle_knowledge_search(self, user_id: int, message: str, intent: Dict) -> Dict[str, Any]:
         """处理知识点搜索"""
@@ -691,7 +734,8 @@ class DeepSeekAITutorService:
             "total_calls": self.call_count,
             "estimated_tokens": int(self.total_tokens),
             "error_count": self.error_count,
-            "success_rate": (self.call_count - self.error_count) / max(self.call_count, 1) * 100
+            "success_rate": (self.call_count - self.error_count) / max(self.call_count, 1) * 100,
+            "circuit_breaker": self.circuit_breaker.get_stats()
         }
 
     def close(self):
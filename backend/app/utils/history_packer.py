@@ -0,0 +1,89 @@
+# NAVI/backend/services/history_packer.py 的精简版：两个后端分别部署，没有共享的包，
+# 这里只保留 EduPath 用到的 token 估算和历史装填。估算系数需与 NAVI 保持一致。
+import math
+from typing import Dict, List, Optional, Tuple
+
+# DeepSeek分词器的经验值：1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+# 每条消息的角色标记等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+# 剩余预算低于该值时不再截断装入
+MIN_TRUNCATED_TOKENS = 32
+
+TRUNCATION_MARKER = "……（已截断）"
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or
+            0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF)
+
+
+def _char_cost(char: str) -> float:
+    if char.isspace():
+        return 0.0 if char == " " else OTHER_TOKENS_PER_CHAR
+    return CJK_TOKENS_PER_CHAR if _is_cjk(char) else OTHER_TOKENS_PER_CHAR
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数（中英文混合）"""
+    if not text:
+        return 0
+    return math.ceil(sum(_char_cost(char) for char in text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本使其不超过 max_tokens，保留开头部分"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARKER)
+    used = 0.0
+    for index, char in enumerate(text):
+        used += _char_cost(char)
+        if used > budget:
+            return text[:index] + TRUNCATION_MARKER
+    return text
+
+
+def pack_messages(messages: List[Dict],
+                  budget: int,
+                  max_message_tokens: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """按token预算从最新到最旧装填对话消息
+
+    Args:
+        messages: 按时间顺序排列的消息（role/content）
+        budget: 可用的token预算
+        max_message_tokens: 单条消息的上限，超出部分被截断
+
+    Returns:
+        (按时间顺序排列的装填结果, 使用的token数)
+    """
+    packed = []
+    used = 0
+
+    for message in reversed(messages):
+        content = message.get("content", "")
+        if not content:
+            continue
+
+        if max_message_tokens is not None:
+            content = truncate_to_tokens(content, max_message_tokens)
+
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        remaining = budget - used
+        if cost > remaining:
+            # 预算不足以装入整条消息：剩余足够时截断装入，然后停止
+            if remaining - MESSAGE_OVERHEAD_TOKENS >= MIN_TRUNCATED_TOKENS:
+                content = truncate_to_tokens(content, remaining - MESSAGE_OVERHEAD_TOKENS)
+                cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+                packed.append({**message, "content": content})
+                used += cost
+            break
+
+        packed.append({**message, "content": content})
+        used += cost
+
+    packed.reverse()
+    return packed, used
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import ai_tutor_service
+from app.services.ai_tutor_service import DeepSeekAITutorService
+from app.utils.circuit_breaker import CircuitBreaker
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+def ok_response(request):
+    return httpx.Response(200, json={"choices": [{"message": {"content": "回复"}}]})
+
+
+def server_error(request):
+    return httpx.Response(503, json={"error": "unavailable"})
+
+
+@pytest.fixture
+def tutor():
+    return DeepSeekAITutorService(
+        "bolt://localhost:7687", "neo4j", "password", "test-key",
+        breaker_failure_threshold=1, breaker_recovery_timeout=60.0
+    )
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """把 DeepSeek 请求交给可替换的处理函数，并记录调用次数"""
+    state = {"handler": ok_response, "calls": 0}
+    real_client = httpx.AsyncClient
+
+    async def handle(request):
+        state["calls"] += 1
+        response = state["handler"](request)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+    monkeypatch.setattr(
+        ai_tutor_service.httpx, "AsyncClient",
+        lambda **kwargs: real_client(transport=httpx.MockTransport(handle), **kwargs)
+    )
+    return state
+
+
+class TestCircuitBreakerWiring:
+    def test_open_breaker_returns_fallback(self, tutor, upstream):
+        """测试上游失败后熔断器打开，之后的请求不再访问上游"""
+        upstream["handler"] = server_error
+        assert asyncio.run(tutor.call_deepseek_api(MESSAGES)) == tutor.FALLBACK_REPLY
+        assert tutor.circuit_breaker.state == CircuitBreaker.OPEN
+
+        upstream["handler"] = ok_response
+        assert asyncio.run(tutor.call_deepseek_api(MESSAGES)) == tutor.FALLBACK_REPLY
+        assert upstream["calls"] == 1
+        assert tutor.circuit_breaker.rejected_count == 1
+
+    def test_half_open_probe_closes_breaker(self, tutor, upstream):
+        """测试半开状态的探测请求成功后熔断器恢复关闭"""
+        tutor.circuit_breaker.recovery_timeout = 0.0
+        upstream["handler"] = server_error
+        asyncio.run(tutor.call_deepseek_api(MESSAGES))
+        assert tutor.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+
+        upstream["handler"] = ok_response
+        assert asyncio.run(tutor.call_deepseek_api(MESSAGES)) == "回复"
+        assert tutor.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    def test_unexpected_error_returns_fallback_and_records_failure(self, tutor, upstream):
+        """测试非网络异常同样返回降级回复并计入熔断"""
+        def broken(request):
+            raise httpx.DecodingError("bad encoding")
+
+        upstream["handler"] = broken
+        assert asyncio.run(tutor.call_deepseek_api(MESSAGES)) == tutor.FALLBACK_REPLY
+        assert tutor.circuit_breaker.state == CircuitBreaker.OPEN
+
+    def test_cancellation_not_counted(self, tutor, upstream):
+        """测试请求被取消时只归还探测名额，不计为上游失败"""
+        tutor.circuit_breaker.recovery_timeout = 0.0
+        upstream["handler"] = server_error
+        asyncio.run(tutor.call_deepseek_api(MESSAGES))
+        failures = tutor.circuit_breaker.get_stats()["consecutive_failures"]
+
+        async def hang(request):
+            await asyncio.sleep(10)
+
+        async def cancel_call():
+            task = asyncio.create_task(tutor.call_deepseek_api(MESSAGES))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        upstream["handler"] = hang
+        asyncio.run(cancel_call())
+
+        assert tutor.circuit_breaker.get_stats()["consecutive_failures"] == failures
+        assert tutor.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+        assert tutor.circuit_breaker.allow_request()